@@ -0,0 +1,176 @@
+import sys
+import argparse
+import subprocess
+
+from twisted.internet import defer, reactor, task
+from twisted.web import server
+
+from tests.fakensone import FakeNsoneApi, LocalNsoneImporter, localClient
+
+
+# the first pass creates every zone and record, the second finds them and merges answers
+PASSES = ('create', 'merge')
+
+
+def zoneData(zones, records):
+    """
+    Returns the synthetic data of the benchmark, every record has two answers
+
+    Args:
+        zones (int): Number of zones
+        records (int): Records per zone
+
+    Returns:
+        list: (zone name, records) tuples
+    """
+
+    data = []
+    for zoneNumber in xrange(zones):
+        rows = []
+        for recordNumber in xrange(records):
+            for answer in (1, 2):
+                rows.append({'Name': 'host{}'.format(recordNumber), 'Type': 'A', 'TTL': '300',
+                             'Data': '10.{}.{}.{}'.format(zoneNumber % 256, recordNumber % 256,
+                                                           answer)})
+        data.append(('zone{}.bench.test'.format(zoneNumber), rows))
+    return data
+
+
+def summaryOnly():
+    """Returns a progress callback printing only the run summary"""
+
+    state = {'summary': False}
+
+    def progress(message):
+        if message == 'Summary:':
+            state['summary'] = True
+        if state['summary']:
+            print message
+    return progress
+
+
+def runThreads(args, endpoint):
+    """Imports the synthetic data with the threads engine, creating and then merging"""
+
+    # requests and futures are only needed by the threads engine
+    import threadedimporter
+
+    class BenchThreadedImporter(threadedimporter.ThreadedImporter):
+        """The threads engine pointed at the fake api"""
+
+        def _createClient(self, apiKey):
+            return localClient(apiKey, threadedimporter.SESSION_TRANSPORT, endpoint)
+
+    for title in PASSES:
+        print 'threads {} pass:'.format(title)
+        importer = BenchThreadedImporter('benchkey', iter(zoneData(args.zones, args.records)),
+                                         False, args.concurrency, progress=summaryOnly())
+        importer.run()
+
+
+@defer.inlineCallbacks
+def runTwisted(reactor, args, endpoint):
+    """Imports the synthetic data with the twisted engine, creating and then merging"""
+
+    for title in PASSES:
+        print 'twisted {} pass:'.format(title)
+        importer = LocalNsoneImporter(endpoint, 'benchkey', iter(zoneData(args.zones, args.records)),
+                                      False, progress=summaryOnly(), concurrency=args.concurrency)
+        yield importer.start()
+
+
+def runEngine(args):
+    """Runs both passes of one engine against the fake api on args.port"""
+
+    endpoint = 'http://127.0.0.1:{}/v1/'.format(args.port)
+    if args.run == 'threads':
+        runThreads(args, endpoint)
+    else:
+        task.react(runTwisted, (args, endpoint))
+
+
+def serveFakeApi(latency):
+    """Serves the fake api on a free local port and prints the port"""
+
+    port = reactor.listenTCP(0, server.Site(FakeNsoneApi(latency)), interface='127.0.0.1')
+    print port.getHost().port
+    sys.stdout.flush()
+    reactor.run()
+
+
+def compareEngines(args):
+    """Runs every engine against its own fresh fake api in separate processes"""
+
+    engines = ['twisted', 'threads'] if args.engine == 'both' else [args.engine]
+    print 'Benchmark: {} zones x {} records x 2 answers, {}s latency, -c {}'.format(
+        args.zones, args.records, args.latency, args.concurrency)
+    for engine in engines:
+        api = subprocess.Popen([sys.executable, __file__, '--serve-fake-api',
+                                '--latency', str(args.latency)], stdout=subprocess.PIPE)
+        try:
+            port = api.stdout.readline().strip()
+            subprocess.check_call([sys.executable, __file__, '--run', engine, '--port', port,
+                                   '--zones', str(args.zones), '--records', str(args.records),
+                                   '-c', str(args.concurrency)])
+        finally:
+            api.terminate()
+            api.wait()
+
+
+def getArgs():
+    """Reads the benchmark arguments from the command line"""
+
+    parser = argparse.ArgumentParser(
+        description='Compare the twisted and threads engines against a local fake NS1 api')
+    parser.add_argument("--engine",
+                        dest="engine",
+                        choices=('twisted', 'threads', 'both'),
+                        default='both',
+                        help="The engines to run")
+    parser.add_argument("--zones",
+                        dest="zones",
+                        type=int,
+                        default=200,
+                        metavar="N",
+                        help="Number of zones")
+    parser.add_argument("--records",
+                        dest="records",
+                        type=int,
+                        default=10,
+                        metavar="N",
+                        help="Records per zone")
+    parser.add_argument("--latency",
+                        dest="latency",
+                        type=float,
+                        default=0.02,
+                        metavar="SECONDS",
+                        help="Delay of every response of the fake api")
+    parser.add_argument("-c", "--concurrency",
+                        dest="concurrency",
+                        type=int,
+                        default=20,
+                        metavar="N",
+                        help="Zones processed by the twisted engine and threads of the threads engine")
+    parser.add_argument("--serve-fake-api",
+                        dest="serveFakeApi",
+                        action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--run",
+                        dest="run",
+                        choices=('twisted', 'threads'),
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--port",
+                        dest="port",
+                        type=int,
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    benchmarkArgs = getArgs()
+    if benchmarkArgs.serveFakeApi:
+        serveFakeApi(benchmarkArgs.latency)
+    elif benchmarkArgs.run:
+        runEngine(benchmarkArgs)
+    else:
+        compareEngines(benchmarkArgs)
@@ -0,0 +1,389 @@
+import os.path
+import csv
+import json
+import mmap
+import cStringIO
+import multiprocessing
+from collections import OrderedDict
+
+from parsecache import fileSha1
+
+
+def _iterLines(data, offsets):
+    """
+    Yields the lines of a chunk one at a time and appends the byte offset
+    reached after each line, so the caller knows exactly where every csv row
+    ends even when quoted fields span several lines.
+
+    Args:
+        data (str): The raw bytes of the chunk
+        offsets (list): Receives the running offset after each line
+    """
+
+    consumed = 0
+    for line in cStringIO.StringIO(data):
+        consumed += len(line)
+        offsets.append(consumed)
+        yield line
+
+
+def _parseChunk(job):
+    """
+    Worker entry point. Parses one row aligned chunk of the csv.
+
+    This is a module level function so it can be pickled by multiprocessing.
+    Every worker maps the file itself instead of receiving the bytes
+    through a pipe.
+
+    The byte ranges of every zone are always recorded so the index stays
+    complete, but only rows selected by the zone filter are materialized.
+
+    Args:
+        job (tuple): (filename, fieldnames, start, end, zoneFilter)
+
+    Returns:
+        tuple: (zone data dict, ordered zone -> list of [start, end] byte ranges)
+    """
+
+    filename, fieldnames, start, end, zoneFilter = job
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            data = mm[start:end]
+        finally:
+            mm.close()
+
+    zones = OrderedDict()
+    ranges = OrderedDict()
+    offsets = []
+    rowStart = 0
+    for row in csv.DictReader(_iterLines(data, offsets), fieldnames=fieldnames):
+        rowEnd = offsets[-1]
+        zoneName = row['Zone']
+        if zoneFilter is None or zoneFilter.matchesRow(zoneName, row['Type']):
+            record = {
+                'Data': row['Data'],
+                'Type': row['Type'],
+                'Name': row['Name'],
+                'TTL': row['TTL']
+            }
+            if row.get('Action'):
+                record['Action'] = row['Action']
+            zones.setdefault(zoneName, []).append(record)
+
+        # consecutive rows of the same zone collapse into a single range
+        zoneRanges = ranges.setdefault(zoneName, [])
+        if zoneRanges and zoneRanges[-1][1] == start + rowStart:
+            zoneRanges[-1][1] = start + rowEnd
+        else:
+            zoneRanges.append([start + rowStart, start + rowEnd])
+        rowStart = rowEnd
+    return zones, ranges
+
+
+class CsvIndexReader(object):
+    """
+    Memory mapped csv reader that splits the file into row aligned chunks,
+    parses them in parallel worker processes and keeps a zone -> byte offset
+    index next to the file so single zones can be read back without a full pass.
+
+    Attributes:
+        filename (str): Absolute path of the csv file
+        workers (int): Number of worker processes used for parsing
+        chunkSize (int): Approximate size in bytes of every chunk
+        indexFilename (str): Path of the on disk index
+    """
+
+    INDEX_VERSION = 3
+    FIELDS = {'Name', 'Zone', 'Type', 'TTL', 'Data'}
+
+
+    def __init__(self, filename, workers=None, chunkSize=4 * 1024 * 1024):
+        """
+        Args:
+            filename (str): The csv file
+            workers (int): Worker processes, defaults to the cpu count
+            chunkSize (int): Approximate chunk size in bytes
+        """
+
+        self.filename = os.path.abspath(filename)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunkSize = chunkSize
+        self.indexFilename = self.filename + '.idx'
+
+
+    def _rowEnd(self, mm, start, end, quotes=0):
+        """
+        Returns the offset just past the first row boundary at or after end.
+
+        A newline only ends a row when the number of quote characters seen
+        since start is even. Escaped quotes ("") always come in pairs so
+        they never change the parity.
+
+        Args:
+            mm (mmap.mmap): The mapped file
+            start (int): Offset of a known row boundary
+            end (int): Offset to start looking for the next boundary
+            quotes (int): Quote characters already counted in [start, end)
+
+        Returns:
+            int
+        """
+
+        size = mm.size()
+        while end < size:
+            newline = mm.find('\n', end)
+            if newline == -1:
+                return size
+            quotes += mm[end:newline + 1].count('"')
+            end = newline + 1
+            if quotes % 2 == 0:
+                return end
+        return size
+
+
+    def _chunks(self, mm, start):
+        """
+        Splits [start, size) into row aligned (start, end) chunks of roughly chunkSize bytes
+
+        Args:
+            mm (mmap.mmap): The mapped file
+            start (int): Offset of the first data row
+
+        Returns:
+            list
+        """
+
+        size = mm.size()
+        chunks = []
+        while start < size:
+            end = min(start + self.chunkSize, size)
+            quotes = mm[start:end].count('"')
+            if quotes % 2 == 0 and (end == size or mm[end - 1] == '\n'):
+                nextStart = end
+            else:
+                nextStart = self._rowEnd(mm, start, end, quotes)
+            chunks.append((start, nextStart))
+            start = nextStart
+        return chunks
+
+
+    def _readHeader(self, mm):
+        """
+        Parses the header row and validates it
+
+        Args:
+            mm (mmap.mmap): The mapped file
+
+        Returns:
+            tuple: (fieldnames, offset of the first data row)
+        """
+
+        headerEnd = self._rowEnd(mm, 0, 0)
+        fieldnames = next(csv.reader([mm[0:headerEnd]]), [])
+        fieldnames = [field.strip() for field in fieldnames]
+        if not self.FIELDS.issubset(set(fieldnames)):
+            import sys
+            fieldStr = ', '.join(field for field in self.FIELDS)
+            sys.exit('CSV must have the following header: {}'.format(fieldStr))
+        return fieldnames, headerEnd
+
+
+    def _stat(self):
+        """
+        Returns the size and content sha1 used to detect a stale index.
+
+        The mtime is not used, a file rewritten within the same second or
+        with a preserved mtime would otherwise keep its old byte offsets.
+        """
+
+        return os.path.getsize(self.filename), fileSha1(self.filename)
+
+
+    def _writeIndex(self, fieldnames, ranges):
+        """
+        Writes the zone -> byte ranges index next to the csv file, with the
+        zone names in the order they first appear in the file.
+        The index is written to a temporary file first and renamed so
+        a concurrent reader never sees a half written index.
+        """
+
+        size, sha1 = self._stat()
+        index = {
+            'version': self.INDEX_VERSION,
+            'size': size,
+            'sha1': sha1,
+            'fieldnames': fieldnames,
+            'zoneNames': ranges.keys(),
+            'zones': ranges
+        }
+        tmpFilename = self.indexFilename + '.tmp'
+        try:
+            with open(tmpFilename, 'wb') as f:
+                json.dump(index, f)
+            os.rename(tmpFilename, self.indexFilename)
+        except (IOError, OSError) as e:
+            # the index is an optimization, an unwritable directory is not fatal
+            print 'Could not write index {}: {}'.format(self.indexFilename, e)
+
+
+    def loadIndex(self):
+        """
+        Returns the on disk index or None if it is missing or stale.
+        Names are turned back into utf-8 str like the csv module returns them.
+
+        Returns:
+            dict
+        """
+
+        if not os.path.exists(self.indexFilename):
+            return None
+        try:
+            with open(self.indexFilename, 'rb') as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        # the size is checked first so most changes are caught without hashing the file
+        if (index.get('version') != self.INDEX_VERSION or
+                index.get('size') != os.path.getsize(self.filename) or
+                index.get('sha1') != fileSha1(self.filename)):
+            return None
+        index['fieldnames'] = [field.encode('utf-8') for field in index['fieldnames']]
+        index['zoneNames'] = [zoneName.encode('utf-8') for zoneName in index['zoneNames']]
+        index['zones'] = {zoneName.encode('utf-8'): spans
+                          for zoneName, spans in index['zones'].iteritems()}
+        return index
+
+
+    def parse(self, zoneFilter=None):
+        """
+        Parses the whole file in parallel and writes the zone index.
+
+        Chunks are handed to a pool of worker processes and the partial
+        results are merged back in file order, so the records of every zone
+        keep the order they have in the csv.
+
+        Args:
+            zoneFilter (zonefilter.ZoneFilter): Optional row selection
+
+        Returns:
+            OrderedDict: zone name -> list of records, in the order the zones first appear
+        """
+
+        with open(self.filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return OrderedDict()
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                fieldnames, dataStart = self._readHeader(mm)
+                chunks = self._chunks(mm, dataStart)
+            finally:
+                mm.close()
+
+        jobs = [(self.filename, fieldnames, start, end, zoneFilter)
+                for start, end in chunks]
+        if self.workers > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(min(self.workers, len(jobs)))
+            try:
+                results = pool.imap(_parseChunk, jobs)
+                data, ranges = self._merge(results)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            data, ranges = self._merge(_parseChunk(job) for job in jobs)
+
+        self._writeIndex(fieldnames, ranges)
+        return data
+
+
+    def _merge(self, results):
+        """
+        Merges the per chunk results in order
+
+        Args:
+            results (iterable): (zones, ranges) tuples as returned by _parseChunk
+
+        Returns:
+            tuple: (zone data dict, ordered zone ranges dict)
+        """
+
+        data = OrderedDict()
+        ranges = OrderedDict()
+        for zones, zoneRanges in results:
+            for zoneName, records in zones.iteritems():
+                data.setdefault(zoneName, []).extend(records)
+            for zoneName, spans in zoneRanges.iteritems():
+                merged = ranges.setdefault(zoneName, [])
+                for span in spans:
+                    if merged and merged[-1][1] == span[0]:
+                        merged[-1][1] = span[1]
+                    else:
+                        merged.append(span)
+        return data, ranges
+
+
+    def zoneNames(self, index=None):
+        """
+        Returns the zone names in the order they first appear in the file,
+        or None without a usable index
+
+        Args:
+            index (dict): A previously loaded index
+
+        Returns:
+            list
+        """
+
+        index = index or self.loadIndex()
+        if index is None:
+            return None
+        return index['zoneNames']
+
+
+    def readZones(self, zoneNames, index=None, zoneFilter=None):
+        """
+        Reads only the rows of the given zones by seeking to their byte ranges.
+        Zones that are not in the index are skipped.
+
+        Args:
+            zoneNames (iterable): The zones to read
+            index (dict): A previously loaded index
+            zoneFilter (zonefilter.ZoneFilter): Optional record type selection
+
+        Yields:
+            tuple: (zone name, list of records)
+        """
+
+        index = index or self.loadIndex()
+        if index is None:
+            raise ValueError('No usable index for {}'.format(self.filename))
+
+        with open(self.filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for zoneName in zoneNames:
+                    spans = index['zones'].get(zoneName)
+                    if not spans:
+                        continue
+                    records = []
+                    for start, end in spans:
+                        reader = csv.DictReader(cStringIO.StringIO(mm[start:end]),
+                                                fieldnames=index['fieldnames'])
+                        for row in reader:
+                            if zoneFilter is not None and not zoneFilter.matchesType(row['Type']):
+                                continue
+                            record = {
+                                'Data': row['Data'],
+                                'Type': row['Type'],
+                                'Name': row['Name'],
+                                'TTL': row['TTL']
+                            }
+                            if row.get('Action'):
+                                record['Action'] = row['Action']
+                            records.append(record)
+                    if records:
+                        yield zoneName, records
+            finally:
+                mm.close()
@@ -0,0 +1,357 @@
+import re
+import hmac
+import json
+import os.path
+import time
+from collections import OrderedDict
+
+from twisted.internet import defer, endpoints, reactor, threads
+from twisted.web import resource, server
+
+from nsoneimporter import NsoneImporter
+from pooledtransport import getRateLimiter, setRateLimit
+from singleflight import SingleFlight
+from zonedataparser import ZoneDataParser
+from zonefilter import ZoneFilter
+
+
+class ImportJob(object):
+    """
+    One import, delete or sync request submitted to the ImportService
+
+    Attributes:
+        jobId (int): The job id
+        action (str): 'import', 'delete' or 'sync'
+        filename (str): The zone data file
+        apiKey (str): The Nsone Api Key the job runs with
+        zoneFilter (zonefilter.ZoneFilter): Optional zone and type selection
+        status (str): queued, parsing, running, done or failed
+        lines (list): Every progress message of the job
+        listeners (list): Requests streaming the progress of the job
+    """
+
+
+    def __init__(self, jobId, action, filename, apiKey, zoneFilter=None):
+        self.jobId = jobId
+        self.action = action
+        self.filename = filename
+        self.apiKey = apiKey
+        self.zoneFilter = zoneFilter
+        self.status = 'queued'
+        self.lines = []
+        self.listeners = []
+        self.created = time.time()
+        self.finished = None
+
+
+    def log(self, message):
+        """
+        Records a progress message and streams it to every listener
+
+        Args:
+            message (str): The message
+        """
+
+        self.lines.append(message)
+        for request in self.listeners:
+            request.write(message + '\n')
+
+
+    def finish(self, status):
+        """
+        Marks the job as finished and closes the progress streams
+
+        Args:
+            status (str): done or failed
+        """
+
+        self.status = status
+        self.finished = time.time()
+        self.log('Job {} {}'.format(self.jobId, status))
+        listeners, self.listeners = self.listeners, []
+        for request in listeners:
+            request.finish()
+
+
+    def toDict(self):
+        """Returns the json representation of the job"""
+
+        return {
+            'id': self.jobId,
+            'action': self.action,
+            'file': self.filename,
+            'status': self.status,
+            'created': self.created,
+            'finished': self.finished,
+            'messages': len(self.lines)
+        }
+
+
+class ImportService(resource.Resource):
+    """
+    Long running import service.
+
+    Jobs are submitted over a small http api, served on tcp or on a unix
+    socket, and run concurrently on one reactor. All of them share the
+    persistent connection pool and rate limiters of the pooled transport,
+    and one zone cache, so later jobs skip creating zones that earlier jobs
+    already created or loaded.
+
+    API:
+        POST /jobs                 {"action": "import", "file": "/path/ZoneData.csv",
+                                    "apikey": "...", "zones": [], "types": [],
+                                    "match": [], "regex": []}
+        GET  /jobs                 list of jobs
+        GET  /jobs/<id>            status of one job
+        GET  /jobs/<id>/progress   streams the progress messages until the job finishes
+
+    A sync job is an import that ignores the zone cache and refreshes it.
+
+    With a token every request has to send it as "Authorization: Bearer <token>".
+    Jobs may only read files below dataDir.
+
+    Attributes:
+        apiKey (str): Default Nsone Api Key for jobs that do not pass one
+        workers (int): Parser processes per job
+        rate (float): Requests per second per api key, None for no limit
+        token (str): The token clients have to send, None for no authentication
+        dataDir (str): The directory the files of the jobs have to be in
+        jobs (OrderedDict): job id -> ImportJob
+        zoneCache (dict): Zone cache shared by every job
+        singleFlight (SingleFlight): Zone and record loads shared by every job
+        recordLocks (dict): Record locks shared by every job, so concurrent jobs
+            never merge into the same record at the same time
+    """
+
+    isLeaf = True
+    ACTIONS = ('import', 'delete', 'sync')
+
+
+    def __init__(self, apiKey=None, workers=1, rate=None, token=None, dataDir=None):
+        """
+        Args:
+            apiKey (str): Default Nsone Api Key
+            workers (int): Parser processes per job
+            rate (float): Requests per second per api key
+            token (str): The token clients have to send
+            dataDir (str): The directory of the job files, defaults to the working directory
+        """
+
+        resource.Resource.__init__(self)
+        self.apiKey = apiKey
+        self.workers = workers
+        self.rate = rate
+        self.token = token
+        self.dataDir = os.path.realpath(dataDir or os.getcwd())
+        self.jobs = OrderedDict()
+        self.zoneCache = {}
+        self.singleFlight = SingleFlight()
+        self.recordLocks = {}
+        self._nextId = 1
+
+
+    def _json(self, request, body, code=200):
+        """Writes a json response"""
+
+        request.setResponseCode(code)
+        request.setHeader('content-type', 'application/json')
+        return json.dumps(body)
+
+
+    def _job(self, jobId):
+        """Returns the job with id jobId or None"""
+
+        try:
+            return self.jobs.get(int(jobId))
+        except ValueError:
+            return None
+
+
+    def render(self, request):
+        """Rejects requests without the token before they are dispatched"""
+
+        if self.token is not None:
+            scheme, _, token = (request.getHeader('authorization') or '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip(), self.token):
+                request.setHeader('www-authenticate', 'Bearer')
+                return self._json(request, {'error': 'unauthorized'}, 401)
+        return resource.Resource.render(self, request)
+
+
+    def render_GET(self, request):
+        """Serves the job list, the job status and the progress streams"""
+
+        path = [segment for segment in request.postpath if segment]
+        if path == ['jobs']:
+            return self._json(request, [job.toDict() for job in self.jobs.itervalues()])
+        if len(path) in (2, 3) and path[0] == 'jobs':
+            job = self._job(path[1])
+            if job is None:
+                return self._json(request, {'error': 'no such job'}, 404)
+            if len(path) == 2:
+                return self._json(request, job.toDict())
+            if path[2] == 'progress':
+                return self._streamProgress(request, job)
+        return self._json(request, {'error': 'not found'}, 404)
+
+
+    def _streamProgress(self, request, job):
+        """
+        Replays the messages of the job and keeps the response open until it finishes
+
+        Args:
+            request (twisted.web.server.Request): The request
+            job (ImportJob): The job
+        """
+
+        request.setHeader('content-type', 'text/plain')
+        for line in job.lines:
+            request.write(line + '\n')
+        if job.finished is not None:
+            request.finish()
+            return server.NOT_DONE_YET
+        job.listeners.append(request)
+        request.notifyFinish().addErrback(self._dropListener, job, request)
+        return server.NOT_DONE_YET
+
+
+    def _dropListener(self, failure, job, request):
+        """Stops streaming to a client that went away"""
+
+        if request in job.listeners:
+            job.listeners.remove(request)
+
+
+    def render_POST(self, request):
+        """Submits a job"""
+
+        if [segment for segment in request.postpath if segment] != ['jobs']:
+            return self._json(request, {'error': 'not found'}, 404)
+        try:
+            body = json.loads(request.content.read())
+            job = self.submit(body.get('action', 'import'), body.get('file'),
+                              body.get('apikey'), self._zoneFilter(body))
+        except (ValueError, TypeError, AttributeError, re.error) as e:
+            return self._json(request, {'error': str(e)}, 400)
+        return self._json(request, job.toDict(), 201)
+
+
+    def _zoneFilter(self, body):
+        """Builds the zone filter of a job request or returns None"""
+
+        zoneFilter = ZoneFilter(body.get('zones'), body.get('types'),
+                                body.get('match'), body.get('regex'))
+        if not zoneFilter.selectsZones() and not zoneFilter.types:
+            return None
+        return zoneFilter
+
+
+    def submit(self, action, filename, apiKey=None, zoneFilter=None):
+        """
+        Creates a job and starts it right away
+
+        Args:
+            action (str): 'import', 'delete' or 'sync'
+            filename (str): The zone data file
+            apiKey (str): The Nsone Api Key, defaults to the service key
+            zoneFilter (zonefilter.ZoneFilter): Optional zone and type selection
+
+        Returns:
+            ImportJob
+        """
+
+        if action not in self.ACTIONS:
+            raise ValueError('action must be one of: {}'.format(', '.join(self.ACTIONS)))
+        if (action == 'delete' and zoneFilter is not None and
+                (zoneFilter.types or zoneFilter.globs or zoneFilter.regexes)):
+            raise ValueError('delete jobs delete whole zones, name them with zones instead of '
+                             'types, match or regex')
+        if not filename or not os.path.exists(filename):
+            raise ValueError('The file {} does not exist!'.format(filename))
+        filename = os.path.realpath(filename)
+        if not filename.startswith(os.path.join(self.dataDir, '')):
+            raise ValueError('The file {} is not in {}'.format(filename, self.dataDir))
+        apiKey = apiKey or self.apiKey
+        if not apiKey:
+            raise ValueError('apikey is required')
+        if self.rate and getRateLimiter(apiKey) is None:
+            setRateLimit(apiKey, self.rate)
+
+        job = ImportJob(self._nextId, action, filename, apiKey, zoneFilter)
+        self._nextId += 1
+        self.jobs[job.jobId] = job
+        self._runJob(job)
+        return job
+
+
+    def _loadData(self, job):
+        """Parses the zone data of a job, runs in a thread to keep the reactor responsive"""
+
+        data = ZoneDataParser().loadZoneData(job.filename, self.workers, job.zoneFilter)
+        return list(data)
+
+
+    @defer.inlineCallbacks
+    def _runJob(self, job):
+        """
+        Parses the job's file and runs an importer that shares the service's zone
+        cache, single-flight and record locks
+
+        Args:
+            job (ImportJob): The job
+        """
+
+        try:
+            job.status = 'parsing'
+            data = yield threads.deferToThread(self._loadData, job)
+            job.status = 'running'
+            job.log('Job {}: {} {} zones from {}'.format(job.jobId, job.action, len(data),
+                                                         job.filename))
+            importer = NsoneImporter(job.apiKey, iter(data), job.action == 'delete',
+                                     zoneCache=self.zoneCache,
+                                     refreshZones=job.action == 'sync',
+                                     progress=job.log,
+                                     singleFlight=self.singleFlight,
+                                     recordLocks=self.recordLocks)
+            yield importer.start()
+        except (Exception, SystemExit) as e:
+            job.log('Job {}: {}'.format(job.jobId, e))
+            job.finish('failed')
+        else:
+            job.finish('done')
+
+
+    def listen(self, description):
+        """
+        Starts serving the api
+
+        Args:
+            description (str): Endpoint like unix:/tmp/nsoneimporter.sock or
+                tcp:8080:interface=127.0.0.1
+        """
+
+        endpoint = endpoints.serverFromString(reactor, description)
+        return endpoint.listen(server.Site(self))
+
+
+    def run(self, description):
+        """Serves the api until the process is stopped"""
+
+        d = self.listen(description)
+        d.addCallback(self._listening, description)
+        d.addErrback(self._listenFailure)
+        reactor.run()
+
+
+    def _listening(self, port, description):
+        """Prints where the service listens"""
+
+        print 'Import service listening on {}'.format(description)
+        return port
+
+
+    def _listenFailure(self, failure):
+        """Prints why the service could not listen and stops the reactor"""
+
+        print failure.getErrorMessage()
+        reactor.stop()
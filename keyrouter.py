@@ -0,0 +1,92 @@
+import json
+import bisect
+import fnmatch
+import hashlib
+
+
+class KeyRouter(object):
+    """
+    Routes every zone to one api key of a pool of keys.
+
+    Keys with an allowed-zone list only receive zones matching one of their
+    glob patterns, and are checked first in the order they were given.
+    All other zones are spread over the keys without a list by a consistent
+    hash ring, so a zone always goes to the same key and adding a key only
+    moves a small share of the zones.
+
+    Attributes:
+        apiKeys (list): Every key of the pool
+        allowedZones (dict): api key -> list of zone globs
+    """
+
+    REPLICAS = 64
+
+
+    def __init__(self, apiKeys, allowedZones=None):
+        """
+        Args:
+            apiKeys (list): The Nsone Api Keys
+            allowedZones (dict): Optional api key -> list of zone globs
+        """
+
+        self.apiKeys = list(apiKeys)
+        self.allowedZones = allowedZones or {}
+        self._ring = []
+        for apiKey in self.apiKeys:
+            if apiKey in self.allowedZones:
+                continue
+            for replica in xrange(self.REPLICAS):
+                self._ring.append((self._hash('{}-{}'.format(apiKey, replica)), apiKey))
+        self._ring.sort()
+        self._ringKeys = [point for point, apiKey in self._ring]
+
+
+    @classmethod
+    def fromFile(cls, apiKeys, filename):
+        """
+        Builds a router from a json file mapping api keys to zone globs,
+        like {"KEY1": ["*.example.com"], "KEY2": ["other.test"]}.
+        Keys only listed in the file are added to the pool.
+
+        Args:
+            apiKeys (list): The Nsone Api Keys given on the command line
+            filename (str): The json file, None for hashing only
+
+        Returns:
+            KeyRouter
+        """
+
+        allowedZones = {}
+        if filename:
+            with open(filename, 'rb') as f:
+                allowedZones = json.load(f)
+        keys = list(apiKeys or [])
+        keys.extend(key for key in allowedZones if key not in keys)
+        return cls(keys, allowedZones)
+
+
+    def _hash(self, value):
+        """Returns a stable integer hash of value"""
+
+        return int(hashlib.md5(value).hexdigest()[:16], 16)
+
+
+    def keyFor(self, zoneName):
+        """
+        Returns the api key zoneName is routed to or None if no key may handle it
+
+        Args:
+            zoneName (str): The zone name
+
+        Returns:
+            str
+        """
+
+        for apiKey in self.apiKeys:
+            for glob in self.allowedZones.get(apiKey, []):
+                if fnmatch.fnmatchcase(zoneName, glob):
+                    return apiKey
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._ringKeys, self._hash(zoneName)) % len(self._ring)
+        return self._ring[index][1]
@@ -0,0 +1,192 @@
+import csv
+import time
+
+from nsone import NSONE, Config
+from twisted.internet import defer, task
+
+from pooledtransport import TRANSPORT
+from recordutils import recordName
+
+
+class NsoneExporter(object):
+    """
+    Exports zones from NS1 into a csv file that ZoneDataParser can read back.
+
+    Zone details are fetched concurrently by a fixed number of workers that
+    pull zone names from a shared iterator, so at most `concurrency` requests
+    are in flight. Every zone is written to the file as soon as it arrives.
+
+    Attributes:
+        config (nsone.Config): The configuration for the nsone requests.
+        nsoneObj (nsone.NSONE): Instance of the nsone object used for http requests
+        filename (str): The csv file the zones are written to
+        concurrency (int): Number of zones fetched at the same time
+        zoneFilter (zonefilter.ZoneFilter): Optional selection of the exported zones
+    """
+
+    FIELDS = ['Name', 'Zone', 'Type', 'TTL', 'Data']
+
+
+    def __init__(self, apiKey, filename, concurrency=20, zoneFilter=None):
+        """
+        Args:
+            apiKey (str):  The Nsone Api Key
+            filename (str): The csv file to write
+            concurrency (int): Zones fetched at the same time
+            zoneFilter (zonefilter.ZoneFilter): Optional zone and type selection
+        """
+
+        self.config = Config()
+        self.config.createFromAPIKey(apiKey)
+        self.config['transport'] = TRANSPORT
+        self.nsoneObj = NSONE(config=self.config)
+        self.filename = filename
+        self.concurrency = concurrency
+        self.zoneFilter = zoneFilter
+        self.zones = 0
+        self.rows = 0
+        self.failures = 0
+        self._writer = None
+
+
+    def _listZones(self):
+        """
+        Returns a deferred list of the zone names in the account
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        d = self.nsoneObj.zones().list()
+        d.addCallback(self._listZonesSuccess)
+        return d
+
+
+    def _listZonesSuccess(self, response):
+        """
+        Extracts and filters the zone names of the zone list
+
+        Args:
+            response (list): The zone list returned by the api
+
+        Returns:
+            list
+        """
+
+        zoneNames = [zone['zone'] for zone in response]
+        if self.zoneFilter is not None:
+            zoneNames = self.zoneFilter.filterZones(zoneNames)
+        print 'Exporting {} zones'.format(len(zoneNames))
+        return zoneNames
+
+
+    def _exportZones(self, zoneNames):
+        """
+        Starts `concurrency` workers that share one iterator of export requests
+
+        Args:
+            zoneNames (list): The zones to export
+
+        Returns:
+            defer.DeferredList
+        """
+
+        work = (self._exportZone(zoneName) for zoneName in zoneNames)
+        cooperator = task.Cooperator()
+        dl = [cooperator.coiterate(work) for _ in xrange(self.concurrency)]
+        return defer.DeferredList(dl)
+
+
+    def _exportZone(self, zoneName):
+        """
+        Fetches the details of one zone. The zone details already carry
+        the short answers of every record, so no request per record is needed.
+
+        Args:
+            zoneName (str): The zone name
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        zone = self.nsoneObj.zones().retrieve(zoneName)
+        zone.addCallback(self._exportZoneSuccess, zoneName)
+        zone.addErrback(self._exportZoneFailure, zoneName)
+        return zone
+
+
+    def _exportZoneSuccess(self, response, zoneName):
+        """
+        Writes the records of a zone, one row per answer
+
+        Args:
+            response (dict): The zone details returned by the api
+            zoneName (str): The zone name
+        """
+
+        rows = 0
+        for rec in response.get('records', []):
+            if self.zoneFilter is not None and not self.zoneFilter.matchesType(rec['type']):
+                continue
+            name = recordName(zoneName, rec['domain'])
+            for answer in rec.get('short_answers', []):
+                self._writeRow([name, zoneName, rec['type'], rec.get('ttl', ''), answer])
+                rows += 1
+        self.zones += 1
+        self.rows += rows
+        print 'Exported zone: {} ({} rows)'.format(zoneName, rows)
+
+
+    def _writeRow(self, row):
+        """Writes one csv row, the api returns unicode which the csv module cannot write"""
+
+        self._writer.writerow([field.encode('utf-8') if isinstance(field, unicode) else field
+                               for field in row])
+
+
+    def _exportZoneFailure(self, failure, zoneName):
+        """
+        Prints the failure of a single zone, the export carries on
+
+        Args:
+            failure (twisted.python.failure)
+            zoneName (str):  The zone name
+        """
+
+        self.failures += 1
+        print '{}: {}'.format(zoneName, failure.getErrorMessage())
+
+
+    def _reportSummary(self, result, started):
+        """Prints the export summary and passes the result through"""
+
+        elapsed = time.time() - started
+        print 'Summary:'
+        print '  Exported {} zones, {} rows to {} in {:.1f}s'.format(self.zones, self.rows,
+                                                                     self.filename, elapsed)
+        print '  Failed zones: {}'.format(self.failures)
+        return result
+
+
+    @defer.inlineCallbacks
+    def _startRequests(self, reactor):
+        """
+        Lists the zones and exports them into the csv file
+
+        Args:
+            reactor (twisted.internet.reactor)
+        """
+
+        started = time.time()
+        with open(self.filename, 'wb') as f:
+            self._writer = csv.writer(f)
+            self._writer.writerow(self.FIELDS)
+            zoneNames = yield self._listZones()
+            yield self._exportZones(zoneNames)
+        self._reportSummary(None, started)
+
+
+    def run(self):
+        """Runs the export on the reactor and exits once every zone is written"""
+
+        task.react(self._startRequests)
@@ -1,33 +1,143 @@
+import time
+
 from nsone import NSONE, Config
 from nsone.rest.errors import ResourceException
 from twisted.internet import defer, reactor, task
+from twisted.python.failure import Failure
+
+from keyrouter import KeyRouter
+from pooledtransport import TRANSPORT
+from recordutils import (ACTIONS, actionRuns, answerTokens, groupRecords, hasActions,
+                         missingAnswers, remainingAnswers, splitZoneDelete, uniqueAnswers,
+                         zoneShape)
+from singleflight import SingleFlight
+
+
+def isNotFound(error):
+    """
+    Returns whether an api error is a 404, for the responses of both transports
+
+    Args:
+        error (ResourceException): The api error
+
+    Returns:
+        bool
+    """
+
+    response = error.response
+    return getattr(response, 'code', getattr(response, 'status_code', None)) == 404
 
 
 class NsoneImporter(object):
     """
     Attributes:
-        config (nsone.Config): The configuration for the nsone requests.
-        nsoneObj (nsone.NSONE): Instance of the nsone object used for http requests
+        config (nsone.Config): The configuration of the first api key, owned by this importer
+        apiKey (str): The first Nsone Api Key
+        apiKeys (list): Every Nsone Api Key of the pool
+        keyRouter (KeyRouter): Routes every zone to one of the api keys
+        clients (dict): api key -> nsone.NSONE instance with its own config
+        keyStats (dict): api key -> request and error counts of this run
+        failedZones (set): Zones with at least one failed operation in this run
+        nsoneObj (nsone.NSONE): Instance of the nsone object of the first api key
         data (dict): Dictionary containing the zone data used by all methods for importing
         deleteData (bool): Attribute used to call deletion endpoints instead of importing
+        profiler (profiler.ImportProfiler): Optional profiler timing zone and record operations
+        zoneCache (dict): (api key, zone name) -> loaded zone, may be shared between importers
+        refreshZones (bool): Ignore cached zones and fetch them again
+        progress (function): Receives every progress message, they are printed without it
+        concurrency (int): Zones processed at the same time, None starts every zone at once
+        linkZones (bool): Create zones with the same records as an earlier zone as linked zones
+        linkStats (dict): Counts of linked zones, source zones and per-record fallbacks
+        singleFlight (SingleFlight): Shares one in-flight load between concurrent callers,
+            may be shared between importers
+        recordLocks (dict): DeferredLock per (zone, domain, type) serializing record merges,
+            may be shared between importers
+        _linkSources (dict): (api key, zone shape) -> state of the source zone of that shape
     """
 
-    config = Config()
-
-
-    def __init__(self, apiKey, data, delete):
+    def __init__(self, apiKey, data, delete, profiler=None, zoneCache=None,
+                 refreshZones=False, progress=None, keyRouter=None, concurrency=None,
+                 linkZones=False, singleFlight=None, recordLocks=None):
         """
         Args:
-            apiKey (str):  The Nsone Api Key
+            apiKey (str|list):  The Nsone Api Key or a pool of keys
             data (Dict):  Zone Data Dict
             delete (bool): Delete Flag, defaults to false from argument parser
+            profiler (profiler.ImportProfiler): Profiler enabled with --profile
+            zoneCache (dict): Zone cache shared by the importers of a long running service
+            refreshZones (bool): Fetch zones again even if they are cached
+            progress (function): Called with every progress message
+            keyRouter (KeyRouter): Routing of zones to keys, defaults to hashing over the pool
+            concurrency (int): Zones processed at the same time, None starts every zone at once
+            linkZones (bool): Create zones with the same records as an earlier zone as linked zones
+            singleFlight (SingleFlight): Single-flight shared by the importers of a long running service
+            recordLocks (dict): Record locks shared by the importers of a long running service
         """
 
-        self.config.createFromAPIKey(apiKey)
-        self.config['transport'] = 'twisted'
-        self.nsoneObj = NSONE(config=self.config)
+        apiKeys = [apiKey] if isinstance(apiKey, basestring) else list(apiKey)
+        self.keyRouter = keyRouter or KeyRouter(apiKeys)
+        self.apiKeys = self.keyRouter.apiKeys
+        self.apiKey = self.apiKeys[0]
+        self.clients = {}
+        self.keyStats = {}
+        for key in self.apiKeys:
+            self.clients[key] = self._createClient(key)
+            self.keyStats[key] = {'requests': 0, 'errors': 0}
+        self.nsoneObj = self.clients[self.apiKey]
+        self.config = self.nsoneObj.config
         self.data = data
         self.deleteData = delete
+        self.profiler = profiler
+        self.zoneCache = zoneCache if zoneCache is not None else {}
+        self.refreshZones = refreshZones
+        self.progress = progress
+        self.concurrency = concurrency
+        self.linkZones = linkZones
+        self.linkStats = {'linked': 0, 'sources': 0, 'fallbacks': 0}
+        self._linkSources = {}
+        self.singleFlight = singleFlight if singleFlight is not None else SingleFlight()
+        self.recordLocks = recordLocks if recordLocks is not None else {}
+        self._flightCounts = (0, 0)
+        self._started = None
+        self.failedZones = set()
+
+
+    def _createClient(self, apiKey):
+        """
+        Creates an nsone client with its own config for one api key
+
+        Args:
+            apiKey (str): The Nsone Api Key
+
+        Returns:
+            nsone.NSONE
+        """
+
+        config = Config()
+        config.createFromAPIKey(apiKey)
+        config['transport'] = TRANSPORT
+        return NSONE(config=config)
+
+
+    def clientFor(self, zoneName):
+        """
+        Returns the client of the api key the zone is routed to, or None
+        if no key of the pool is allowed to handle the zone
+
+        Args:
+            zoneName (str): The zone name
+
+        Returns:
+            nsone.NSONE
+        """
+
+        return self.clients.get(self.keyRouter.keyFor(zoneName))
+
+
+    def _keyOf(self, nsoneObj):
+        """Returns the api key of a client"""
+
+        return nsoneObj.config.getAPIKey()
 
 
     def _deleteZoneData(self):
@@ -41,15 +151,57 @@ class NsoneImporter(object):
         each object is collected for graceful termination
         """
 
-        dl = []
-        for zoneName, records in self.data:
-            deleteZoneRes = self._deleteZonesAndRecords(zoneName, records, self.nsoneObj)
-            deleteZoneRes.addCallback(self._deleteZoneSuccess, zoneName)
-            deleteZoneRes.addErrback(self._deleteZoneFailure, zoneName)
-            dl.append(deleteZoneRes)
+        return self._processZones(self._deleteZone)
+
+
+    def _processZones(self, processZone):
+        """
+        Runs processZone for every zone of the data.
+
+        Without a concurrency limit every zone is started right away. With one,
+        `concurrency` workers share one iterator of the data and pull the next
+        zone once their current zone is done, so lazily produced data is never
+        held in memory as a whole.
+
+        Args:
+            processZone (function): Called with the zone name and records,
+                returns a deferred or None
+
+        Returns:
+            defer.DeferredList
+        """
+
+        work = (processZone(zoneName, records) for zoneName, records in self.data)
+        if not self.concurrency:
+            dl = [d for d in work if d is not None]
+        else:
+            cooperator = task.Cooperator()
+            dl = [cooperator.coiterate(work) for _ in xrange(self.concurrency)]
         return defer.DeferredList(dl, fireOnOneErrback=True)
 
 
+    def _deleteZone(self, zoneName, records):
+        """
+        Starts the deletion of one zone
+
+        Args:
+            zoneName (str):  The zone name
+            records (list): The records of the zone
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        nsoneObj = self.clientFor(zoneName)
+        if nsoneObj is None:
+            self._report('{}: no api key is allowed to manage this zone'.format(zoneName))
+            return None
+        deleteZoneRes = self._deleteZonesAndRecords(zoneName, records, nsoneObj)
+        deleteZoneRes.addCallback(self._deleteZoneSuccess, zoneName, nsoneObj)
+        deleteZoneRes.addErrback(self._deleteZoneFailure, zoneName)
+        return deleteZoneRes
+
+
     @defer.inlineCallbacks
     def _deleteZonesAndRecords(self, zoneName, records, nsoneObj):
         """
@@ -62,11 +214,13 @@ class NsoneImporter(object):
 
         """
 
-        zone = yield nsoneObj.loadZone(zoneName)
-        yield zone.delete()
+        key = ('zone', self._keyOf(nsoneObj), zoneName)
+        zone = yield self.singleFlight.run(key, self._trackCall, 'zone ops', nsoneObj,
+                                           nsoneObj.loadZone, zoneName)
+        yield self._track('zone ops', zone.delete(), nsoneObj)
 
 
-    def _deleteZoneSuccess(self, response, zoneName):
+    def _deleteZoneSuccess(self, response, zoneName, nsoneObj):
         """
         Success callback for deleteZonesAndRecords deferred object.
         Triggered if there are no errors when calling the api
@@ -74,9 +228,11 @@ class NsoneImporter(object):
         Args:
             response (None): Upon success, the delete method returns None
             zoneName (str):  The zone name
+            nsoneObj (nsone.NSONE): Instance of the nsone object
         """
 
-        print 'Successfully Deleted Zone: {}'.format(zoneName)
+        self.zoneCache.pop((self._keyOf(nsoneObj), zoneName), None)
+        self._report('Successfully Deleted Zone: {}'.format(zoneName))
 
 
     def _deleteZoneFailure(self, failure, zoneName):
@@ -89,7 +245,8 @@ class NsoneImporter(object):
             zoneName (str):  The zone name
         """
 
-        print '{}: {}'.format(zoneName, failure.getErrorMessage())
+        self.failedZones.add(zoneName)
+        self._report('{}: {}'.format(zoneName, failure.getErrorMessage()))
 
 
     def _importZoneData(self):
@@ -113,28 +270,265 @@ class NsoneImporter(object):
 
 
         """
-        dl = []
-        for zoneName, records in self.data:
-            zone = self._createZone(zoneName)
-            zone.addCallback(self._createZoneSuccess, zoneName, records, self.nsoneObj)
-            zone.addErrback(self._createZoneFailure, zoneName, records, self.nsoneObj)
-            dl.append(zone)
-        return defer.DeferredList(dl, fireOnOneErrback=True)
+        return self._processZones(self.importZone)
+
+
+    def importZone(self, zoneName, records):
+        """
+        Starts the import of one zone. Sources that produce zones
+        asynchronously call this from the function passed to start.
+
+        Args:
+            zoneName (str):  The zone name
+            records (list): The records of the zone
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        nsoneObj = self.clientFor(zoneName)
+        if nsoneObj is None:
+            self._report('{}: no api key is allowed to manage this zone'.format(zoneName))
+            return None
+        deleteZone, records = splitZoneDelete(records)
+        if deleteZone:
+            return self._recreateZone(zoneName, records, nsoneObj)
+        if self.linkZones and not hasActions(records) and (self.refreshZones or
+                               (self._keyOf(nsoneObj), zoneName) not in self.zoneCache):
+            return self._importLinkedZone(zoneName, records, nsoneObj)
+        return self._importZoneRecords(zoneName, records, nsoneObj)
+
+
+    @defer.inlineCallbacks
+    def updateZone(self, zoneName, records):
+        """
+        Applies the records to a zone only if it still exists. Unlike importZone
+        the zone is never created, a zone that is gone is skipped.
+
+        Args:
+            zoneName (str):  The zone name
+            records (list): The records of the zone
+
+        Yields:
+            twisted.internet.defer
+        """
+
+        nsoneObj = self.clientFor(zoneName)
+        if nsoneObj is None:
+            self._report('{}: no api key is allowed to manage this zone'.format(zoneName))
+            return
+        try:
+            zone = yield self._loadZone(zoneName, nsoneObj)
+        except ResourceException as e:
+            if not isNotFound(e):
+                self._loadZoneFailure(Failure(e), zoneName)
+                return
+            self.zoneCache.pop((self._keyOf(nsoneObj), zoneName), None)
+            self._report('Skipped Zone: {} does not exist'.format(zoneName))
+            return
+        self.zoneCache[(self._keyOf(nsoneObj), zoneName)] = zone
+        yield self._createRecords(zone, zoneName, records, nsoneObj)
 
 
     @defer.inlineCallbacks
-    def _createZone(self, zoneName):
+    def _recreateZone(self, zoneName, records, nsoneObj):
+        """
+        Deletes a zone for a delete-zone row and imports the rows that follow it
+
+        Args:
+            zoneName (str):  The zone name
+            records (list): The records after the last delete-zone row
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Yields:
+            twisted.internet.defer
+        """
+
+        try:
+            yield self._deleteZonesAndRecords(zoneName, records, nsoneObj)
+        except ResourceException as e:
+            self.zoneCache.pop((self._keyOf(nsoneObj), zoneName), None)
+            self._report('{} not deleted: {}'.format(zoneName, e.message))
+        else:
+            self._deleteZoneSuccess(None, zoneName, nsoneObj)
+        if records:
+            yield self._importZoneRecords(zoneName, records, nsoneObj)
+
+
+    def _importZoneRecords(self, zoneName, records, nsoneObj):
+        """
+        Creates or loads a zone and imports every one of its records
+
+        Args:
+            zoneName (str):  The zone name
+            records (list): The records of the zone
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        zone = self._createZone(zoneName, nsoneObj)
+        zone.addCallback(self._createZoneSuccess, zoneName, records, nsoneObj)
+        zone.addErrback(self._createZoneFailure, zoneName, records, nsoneObj)
+        zone.addErrback(self._markZoneFailed, zoneName)
+        return zone
+
+
+    def _importLinkedZone(self, zoneName, records, nsoneObj):
+        """
+        Imports the first zone of every record set shape as a source zone and
+        creates every later zone of the same shape as a zone linked to it,
+        one request per zone instead of one per record.
+
+        Args:
+            zoneName (str):  The zone name
+            records (list): The records of the zone
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        key = (self._keyOf(nsoneObj), zoneShape(zoneName, records))
+        source = self._linkSources.get(key)
+        if source is None:
+            self.linkStats['sources'] += 1
+            source = {'zone': zoneName, 'done': False, 'failed': False, 'waiting': []}
+            self._linkSources[key] = source
+            d = self._importZoneRecords(zoneName, records, nsoneObj)
+            d.addBoth(self._linkSourceDone, source)
+            return d
+
+        ready = defer.Deferred()
+        if source['done']:
+            ready.callback(source)
+        else:
+            source['waiting'].append(ready)
+        ready.addCallback(self._linkZone, zoneName, records, nsoneObj)
+        return ready
+
+
+    def _linkSourceDone(self, result, source):
+        """
+        Marks a source zone as imported and starts the zones waiting to link to it
+
+        Args:
+            result: The result of the source zone import
+            source (dict): The state of the source zone
+        """
+
+        source['done'] = True
+        source['failed'] = isinstance(result, Failure) or source['zone'] in self.failedZones
+        waiting, source['waiting'] = source['waiting'], []
+        for ready in waiting:
+            ready.callback(source)
+        return result
+
+
+    def _linkZone(self, source, zoneName, records, nsoneObj):
+        """
+        Creates a zone as a linked zone of its source zone, or imports its
+        records if the source zone could not be imported
+
+        Args:
+            source (dict): The state of the source zone
+            zoneName (str):  The zone name
+            records (list): The records of the zone
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        sourceZone = self.zoneCache.get((self._keyOf(nsoneObj), source['zone']))
+        if source['failed'] or sourceZone is None:
+            self.linkStats['fallbacks'] += 1
+            return self._importZoneRecords(zoneName, records, nsoneObj)
+
+        zone = self._track('zone ops', sourceZone.createLinkToSelf(zoneName), nsoneObj)
+        zone.addCallback(self._linkZoneSuccess, zoneName, source, nsoneObj)
+        zone.addErrback(self._linkZoneFailure, zoneName, records, source, nsoneObj)
+        zone.addErrback(self._markZoneFailed, zoneName)
+        return zone
+
+
+    def _linkZoneSuccess(self, response, zoneName, source, nsoneObj):
+        """
+        Caches a zone that was created as a linked zone
+
+        Args:
+            response (nsone.zones.Zone): The linked zone
+            zoneName (str):  The zone name
+            source (dict): The state of the source zone
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+        """
+
+        self.linkStats['linked'] += 1
+        self.zoneCache[(self._keyOf(nsoneObj), zoneName)] = response
+        self._report('Linked Zone: {} -> {}'.format(zoneName, source['zone']))
+
+
+    @defer.inlineCallbacks
+    def _linkZoneFailure(self, failure, zoneName, records, source, nsoneObj):
+        """
+        Triggered when a linked zone cannot be created, likely because the zone exists.
+
+        A zone that is already linked to the source zone is left alone. Any
+        other existing zone diverges from the source, so its records are
+        imported one by one like without linking.
+
+        Args:
+            failure (twisted.python.failure)
+            zoneName (str):  The zone name
+            records (list): The records of the zone
+            source (dict): The state of the source zone
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Yields:
+            twisted.internet.defer
+        """
+
+        failure.trap(ResourceException)
+        self._report(failure.getErrorMessage())
+        try:
+            zone = yield self._loadZone(zoneName, nsoneObj)
+        except ResourceException as e:
+            self._loadZoneFailure(Failure(e), zoneName)
+            return
+
+        self.zoneCache[(self._keyOf(nsoneObj), zoneName)] = zone
+        if zone.data.get('link') == source['zone']:
+            self.linkStats['linked'] += 1
+            self._report('Zone {} is already linked to {}'.format(zoneName, source['zone']))
+            return
+        self.linkStats['fallbacks'] += 1
+        self._report('Zone {} is not linked to {}, importing its records'.format(
+            zoneName, source['zone']))
+        yield self._createRecords(zone, zoneName, records, nsoneObj)
+
+
+    @defer.inlineCallbacks
+    def _createZone(self, zoneName, nsoneObj):
         """
         Returns the result of the deferred zone api call when available.
 
+        A zone that is already in the zone cache is not created again
+        unless refreshZones is set.
+
         Args:
             zoneName (str): The zone name in the data dictionary
+            nsoneObj (nsone.NSONE): Instance of the nsone object
 
         Returns:
             nsone.zones.Zone
         """
 
-        zone = yield self.nsoneObj.createZone(zoneName)
+        key = (self._keyOf(nsoneObj), zoneName)
+        zone = None if self.refreshZones else self.zoneCache.get(key)
+        if zone is None:
+            zone = yield self._track('zone ops', nsoneObj.createZone(zoneName), nsoneObj)
+            self.zoneCache[key] = zone
         defer.returnValue(zone)
 
 
@@ -192,7 +586,7 @@ class NsoneImporter(object):
         """
 
         f = failure.trap(ResourceException)
-        print failure.getErrorMessage()
+        self._report(failure.getErrorMessage())
 
         zone = self._loadZone(zoneName, nsoneObj)
         zone.addCallback(self._loadZoneSuccess, zoneName, records, nsoneObj)
@@ -204,6 +598,7 @@ class NsoneImporter(object):
     def _loadZone(self, zoneName, nsoneObj):
         """
         Gets the result of the deferred load zone api call when available.
+        Concurrent loads of the same zone share a single request.
 
         Args:
             zoneName (str): The zone name in the data dictionary
@@ -213,7 +608,9 @@ class NsoneImporter(object):
             nsone.zones.Zone
         """
 
-        zone = yield nsoneObj.loadZone(zoneName)
+        key = ('zone', self._keyOf(nsoneObj), zoneName)
+        zone = yield self.singleFlight.run(key, self._trackCall, 'zone ops', nsoneObj,
+                                           nsoneObj.loadZone, zoneName)
         defer.returnValue(zone)
 
 
@@ -243,7 +640,8 @@ class NsoneImporter(object):
             defer.DeferredList
         """
 
-        print 'Successfully Loaded Zone: {}'.format(zoneName)
+        self._report('Successfully Loaded Zone: {}'.format(zoneName))
+        self.zoneCache[(self._keyOf(nsoneObj), zoneName)] = response
 
         return self._createRecords(response, zoneName, records, nsoneObj)
 
@@ -258,7 +656,21 @@ class NsoneImporter(object):
             zoneName (str):  The zone name
         """
 
-        print '{}: {}'.format(zoneName, failure.getErrorMessage())
+        self.failedZones.add(zoneName)
+        self._report('{}: {}'.format(zoneName, failure.getErrorMessage()))
+
+
+    def _markZoneFailed(self, failure, zoneName):
+        """
+        Records a zone whose callback chain ended in an error and passes the failure on
+
+        Args:
+            failure (twisted.python.failure)
+            zoneName (str):  The zone name
+        """
+
+        self.failedZones.add(zoneName)
+        return failure
 
 
     def _createRecords(self, response, zoneName, records, nsoneObj):
@@ -267,6 +679,10 @@ class NsoneImporter(object):
         for all of the records  in the record list and addes both success
         and error callbacks for each instance.
 
+        Rows are grouped by (domain, type) first, so a record with
+        several answers is created with all of them in one request
+        instead of one request per row.
+
         Records are logically created either after creating a zone
         or loading a zone successfully which is why this functionality
         is modularized into this function to remove duplicate logic.
@@ -286,34 +702,185 @@ class NsoneImporter(object):
 
         dl = []
         zone = response
-        for rec in records:
-            answers = rec['Data'].split()
-            methodName = 'add_{}'.format(rec['Type'])
-            addMethod = getattr(zone, methodName)
-
-            record = self._createRecord(addMethod, zoneName, [answers], rec['TTL'])
-            record.addCallback(self._createRecordSuccess)
-            record.addErrback(self._createRecordFailure, zoneName, rec['Type'], answers, nsoneObj)
+        for (domain, recType), group in groupRecords(zoneName, records):
+            runs = actionRuns(group)
+            if len(runs) == 1:
+                record = self._applyRecordAction(None, zone, zoneName, domain, recType,
+                                                 runs[0][0], runs[0][1], nsoneObj)
+            else:
+                record = defer.succeed(None)
+                for action, rows in runs:
+                    record.addCallback(self._applyRecordAction, zone, zoneName, domain, recType,
+                                       action, rows, nsoneObj)
             dl.append(record)
         return defer.DeferredList(dl, fireOnOneErrback=True)
 
 
+    def _applyRecordAction(self, ignored, zone, zoneName, domain, recType, action, rows, nsoneObj):
+        """
+        Applies one run of consecutive rows with the same action to a record.
+        Runs of the same record are chained, so they are applied in file order,
+        while different records of the zone are processed in parallel.
+
+        Args:
+            ignored: The result of the previous run of the record
+            zone (nsone.zones.Zone): The zone of the record
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            action (str): upsert, replace-answers, remove-answers or delete-record
+            rows (list): The rows of the run
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        answers = uniqueAnswers([answerTokens(rec) for rec in rows], recType)
+        if action == 'upsert':
+            addMethod = getattr(zone, 'add_{}'.format(recType))
+            record = self._createRecord(addMethod, domain, answers, rows[0]['TTL'], nsoneObj)
+            record.addCallback(self._createRecordSuccess)
+            record.addErrback(self._createRecordFailure, zoneName, domain, recType, answers, nsoneObj)
+            return record
+        if action == 'replace-answers':
+            return self._replaceRecordAnswers(zone, zoneName, domain, recType, answers,
+                                              rows[0]['TTL'], nsoneObj)
+        if action == 'delete-record':
+            return self._deleteRecord(zoneName, domain, recType, nsoneObj)
+        if action == 'remove-answers':
+            return self._removeRecordAnswers(zoneName, domain, recType, answers, nsoneObj)
+
+        self.failedZones.add(zoneName)
+        self._report('{}: unknown action {} for {} {}, expected one of: {}'.format(
+            zoneName, action, domain, recType, ', '.join(ACTIONS)))
+        return defer.succeed(None)
+
+
+    @defer.inlineCallbacks
+    def _replaceRecordAnswers(self, zone, zoneName, domain, recType, answers, ttl, nsoneObj):
+        """
+        Creates a record with exactly the given answers, or replaces every
+        answer of the record if it already exists
+
+        Args:
+            zone (nsone.zones.Zone): The zone of the record
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            answers (list): The new answers of the record
+            ttl (str): The TTL value for the record
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Yields:
+            twisted.internet.defer
+        """
+
+        addMethod = getattr(zone, 'add_{}'.format(recType))
+        try:
+            record = yield self._createRecord(addMethod, domain, answers, ttl, nsoneObj)
+        except ResourceException:
+            pass
+        else:
+            self._createRecordSuccess(record)
+            return
+
+        try:
+            record = yield self._loadRecord(zoneName, domain, recType, nsoneObj)
+            yield self._track('record ops', record.update(answers=answers, ttl=ttl), nsoneObj)
+        except ResourceException as e:
+            self.failedZones.add(zoneName)
+            self._report('{} {}: {}'.format(domain, recType, e.message))
+        else:
+            self._report('Replaced answers of {} {}: {}'.format(domain, recType, answers))
+
+
+    @defer.inlineCallbacks
+    def _removeRecordAnswers(self, zoneName, domain, recType, answers, nsoneObj):
+        """
+        Removes answers from a record, a record left without answers is deleted
+
+        Args:
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            answers (list): The answers to remove
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Yields:
+            twisted.internet.defer
+        """
+
+        try:
+            record = yield self._loadRecord(zoneName, domain, recType, nsoneObj)
+        except ResourceException as e:
+            self._report('{} {} answers not removed: {}'.format(domain, recType, e.message))
+            return
+
+        recordData = yield record.data
+        remaining = remainingAnswers(recordData['answers'], answers, recType)
+        if len(remaining) == len(recordData['answers']):
+            self._report('Answers already removed: {}'.format(answers))
+            return
+        try:
+            if remaining:
+                yield self._track('record ops', record.update(answers=remaining), nsoneObj)
+            else:
+                yield self._track('record ops', record.delete(), nsoneObj)
+        except ResourceException as e:
+            self.failedZones.add(zoneName)
+            self._report('{} {}: {}'.format(domain, recType, e.message))
+        else:
+            self._report('Removed answers of {} {}: {}'.format(domain, recType, answers))
+
+
+    @defer.inlineCallbacks
+    def _deleteRecord(self, zoneName, domain, recType, nsoneObj):
+        """
+        Deletes a record, a record that does not exist is already deleted
+
+        Args:
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Yields:
+            twisted.internet.defer
+        """
+
+        try:
+            record = yield self._loadRecord(zoneName, domain, recType, nsoneObj)
+        except ResourceException as e:
+            self._report('{} {} not deleted: {}'.format(domain, recType, e.message))
+            return
+
+        try:
+            yield self._track('record ops', record.delete(), nsoneObj)
+        except ResourceException as e:
+            self.failedZones.add(zoneName)
+            self._report('{} {}: {}'.format(domain, recType, e.message))
+        else:
+            self._report('Deleted record: {} {}'.format(domain, recType))
+
+
     @defer.inlineCallbacks
-    def _createRecord(self, addMethod, zoneName, answers, ttl):
+    def _createRecord(self, addMethod, domain, answers, ttl, nsoneObj):
         """
         Calls the add_X method on zones for creating records and
         returns the value when it's available
 
         Args:
             addMethod (function) : add_X method of the zone where X is dynamic
-            zoneName (str): The zone name from the data dict
+            domain (str): The fully qualified record domain
             answers (list): The answers for the record in list form
             ttl (str): The TTL value for the record
+            nsoneObj (nsone.NSONE): Instance of the nsone object
 
         Return:
             nsone.records.Record
         """
-        record = yield addMethod(zoneName, answers, ttl=ttl)
+        record = yield self._track('record ops', addMethod(domain, answers, ttl=ttl), nsoneObj)
         defer.returnValue(record)
 
 
@@ -326,21 +893,27 @@ class NsoneImporter(object):
         Args:
             response (nsone.records.Record): an instance of an nsone record object
         """
-        print 'Created record: {}'.format(response)
+        self._report('Created record: {}'.format(response))
 
 
     @defer.inlineCallbacks
-    def _createRecordFailure(self, failure, zoneName, recType, answers, nsoneObj):
+    def _createRecordFailure(self, failure, zoneName, domain, recType, answers, nsoneObj):
         """
         Triggered when a record cannot be created.
 
-        Logically if a record can't be created, an attempt at loading it is made.
-        A deferred record object is created and both success and error callbacks
-        are chained onto it.
+        Logically if a record can't be created, an attempt at loading it is made
+        and all of the answers of the record are merged into it at once.
+        The merge runs under the lock of the (zone, domain, type) key so
+        concurrent merges into the same record never overwrite each other.
 
 
         Args:
             failure (twisted.python.failure): the failure object
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            answers (list): All of the answers for the record
+            nsoneObj (nsone.NSONE): Instance of the nsone object
 
         Yields:
             nsone.records.Record
@@ -348,20 +921,71 @@ class NsoneImporter(object):
         """
         f = failure.trap(ResourceException)
         if f == ResourceException:
-            record = self._loadRecord(zoneName, recType, nsoneObj)
-            record.addCallback(self._loadRecordSuccess, answers)
-            record.addErrback(self._loadRecordFailure)
-            yield record
+            key = (zoneName, domain, recType)
+            yield self._withRecordLock(key, self._mergeRecord, zoneName, domain,
+                                       recType, answers, nsoneObj)
+
+
+    def _withRecordLock(self, key, f, *args):
+        """
+        Runs f while holding the DeferredLock of key.
+        Locks are created on demand and dropped again once nobody waits on them.
+
+        Args:
+            key (tuple): (zone, domain, type)
+            f (function): Function returning a deferred
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        lock = self.recordLocks.get(key)
+        if lock is None:
+            lock = self.recordLocks[key] = defer.DeferredLock()
+        d = lock.run(f, *args)
+        d.addBoth(self._releaseRecordLock, key, lock)
+        return d
+
+
+    def _releaseRecordLock(self, result, key, lock):
+        """Drops an idle lock and passes the result through"""
+
+        if not lock.locked and not lock.waiting and self.recordLocks.get(key) is lock:
+            del self.recordLocks[key]
+        return result
+
+
+    def _mergeRecord(self, zoneName, domain, recType, answers, nsoneObj):
+        """
+        Loads an existing record once and adds every missing answer in one update
+
+        Args:
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            answers (list): All of the answers for the record
+            nsoneObj (nsone.NSONE): Instance of the nsone object
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        record = self._loadRecord(zoneName, domain, recType, nsoneObj)
+        record.addCallback(self._loadRecordSuccess, zoneName, recType, answers, nsoneObj)
+        record.addErrback(self._loadRecordFailure, zoneName)
+        return record
 
 
     @defer.inlineCallbacks
-    def _loadRecord(self, zoneName, recType, nsoneObj):
+    def _loadRecord(self, zoneName, domain, recType, nsoneObj):
         """
         Calls the loadRecord  method on nsoneObj
-        returns the value of the record when it's available
+        returns the value of the record when it's available.
+        Concurrent loads of the same record share a single request.
 
         Args:
             zoneName (str): The zone name from the data dict
+            domain (str): The fully qualified record domain
             recType (str): The record type
             nsoneObj (nsone.NSONE): Instance of the nsone object
 
@@ -369,12 +993,14 @@ class NsoneImporter(object):
             nsone.records.Record
         """
 
-        record = yield nsoneObj.loadRecord(zoneName, recType, zoneName)
+        key = ('record', self._keyOf(nsoneObj), zoneName, domain, recType)
+        record = yield self.singleFlight.run(key, self._trackCall, 'record ops', nsoneObj,
+                                             nsoneObj.loadRecord, domain, recType, zoneName)
         defer.returnValue(record)
 
 
     @defer.inlineCallbacks
-    def _loadRecordSuccess(self, response, answers):
+    def _loadRecordSuccess(self, response, zoneName, recType, answers, nsoneObj):
         """
         Triggered when a record is successfully loaded
 
@@ -388,61 +1014,67 @@ class NsoneImporter(object):
 
         Args:
             response (nsone.records.Record): the record instance
+            zoneName (str): The zone name
+            recType (str): The record type
             answers (list): The answers to be added to the record
+            nsoneObj (nsone.NSONE): Instance of the nsone object
 
         Yields:
             twisted.internet.defer
 
         """
 
-        print 'Successfully loaded Record: {}'.format(response)
+        self._report('Successfully loaded Record: {}'.format(response))
         record = response
-        addRecordAnswersRes = self._addRecordAnswers(record, answers)
+        addRecordAnswersRes = self._addRecordAnswers(record, recType, answers, nsoneObj)
         addRecordAnswersRes.addCallback(self._addRecordAnswersSuccess, answers)
-        addRecordAnswersRes.addErrback(self._addRecordAnswersFailure)
+        addRecordAnswersRes.addErrback(self._addRecordAnswersFailure, zoneName)
         yield addRecordAnswersRes
 
 
-    def _loadRecordFailure(self, failure):
+    def _loadRecordFailure(self, failure, zoneName):
         """
         Prints the failure message if a record fails to load
 
         Args:
             failure (twisted.python.failure): The failure object
+            zoneName (str): The zone name
         """
-        print failure.getErrorMessage()
+        self.failedZones.add(zoneName)
+        self._report(failure.getErrorMessage())
 
 
     @defer.inlineCallbacks
-    def _addRecordAnswers(self, record, answers):
+    def _addRecordAnswers(self, record, recType, answers, nsoneObj):
         """
         Calls the addAnswers method on the nsone.records.Record object
 
-        If the record answers already contain the answers passed
-        into this method, then nothing is done. Otherwise, the
-        addAnswers method is called and the answers are added to
-        the record
+        Answers are compared field by field (priority, host, ...) with
+        the answers of the record. If every answer passed into this method
+        already exists, then nothing is done. Otherwise, the addAnswers method
+        is called once with all of the missing answers.
 
         Returns a deferred object with the response from the
         addAnswers method on the record object when it is available
-        or returns None if the record answers intersect with
-        what's passed in here.
+        or returns None if there is nothing to add.
 
         Args:
             record (nsone.records.Record): The nsone record object
+            recType (str): The record type
             answers (list): The record answers
+            nsoneObj (nsone.NSONE): Instance of the nsone object
 
         Yields:
             None
         """
 
         recordData = yield record.data
-        recordAnswers = {answer['answer'][0] for answer in recordData['answers']}
-        if not recordAnswers.intersection(answers):
-            print 'Adding answer: {}'.format(answers)
-            yield record.addAnswers(answers)
+        newAnswers = missingAnswers(recordData['answers'], answers, recType)
+        if newAnswers:
+            self._report('Adding answers: {}'.format(newAnswers))
+            yield self._track('record ops', record.addAnswers(newAnswers), nsoneObj)
         else:
-            print 'Answer already exists: {}'.format(answers[0])
+            self._report('Answers already exist: {}'.format(answers))
 
 
     def _addRecordAnswersSuccess(self, response, answers):
@@ -454,21 +1086,132 @@ class NsoneImporter(object):
             answers (list): The record answers
 
         """
-        print 'Successfully processed answers: {}'.format(answers)
+        self._report('Successfully processed answers: {}'.format(answers))
 
 
-    def _addRecordAnswersFailure(self, failure):
+    def _addRecordAnswersFailure(self, failure, zoneName):
         """
         Prints a failure message to show that the answers weren't added
 
         Args:
             failure (twisted.python.failure): the twisted failure object
+            zoneName (str): The zone name
+
+        """
+        self.failedZones.add(zoneName)
+        self._report(failure.getErrorMessage())
+
+
+    def _report(self, message):
+        """
+        Hands a progress message to the progress callback or prints it
+
+        Args:
+            message (str): The message
+        """
+
+        if self.progress is not None:
+            self.progress(message)
+        else:
+            print message
+
+
+    def _track(self, phase, d, nsoneObj):
+        """
+        Counts the deferred request d against the api key of nsoneObj and
+        times it under phase when profiling
+
+        Args:
+            phase (str): 'zone ops' or 'record ops'
+            d (twisted.internet.defer.Deferred): The api request
+            nsoneObj (nsone.NSONE): The client sending the request
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        d.addBoth(self._countRequest, self._keyOf(nsoneObj))
+        if self.profiler is None:
+            return d
+        return self.profiler.trackDeferred(phase, d)
+
 
+    def _trackCall(self, phase, nsoneObj, f, *args):
         """
-        print failure.getErrorMessage()
+        Sends a request with f and tracks it like _track. Handed to the
+        single-flight so a shared request is counted and timed once, not
+        once per caller waiting on it.
 
+        Args:
+            phase (str): 'zone ops' or 'record ops'
+            nsoneObj (nsone.NSONE): The client sending the request
+            f (function): The api method returning a deferred
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        return self._track(phase, f(*args), nsoneObj)
+
+
+    def _countRequest(self, result, apiKey):
+        """Updates the request and error counts of an api key and passes the result through"""
+
+        stats = self.keyStats[apiKey]
+        stats['requests'] += 1
+        if isinstance(result, Failure):
+            stats['errors'] += 1
+        return result
+
+
+    def _startTeardown(self, result):
+        """Starts the teardown phase once every request is done"""
+
+        if self.profiler is not None:
+            self.profiler.startPhase('teardown')
+        return result
+
+
+    def _summaryLines(self):
+        """
+        Returns the lines of the run summary
+
+        Returns:
+            list
+        """
+
+        elapsed = max(time.time() - self._started, 0.001)
+        lines = [
+            'Engine: twisted, {:.3f}s'.format(elapsed),
+            'Single-flight loads: {} shared, {} requested'.format(
+                self.singleFlight.hits - self._flightCounts[0],
+                self.singleFlight.misses - self._flightCounts[1])
+        ]
+        if self.linkZones:
+            lines.append('Linked zones: {} linked, {} sources, {} imported per record'.format(
+                self.linkStats['linked'], self.linkStats['sources'], self.linkStats['fallbacks']))
+        for apiKey in self.apiKeys:
+            stats = self.keyStats[apiKey]
+            lines.append('Key ...{}: {} requests, {} errors, {:.1f} requests/s'.format(
+                apiKey[-4:], stats['requests'], stats['errors'], stats['requests'] / elapsed))
+        return lines
+
+
+    def _reportSummary(self, result):
+        """
+        Prints the run summary once all requests are done and passes the result through
+
+        Args:
+            result: The result of the deferred list
+        """
+
+        self._report('Summary:')
+        for line in self._summaryLines():
+            self._report('  {}'.format(line))
+        return result
 
-    def _startRequests(self, reactor):
+
+    def _startRequests(self, reactor, produceRequests=None):
         """
         This method initializes either the zone data import or deletion.
 
@@ -476,20 +1219,64 @@ class NsoneImporter(object):
 
         Args:
             reactor (twisted.internet.reactor)
+            produceRequests (function): Called with the importer instead of
+                processing the data, returns a deferred
 
         Return:
             function
         """
 
-        if self.deleteData:
-            return self._deleteZoneData()
-        return self._importZoneData()
+        self._started = time.time()
+        # a shared single-flight counts for every importer, the summary shows this run only
+        self._flightCounts = (self.singleFlight.hits, self.singleFlight.misses)
+        if produceRequests is not None:
+            d = produceRequests(self)
+        elif self.deleteData:
+            d = self._deleteZoneData()
+        else:
+            d = self._importZoneData()
+        d.addBoth(self._reportSummary)
+        d.addBoth(self._startTeardown)
+        return d
+
+
+    def start(self, produceRequests=None):
+        """
+        Starts the import or deletion on an already running reactor
+
+        Args:
+            produceRequests (function): Optional source of the requests, called
+                with the importer and feeding zones to importZone as they arrive
+
+        Returns:
+            twisted.internet.defer.Deferred: fires when every request is done
+        """
+
+        return self._startRequests(reactor, produceRequests)
 
 
-    def run(self):
+    def run(self, afterImport=None, produceRequests=None):
         """
         Schedules the startRequests method and gracefully exits the program when either
         all of the deferred objects fire successfully or fail
+
+        Args:
+            afterImport (callable): Optional stage run on the same reactor once the
+                import is done, may return a deferred
+            produceRequests (function): Optional source of the requests, like in start
         """
 
-        task.react(self._startRequests)
+        if self.profiler is not None:
+            self.profiler.install()
+        if afterImport is None:
+            task.react(self._startRequests, (produceRequests,))
+        else:
+            task.react(self._startRequestsThen, (afterImport, produceRequests))
+
+
+    def _startRequestsThen(self, reactor, afterImport, produceRequests=None):
+        """Runs the requests and then the afterImport stage"""
+
+        d = self._startRequests(reactor, produceRequests)
+        d.addCallback(lambda result: afterImport())
+        return d
@@ -0,0 +1,190 @@
+import os
+import marshal
+import hashlib
+import sqlite3
+
+
+HASH_CHUNK = 1 << 20
+
+
+def fileSha1(filename):
+    """
+    Returns the hex sha1 of the content of a file, read in HASH_CHUNK pieces
+
+    Args:
+        filename (str): The file to hash
+
+    Returns:
+        str
+    """
+
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), ''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ParseCache(object):
+    """
+    Parse-once cache of the normalized zone data of a file.
+
+    The grouped records of every zone are stored in a sqlite database next
+    to the data file (ZoneData.csv.cache), one row per zone, with the records
+    of the zone marshalled into a single blob. The cache is keyed by the
+    sha1 of the file content and the parser version, so touching the file
+    without changing it keeps the cache and any change to the content or to
+    the parser throws it away.
+
+    Zones are stored in the order of the parsed data, which is the order they
+    first appear in the file. Reading iterates them in that order and only
+    unmarshals one zone at a time, selected zones are looked up by name.
+
+    Attributes:
+        filename (str): The zone data file
+        cacheFilename (str): Path of the cache database
+    """
+
+    VERSION = 2
+    FIELDS = ('Name', 'Type', 'TTL', 'Data', 'Action')
+
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename (str): The zone data file the cache belongs to
+        """
+
+        self.filename = os.path.abspath(filename)
+        self.cacheFilename = self.filename + '.cache'
+        self._key = None
+
+
+    def key(self):
+        """
+        Returns the cache key of the file, the parser version and the content hash
+
+        Returns:
+            str
+        """
+
+        if self._key is None:
+            self._key = '{}-{}'.format(self.VERSION, fileSha1(self.filename))
+        return self._key
+
+
+    def _connect(self, filename):
+        """Opens a cache database"""
+
+        connection = sqlite3.connect(filename)
+        connection.text_factory = str
+        return connection
+
+
+    def isFresh(self):
+        """
+        Returns whether a cache exists for the current content of the file
+
+        Returns:
+            bool
+        """
+
+        if not os.path.exists(self.cacheFilename):
+            return False
+        connection = self._connect(self.cacheFilename)
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE name = 'key'").fetchone()
+        except sqlite3.DatabaseError:
+            return False
+        finally:
+            connection.close()
+        return row is not None and row[0] == self.key()
+
+
+    def write(self, data):
+        """
+        Stores the parsed zone data, through a temporary file so a half
+        written cache is never picked up
+
+        Args:
+            data (iterable): (zone name, records) tuples
+        """
+
+        tmpFilename = self.cacheFilename + '.tmp'
+        if os.path.exists(tmpFilename):
+            os.remove(tmpFilename)
+        connection = self._connect(tmpFilename)
+        try:
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE zones (position INTEGER PRIMARY KEY, '
+                               'name TEXT UNIQUE, count INTEGER, records BLOB)')
+            connection.executemany('INSERT INTO zones VALUES (?, ?, ?, ?)',
+                                   self._rows(data))
+            connection.execute("INSERT INTO meta VALUES ('key', ?)", (self.key(),))
+            connection.commit()
+        finally:
+            connection.close()
+        os.rename(tmpFilename, self.cacheFilename)
+
+
+    def _rows(self, data):
+        """Yields the database row of every zone"""
+
+        for position, (zoneName, records) in enumerate(data):
+            packed = [tuple(rec.get(field) for field in self.FIELDS) for rec in records]
+            yield position, zoneName, len(records), sqlite3.Binary(marshal.dumps(packed))
+
+
+    def zoneNames(self):
+        """
+        Returns the cached zone names in the order they first appear in the file
+
+        Returns:
+            list
+        """
+
+        connection = self._connect(self.cacheFilename)
+        try:
+            return [row[0] for row in
+                    connection.execute('SELECT name FROM zones ORDER BY position')]
+        finally:
+            connection.close()
+
+
+    def readZones(self, zoneNames=None, zoneFilter=None):
+        """
+        Lazily yields the cached zones, one zone is unmarshalled at a time
+
+        Args:
+            zoneNames (list): Only read these zones, None for every zone
+            zoneFilter (zonefilter.ZoneFilter): Optional zone and type selection
+
+        Yields:
+            tuple: (zone name, records)
+        """
+
+        connection = self._connect(self.cacheFilename)
+        try:
+            if zoneNames is None:
+                rows = connection.execute('SELECT name, records FROM zones ORDER BY position')
+            else:
+                rows = (connection.execute('SELECT name, records FROM zones WHERE name = ?',
+                                           (zoneName,)).fetchone()
+                        for zoneName in zoneNames)
+            for row in rows:
+                if row is None:
+                    continue
+                zoneName = row[0]
+                if zoneFilter is not None and not zoneFilter.matchesZone(zoneName):
+                    continue
+                records = [dict((field, value) for field, value in zip(self.FIELDS, packed)
+                                if value is not None)
+                           for packed in marshal.loads(str(row[1]))]
+                if zoneFilter is not None and zoneFilter.types:
+                    records = [rec for rec in records if zoneFilter.matchesType(rec['Type'])]
+                if records:
+                    yield zoneName, records
+        finally:
+            connection.close()
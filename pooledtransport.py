@@ -0,0 +1,113 @@
+from nsone.rest.transport.base import TransportBase
+from nsone.rest.transport.twisted import TwistedTransport
+from twisted.internet import reactor
+from twisted.web.client import Agent, HTTPConnectionPool
+
+from ratelimiter import RateLimiter
+
+
+TRANSPORT = 'twisted-pooled'
+
+_pool = None
+_limiters = {}
+
+
+def getPool():
+    """
+    Returns the persistent connection pool shared by every client of the process
+
+    Returns:
+        twisted.web.client.HTTPConnectionPool
+    """
+
+    global _pool
+    if _pool is None:
+        _pool = HTTPConnectionPool(reactor, persistent=True)
+        _pool.maxPersistentPerHost = 20
+    return _pool
+
+
+def setRateLimit(apiKey, rate):
+    """
+    Limits the requests sent with apiKey to rate per second, for every client of the process
+
+    Args:
+        apiKey (str): The Nsone Api Key
+        rate (float): Requests per second, None removes the limit
+    """
+
+    setRateLimiter(apiKey, RateLimiter(rate) if rate else None)
+
+
+def setRateLimiter(apiKey, limiter):
+    """
+    Makes every client of the process wait for a token of limiter before
+    sending a request with apiKey
+
+    Args:
+        apiKey (str): The Nsone Api Key
+        limiter: Anything with an acquire() method returning a deferred,
+            like ratelimiter.RateLimiter, None removes the limit
+    """
+
+    if limiter is not None:
+        _limiters[apiKey] = limiter
+    else:
+        _limiters.pop(apiKey, None)
+
+
+def getRateLimiter(apiKey):
+    """
+    Returns the limiter of apiKey or None
+
+    Returns:
+        ratelimiter.RateLimiter
+    """
+
+    return _limiters.get(apiKey)
+
+
+class PooledTwistedTransport(TwistedTransport):
+    """
+    The nsone twisted transport with a process wide connection pool and
+    rate limiter.
+
+    The stock transport creates a new Agent, and therefore new connections,
+    for every resource object. This one reuses persistent connections and
+    waits for a token of the api key's rate limiter before every request.
+    It is registered with nsone as the 'twisted-pooled' transport.
+    """
+
+
+    def __init__(self, config):
+        """
+        Args:
+            config (nsone.Config): The client configuration
+        """
+
+        TwistedTransport.__init__(self, config)
+        self.agent = Agent(reactor, pool=getPool())
+        self.apiKey = config.getAPIKey()
+
+
+    def send(self, method, url, headers=None, data=None, files=None,
+             callback=None, errback=None):
+        """Sends the request once the rate limiter of the api key allows it"""
+
+        limiter = getRateLimiter(self.apiKey)
+        if limiter is None:
+            return TwistedTransport.send(self, method, url, headers, data, files,
+                                         callback, errback)
+        d = limiter.acquire()
+        d.addCallback(self._send, method, url, headers, data, files, callback, errback)
+        return d
+
+
+    def _send(self, ignored, method, url, headers, data, files, callback, errback):
+        """Sends the request after a token was granted"""
+
+        return TwistedTransport.send(self, method, url, headers, data, files,
+                                     callback, errback)
+
+
+TransportBase.REGISTRY[TRANSPORT] = PooledTwistedTransport
@@ -0,0 +1,264 @@
+import sys
+import time
+import cProfile
+import threading
+import traceback
+from collections import Counter, OrderedDict
+
+from twisted.internet import reactor, task
+
+
+class ImportProfiler(object):
+    """
+    Collects per-phase timings of an import and watches the reactor for stalls.
+
+    Synchronous phases (validate, parse, teardown) are recorded as wall clock
+    spans. Asynchronous phases (zone ops, record ops) are recorded per request
+    from the moment the request is issued until its deferred fires. Sources
+    read lazily while the import runs (index, cache, templates) add the time
+    spent producing every zone to the parse phase.
+
+    A heartbeat is scheduled on the reactor and a watchdog thread checks it.
+    Whenever the heartbeat is late by more than stallThreshold the stack of the
+    reactor thread is printed, which points at the code blocking the reactor.
+    The same thread can sample the reactor stack for flamegraph output.
+
+    Attributes:
+        stallThreshold (float): Seconds the reactor may block before it is reported
+        statsFilename (str): If set, cProfile stats of the reactor thread are dumped here
+        foldedFilename (str): If set, sampled stacks are written here in folded format
+        sampleInterval (float): Seconds between two watchdog checks or samples
+        phases (OrderedDict): phase name -> timing dict
+        stalls (list): Durations of the reported reactor stalls
+    """
+
+
+    def __init__(self, stallThreshold=0.5, statsFilename=None, foldedFilename=None,
+                 sampleInterval=0.01):
+        """
+        Args:
+            stallThreshold (float): Stall threshold in seconds
+            statsFilename (str): pstats output file
+            foldedFilename (str): Folded stacks output file
+            sampleInterval (float): Watchdog period in seconds
+        """
+
+        self.stallThreshold = stallThreshold
+        self.statsFilename = statsFilename
+        self.foldedFilename = foldedFilename
+        self.sampleInterval = sampleInterval
+        self.phases = OrderedDict()
+        self.stalls = []
+        self._open = {}
+        self._samples = Counter()
+        self._lastBeat = None
+        self._heartbeat = None
+        self._watchdog = None
+        self._running = False
+        self._reactorThreadId = None
+        self._cprofile = None
+
+
+    def _phase(self, name):
+        """Returns the timing dict of a phase, creating it on first use"""
+
+        if name not in self.phases:
+            self.phases[name] = {'start': None, 'end': None, 'count': 0,
+                                 'total': 0.0, 'max': 0.0, 'lazy': False}
+        return self.phases[name]
+
+
+    def recordPhase(self, name, start, end):
+        """
+        Records one span of a phase
+
+        Args:
+            name (str): The phase name
+            start (float): Start timestamp
+            end (float): End timestamp
+        """
+
+        phase = self._phase(name)
+        elapsed = end - start
+        if phase['start'] is None or start < phase['start']:
+            phase['start'] = start
+        if phase['end'] is None or end > phase['end']:
+            phase['end'] = end
+        phase['count'] += 1
+        phase['total'] += elapsed
+        phase['max'] = max(phase['max'], elapsed)
+
+
+    def startPhase(self, name):
+        """Starts a synchronous phase"""
+
+        self._open[name] = time.time()
+
+
+    def stopPhase(self, name):
+        """Stops a synchronous phase started with startPhase"""
+
+        start = self._open.pop(name, None)
+        if start is not None:
+            self.recordPhase(name, start, time.time())
+
+
+    def trackDeferred(self, name, d):
+        """
+        Records the time until d fires as one request of the phase
+
+        Args:
+            name (str): The phase name, like 'zone ops'
+            d (twisted.internet.defer.Deferred): The request
+
+        Returns:
+            twisted.internet.defer.Deferred: d itself
+        """
+
+        d.addBoth(self._trackDone, name, time.time())
+        return d
+
+
+    def trackIterator(self, name, iterable):
+        """
+        Records the time spent producing every item of a lazily read source
+        as one span of the phase, whenever the item is consumed
+
+        Args:
+            name (str): The phase name, like 'parse'
+            iterable (iterable): The lazy source
+
+        Yields:
+            The items of iterable
+        """
+
+        self._phase(name)['lazy'] = True
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.recordPhase(name, start, time.time())
+                return
+            self.recordPhase(name, start, time.time())
+            yield item
+
+
+    def _trackDone(self, result, name, start):
+        """Records a finished request and passes the result through"""
+
+        self.recordPhase(name, start, time.time())
+        return result
+
+
+    def start(self):
+        """
+        Starts the heartbeat, the watchdog thread and cProfile.
+        Must be called from the reactor thread once the reactor runs.
+        """
+
+        self._running = True
+        self._reactorThreadId = threading.current_thread().ident
+        self._lastBeat = time.time()
+        self._heartbeat = task.LoopingCall(self._beat)
+        self._heartbeat.start(self.sampleInterval)
+        self._watchdog = threading.Thread(target=self._watch, name='reactor-watchdog')
+        self._watchdog.daemon = True
+        self._watchdog.start()
+        if self.statsFilename:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+
+    def _beat(self):
+        """Heartbeat run by the reactor"""
+
+        self._lastBeat = time.time()
+
+
+    def _watch(self):
+        """
+        Watchdog loop run in its own thread.
+        Reports every stall once, with the stack of the reactor thread at the
+        time the threshold was crossed, and samples stacks for folded output.
+        """
+
+        reportedBeat = None
+        while self._running:
+            time.sleep(self.sampleInterval)
+            frame = sys._current_frames().get(self._reactorThreadId)
+            if frame is None:
+                continue
+            if self.foldedFilename:
+                self._samples[self._fold(frame)] += 1
+
+            lastBeat = self._lastBeat
+            blocked = time.time() - lastBeat
+            if blocked > self.stallThreshold and reportedBeat != lastBeat:
+                reportedBeat = lastBeat
+                self.stalls.append(blocked)
+                stack = ''.join(traceback.format_stack(frame))
+                print 'Reactor blocked for {:.3f}s:\n{}'.format(blocked, stack)
+            elif reportedBeat == lastBeat and self.stalls:
+                self.stalls[-1] = max(self.stalls[-1], blocked)
+
+
+    def _fold(self, frame):
+        """Returns a stack in the folded format read by flamegraph.pl"""
+
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{}:{}'.format(code.co_filename, code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+    def stop(self):
+        """Stops the watchdog, writes the requested outputs and prints the report"""
+
+        self.stopPhase('teardown')
+        self._running = False
+        if self._watchdog is not None:
+            self._watchdog.join()
+        if self._heartbeat is not None and self._heartbeat.running:
+            self._heartbeat.stop()
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.statsFilename)
+            print 'Wrote cProfile stats: {}'.format(self.statsFilename)
+        if self.foldedFilename:
+            with open(self.foldedFilename, 'wb') as f:
+                for stack, count in self._samples.most_common():
+                    f.write('{} {}\n'.format(stack, count))
+            print 'Wrote folded stacks: {}'.format(self.foldedFilename)
+        self.report()
+
+
+    def report(self):
+        """Prints the phase breakdown and the reactor stalls"""
+
+        print 'Profile:'
+        for name, phase in self.phases.iteritems():
+            wall = phase['end'] - phase['start']
+            if phase['lazy']:
+                print '  {:<12} {:.3f}s in {} reads during the import, max {:.3f}s'.format(
+                    name, phase['total'], phase['count'], phase['max'])
+            elif phase['count'] > 1:
+                print '  {:<12} {:.3f}s wall, {} requests, avg {:.3f}s, max {:.3f}s'.format(
+                    name, wall, phase['count'], phase['total'] / phase['count'], phase['max'])
+            else:
+                print '  {:<12} {:.3f}s'.format(name, wall)
+        if self.stalls:
+            print '  Reactor stalls over {}s: {}, longest {:.3f}s'.format(
+                self.stallThreshold, len(self.stalls), max(self.stalls))
+        else:
+            print '  Reactor stalls over {}s: none'.format(self.stallThreshold)
+
+
+    def install(self):
+        """Hooks start and stop into the reactor lifecycle"""
+
+        reactor.callWhenRunning(self.start)
+        reactor.addSystemEventTrigger('after', 'shutdown', self.stop)
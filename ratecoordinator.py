@@ -0,0 +1,409 @@
+import time
+import hashlib
+from collections import deque
+
+from twisted.internet import defer, endpoints, protocol, reactor
+from twisted.protocols.basic import LineReceiver
+
+from ratelimiter import RateLimiter
+
+
+def keyId(apiKey):
+    """
+    Returns the id an api key is known by at the coordinator, so the key
+    itself never leaves the process
+
+    Args:
+        apiKey (str): The Nsone Api Key
+
+    Returns:
+        str
+    """
+
+    return hashlib.sha1(apiKey).hexdigest()[:16]
+
+
+class CoordinatorProtocol(LineReceiver):
+    """
+    One importer process connected to the RateCoordinator.
+
+    Lines sent by the importer:
+        HELLO <name> <weight>      names the job and sets its priority weight
+        ACQUIRE <key id> <count>   asks for count request tokens of a key
+
+    Lines sent by the coordinator:
+        GRANT <key id> <count>     count tokens were granted
+        ERROR <message>
+    """
+
+    delimiter = '\n'
+
+
+    def connectionMade(self):
+        self.name = '{}'.format(self.transport.getPeer())
+        self.weight = 1.0
+
+
+    def lineReceived(self, line):
+        parts = line.split()
+        try:
+            if len(parts) == 3 and parts[0] == 'HELLO':
+                self.name = parts[1]
+                self.weight = max(float(parts[2]), 0.01)
+            elif len(parts) == 3 and parts[0] == 'ACQUIRE':
+                count = int(parts[2])
+                if count < 1:
+                    self.sendLine('ERROR count must be at least 1')
+                    return
+                self.factory.coordinator.request(self, parts[1], count)
+            else:
+                self.sendLine('ERROR unknown command')
+        except ValueError as e:
+            self.sendLine('ERROR {}'.format(e))
+
+
+    def connectionLost(self, reason):
+        self.factory.coordinator.drop(self)
+
+
+class RateCoordinator(object):
+    """
+    Host wide request budget shared by every importer process using the same api keys.
+
+    Every api key has one token bucket refilled at `rate` tokens per second.
+    The bucket only saves up `burst` tokens, so the requests of all processes
+    together are paced at the limit instead of bursting over it and being
+    throttled. Tokens are handed out by weighted fair queuing: every waiting
+    process has a virtual time that advances by 1 / weight per granted token
+    and the next token goes to the waiting process with the lowest one. A
+    process that starts waiting joins at the virtual time of the others, so
+    being idle earns no credit.
+
+    Attributes:
+        rate (float): Requests per second per api key
+        burst (float): Tokens a bucket can save up
+        granted (int): Tokens handed out so far
+        clients (set): Connected importer processes
+    """
+
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float): Requests per second per api key
+            burst (float): Bucket size, defaults to a single token
+        """
+
+        self.rate = float(rate)
+        self.burst = float(burst or 1)
+        self.granted = 0
+        self.clients = set()
+        self._buckets = {}
+        self._waiting = {}
+        self._virtualTimes = {}
+        self._calls = {}
+
+
+    def request(self, client, keyId, count):
+        """
+        Queues a request of client for count tokens of a key
+
+        Args:
+            client (CoordinatorProtocol): The importer process
+            keyId (str): The key id
+            count (int): Tokens asked for
+        """
+
+        self.clients.add(client)
+        waiting = self._waiting.setdefault(keyId, {})
+        virtualTimes = self._virtualTimes.setdefault(keyId, {})
+        if client not in waiting:
+            start = min(virtualTimes[other] for other in waiting) if waiting else 0.0
+            virtualTimes[client] = max(virtualTimes.get(client, 0.0), start)
+        waiting[client] = waiting.get(client, 0) + count
+        self._drain(keyId)
+
+
+    def drop(self, client):
+        """Forgets a process that disconnected"""
+
+        self.clients.discard(client)
+        for keyId in self._waiting.keys():
+            self._waiting[keyId].pop(client, None)
+            self._virtualTimes[keyId].pop(client, None)
+
+
+    def _refill(self, keyId):
+        """Adds the tokens a key earned since its last refill and returns its bucket"""
+
+        now = time.time()
+        bucket = self._buckets.setdefault(keyId, [self.burst, now])
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        return bucket
+
+
+    def _drain(self, keyId):
+        """Grants the available tokens of a key fairly and schedules the next grant"""
+
+        bucket = self._refill(keyId)
+        waiting = self._waiting[keyId]
+        virtualTimes = self._virtualTimes[keyId]
+        grants = {}
+        while waiting and bucket[0] >= 1:
+            client = min(waiting, key=virtualTimes.get)
+            bucket[0] -= 1
+            virtualTimes[client] += 1.0 / client.weight
+            grants[client] = grants.get(client, 0) + 1
+            waiting[client] -= 1
+            if not waiting[client]:
+                del waiting[client]
+        for client, count in grants.iteritems():
+            self.granted += count
+            client.sendLine('GRANT {} {}'.format(keyId, count))
+        if waiting and keyId not in self._calls:
+            delay = (1 - bucket[0]) / self.rate
+            self._calls[keyId] = reactor.callLater(delay, self._wake, keyId)
+
+
+    def _wake(self, keyId):
+        """Timer callback"""
+
+        del self._calls[keyId]
+        self._drain(keyId)
+
+
+    def listen(self, description):
+        """
+        Starts serving the coordinator
+
+        Args:
+            description (str): Endpoint like unix:/tmp/nsoneimporter-rate.sock
+        """
+
+        factory = protocol.Factory()
+        factory.protocol = CoordinatorProtocol
+        factory.coordinator = self
+        return endpoints.serverFromString(reactor, description).listen(factory)
+
+
+    def run(self, description):
+        """Serves the coordinator until the process is stopped"""
+
+        d = self.listen(description)
+        d.addCallback(self._listening, description)
+        d.addErrback(self._listenFailure)
+        reactor.run()
+
+
+    def _listening(self, port, description):
+        print 'Rate coordinator for {} requests/s per key listening on {}'.format(self.rate,
+                                                                                 description)
+        return port
+
+
+    def _listenFailure(self, failure):
+        print failure.getErrorMessage()
+        reactor.stop()
+
+
+class CoordinatorClientProtocol(LineReceiver):
+    """The connection of an importer process to the RateCoordinator"""
+
+    delimiter = '\n'
+
+
+    def connectionMade(self):
+        self.factory.client.connected(self)
+
+
+    def lineReceived(self, line):
+        parts = line.split()
+        if len(parts) == 3 and parts[0] == 'GRANT':
+            self.factory.client.granted(parts[1], int(parts[2]))
+        else:
+            print 'Rate coordinator: {}'.format(line)
+
+
+    def connectionLost(self, reason):
+        self.factory.client.disconnected(reason)
+
+
+class CoordinatedRateLimiter(object):
+    """
+    Rate limiter drawing its tokens from the RateCoordinator.
+    It has the acquire() interface of RateLimiter, so the pooled transport
+    uses either one the same way.
+
+    Attributes:
+        keyId (str): The id of the api key at the coordinator
+        granted (int): Tokens handed out so far
+    """
+
+
+    def __init__(self, client, apiKey):
+        """
+        Args:
+            client (RateCoordinatorClient): The connection to the coordinator
+            apiKey (str): The Nsone Api Key
+        """
+
+        self.keyId = keyId(apiKey)
+        self.granted = 0
+        self._client = client
+        self._waiting = deque()
+        self._fallback = None
+
+
+    def acquire(self):
+        """
+        Returns a deferred that fires when the caller may send a request
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        if self._fallback is not None:
+            return self._fallback.acquire()
+        d = defer.Deferred()
+        self._waiting.append(d)
+        self._client.request(self.keyId, 1)
+        return d
+
+
+    def grant(self, count):
+        """Serves count waiters in the order they asked"""
+
+        for _ in xrange(min(count, len(self._waiting))):
+            self.granted += 1
+            self._waiting.popleft().callback(None)
+
+
+    def fallBack(self, limiter):
+        """
+        Serves the current and future waiters from a local limiter once the
+        coordinator is gone, without a limit if limiter is None
+
+        Args:
+            limiter (ratelimiter.RateLimiter): The local limiter
+        """
+
+        waiting, self._waiting = self._waiting, deque()
+        self._fallback = limiter
+        for d in waiting:
+            if limiter is None:
+                d.callback(None)
+            else:
+                limiter.acquire().chainDeferred(d)
+
+
+class RateCoordinatorClient(object):
+    """
+    Connection of one importer process to the RateCoordinator.
+
+    Token requests made before the connection is up are sent once it is.
+    If the coordinator cannot be reached or goes away, every limiter falls
+    back to a local RateLimiter at fallbackRate, or to no limit.
+
+    Attributes:
+        name (str): The job name shown to the coordinator
+        weight (float): The priority weight of the job
+        fallbackRate (float): Local requests per second per key without the coordinator
+        limiters (dict): key id -> CoordinatedRateLimiter
+    """
+
+
+    def __init__(self, description, name, weight=1.0, fallbackRate=None):
+        """
+        Args:
+            description (str): Endpoint of the coordinator, like unix:/tmp/nsoneimporter-rate.sock
+            name (str): The job name
+            weight (float): Priority weight, a job with weight 2 gets twice the share of weight 1
+            fallbackRate (float): Requests per second per key if the coordinator is unavailable
+        """
+
+        self.name = name
+        self.weight = weight
+        self.fallbackRate = fallbackRate
+        self.limiters = {}
+        self._protocol = None
+        self._unsent = {}
+        self._failed = False
+        self._stopping = False
+        reactor.addSystemEventTrigger('before', 'shutdown', self._stop)
+
+        factory = protocol.ClientFactory()
+        factory.protocol = CoordinatorClientProtocol
+        factory.client = self
+        d = endpoints.clientFromString(reactor, description).connect(factory)
+        d.addErrback(self.disconnected)
+
+
+    def limiterFor(self, apiKey):
+        """
+        Returns the limiter of an api key
+
+        Args:
+            apiKey (str): The Nsone Api Key
+
+        Returns:
+            CoordinatedRateLimiter
+        """
+
+        limiter = CoordinatedRateLimiter(self, apiKey)
+        self.limiters[limiter.keyId] = limiter
+        if self._failed:
+            limiter.fallBack(self._localLimiter())
+        return limiter
+
+
+    def _localLimiter(self):
+        """Returns the limiter used without the coordinator"""
+
+        return RateLimiter(self.fallbackRate) if self.fallbackRate else None
+
+
+    def request(self, keyId, count):
+        """Asks the coordinator for tokens, or queues the request until connected"""
+
+        if self._protocol is None:
+            self._unsent[keyId] = self._unsent.get(keyId, 0) + count
+        else:
+            self._protocol.sendLine('ACQUIRE {} {}'.format(keyId, count))
+
+
+    def connected(self, clientProtocol):
+        """Introduces the job and sends the queued requests"""
+
+        self._protocol = clientProtocol
+        clientProtocol.sendLine('HELLO {} {}'.format(self.name.replace(' ', '_'), self.weight))
+        unsent, self._unsent = self._unsent, {}
+        for keyId, count in unsent.iteritems():
+            self.request(keyId, count)
+
+
+    def granted(self, keyId, count):
+        """Hands granted tokens to the limiter of the key"""
+
+        limiter = self.limiters.get(keyId)
+        if limiter is not None:
+            limiter.grant(count)
+
+
+    def disconnected(self, reason):
+        """Falls back to local limiting once the coordinator is gone"""
+
+        self._protocol = None
+        if self._failed or self._stopping:
+            return
+        self._failed = True
+        print 'Rate coordinator unavailable ({}), limiting locally at {} requests/s'.format(
+            reason.getErrorMessage(), self.fallbackRate or 'unlimited')
+        for limiter in self.limiters.itervalues():
+            limiter.fallBack(self._localLimiter())
+
+
+    def _stop(self):
+        """Keeps the shutdown of the reactor from looking like a lost coordinator"""
+
+        self._stopping = True
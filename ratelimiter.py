@@ -0,0 +1,122 @@
+import time
+import threading
+from collections import deque
+
+from twisted.internet import defer, reactor
+
+
+class RateLimiter(object):
+    """
+    Token bucket handing out request tokens at a fixed rate.
+
+    acquire() returns a deferred that fires once a token is available.
+    Waiters are served in the order they asked, so no request starves.
+
+    Attributes:
+        rate (float): Tokens added per second
+        burst (float): Maximum number of tokens that can be saved up
+        granted (int): Tokens handed out so far
+    """
+
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float): Requests per second
+            burst (float): Bucket size, defaults to one second worth of tokens
+        """
+
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.granted = 0
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._waiting = deque()
+        self._call = None
+
+
+    def acquire(self):
+        """
+        Returns a deferred that fires when the caller may send a request
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        d = defer.Deferred()
+        self._waiting.append(d)
+        self._drain()
+        return d
+
+
+    def _refill(self):
+        """Adds the tokens earned since the last refill"""
+
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+    def _drain(self):
+        """Serves waiters while tokens are left and schedules the next wake up"""
+
+        self._refill()
+        while self._waiting and self._tokens >= 1:
+            self._tokens -= 1
+            self.granted += 1
+            self._waiting.popleft().callback(None)
+        if self._waiting and self._call is None:
+            delay = (1 - self._tokens) / self.rate
+            self._call = reactor.callLater(delay, self._wake)
+
+
+    def _wake(self):
+        """Timer callback"""
+
+        self._call = None
+        self._drain()
+
+
+class BlockingRateLimiter(object):
+    """
+    Thread safe token bucket for blocking clients, like the threads engine.
+
+    acquire() blocks the calling thread until its token is due. Every caller
+    reserves the next token under a lock and then sleeps outside of it, so
+    threads are served in the order they asked and the rate holds across
+    all of them.
+
+    Attributes:
+        rate (float): Tokens added per second
+        burst (float): Maximum number of tokens that can be saved up
+        granted (int): Tokens handed out so far
+    """
+
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float): Requests per second
+            burst (float): Bucket size, defaults to one second worth of tokens
+        """
+
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.granted = 0
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        """Blocks until the caller may send a request"""
+
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            self.granted += 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,290 @@
+import hashlib
+from collections import OrderedDict
+
+
+ACTIONS = ('upsert', 'delete-record', 'delete-zone', 'replace-answers', 'remove-answers')
+
+# record type -> positions of the answer tokens compared without case, host names and IPv6 addresses
+NAME_TOKENS = {
+    'CNAME': (0,),
+    'NS': (0,),
+    'PTR': (0,),
+    'ALIAS': (0,),
+    'DNAME': (0,),
+    'MX': (1,),
+    'SRV': (3,),
+    'AAAA': (0,)
+}
+
+
+def domainFor(zoneName, name):
+    """
+    Returns the fully qualified, lower cased domain for a record name of the csv.
+    Domains are case insensitive, so www and WWW name the same NS1 record.
+
+    Args:
+        zoneName (str): The zone name, like example.test
+        name (str): The record name, like @, www or www.example.test.
+
+    Returns:
+        str
+    """
+
+    zoneName = zoneName.lower()
+    name = name.strip()
+    if name in ('', '@'):
+        return zoneName
+    name = name.rstrip('.').lower()
+    if name == zoneName or name.endswith('.' + zoneName):
+        return name
+    return '{}.{}'.format(name, zoneName)
+
+
+def recordKey(domain, recType):
+    """
+    Returns the (domain, type) identity of a record, the domain compares
+    without case and trailing dot like NS1 does
+
+    Args:
+        domain (str): The record domain, from the csv or the api
+        recType (str): The record type
+
+    Returns:
+        tuple
+    """
+
+    return domain.rstrip('.').lower(), recType.upper()
+
+
+def answerTokens(rec):
+    """
+    Returns the answer tokens of a record. Csv rows are split on whitespace,
+    records that carry their tokens in an Answer list, like TXT records
+    pulled with a zone transfer, keep them as they are.
+
+    Args:
+        rec (dict): A record with a Data and an optional Answer field
+
+    Returns:
+        list
+    """
+
+    if rec.get('Answer') is not None:
+        return list(rec['Answer'])
+    return rec['Data'].split()
+
+
+def answerKey(answer, recType):
+    """
+    Returns a hashable, normalized form of an answer so answers from the csv
+    and answers returned by the api compare equal field by field.
+
+    Host names (the targets of CNAME, NS, MX, SRV, ...) and IPv6 addresses
+    compare without case and trailing dot, every other field, like TXT data,
+    compares exactly.
+
+    Args:
+        answer (list|dict): Answer tokens like ['10', 'mail.example.test']
+            or an api answer like {'answer': [10, 'mail.example.test']}
+        recType (str): The record type
+
+    Returns:
+        tuple
+    """
+
+    if isinstance(answer, dict):
+        answer = answer['answer']
+    nameTokens = NAME_TOKENS.get(recType.upper(), ())
+    return tuple(str(token).strip().rstrip('.').lower() if position in nameTokens
+                 else str(token).strip()
+                 for position, token in enumerate(answer))
+
+
+def uniqueAnswers(answers, recType):
+    """
+    Removes duplicate answers while keeping their order
+
+    Args:
+        answers (list): A list of answer token lists
+        recType (str): The record type
+
+    Returns:
+        list
+    """
+
+    seen = set()
+    unique = []
+    for answer in answers:
+        key = answerKey(answer, recType)
+        if key not in seen:
+            seen.add(key)
+            unique.append(answer)
+    return unique
+
+
+def missingAnswers(existing, answers, recType):
+    """
+    Returns the answers that are not part of existing
+
+    Args:
+        existing (list): The api answers of a record
+        answers (list): Answer token lists to merge in
+        recType (str): The record type
+
+    Returns:
+        list
+    """
+
+    existingKeys = {answerKey(answer, recType) for answer in existing}
+    return [answer for answer in uniqueAnswers(answers, recType)
+            if answerKey(answer, recType) not in existingKeys]
+
+
+def remainingAnswers(existing, answers, recType):
+    """
+    Returns the answers of existing that are not removed by answers
+
+    Args:
+        existing (list): The api answers of a record
+        answers (list): Answer token lists to remove
+        recType (str): The record type
+
+    Returns:
+        list
+    """
+
+    removedKeys = {answerKey(answer, recType) for answer in answers}
+    return [answer for answer in existing if answerKey(answer, recType) not in removedKeys]
+
+
+def groupRecords(zoneName, records):
+    """
+    Groups the csv records of a zone by (domain, type) in first seen order
+    so all answers of a record can be sent in a single request.
+
+    Args:
+        zoneName (str): The zone name
+        records (list): The records of the zone
+
+    Returns:
+        list: ((domain, type), records) tuples
+    """
+
+    groups = OrderedDict()
+    for rec in records:
+        key = recordKey(domainFor(zoneName, rec['Name']), rec['Type'])
+        groups.setdefault(key, []).append(rec)
+    return groups.items()
+
+
+def recordName(zoneName, domain):
+    """
+    Returns the csv record name for a fully qualified domain, the inverse of domainFor
+
+    Args:
+        zoneName (str): The zone name, like example.test
+        domain (str): The record domain, like www.example.test
+
+    Returns:
+        str
+    """
+
+    domain = domain.rstrip('.')
+    zoneName = zoneName.lower()
+    if domain.lower() == zoneName:
+        return '@'
+    suffix = '.' + zoneName
+    if domain.lower().endswith(suffix):
+        return domain[:-len(suffix)]
+    return domain + '.'
+
+
+def zoneShape(zoneName, records):
+    """
+    Returns a hash of the records of a zone with their names made relative
+    to the zone, so zones serving the same record set under different names
+    have the same shape. Answers that mention the zone name make the shape
+    differ, since a linked zone would serve the answers of its source zone.
+
+    Args:
+        zoneName (str): The zone name
+        records (list): The records of the zone
+
+    Returns:
+        str
+    """
+
+    rows = set('{}\t{}\t{}\t{}'.format(recordName(zoneName, domainFor(zoneName, rec['Name'])),
+                                      rec['Type'].upper(), str(rec['TTL']).strip(),
+                                      ' '.join(answerKey(answerTokens(rec), rec['Type'])))
+               for rec in records)
+    return hashlib.sha1('\n'.join(sorted(rows))).hexdigest()
+
+
+def recordAction(rec):
+    """
+    Returns the action of a record, rows without an Action column are upserts
+
+    Args:
+        rec (dict): A csv record
+
+    Returns:
+        str
+    """
+
+    return (rec.get('Action') or 'upsert').strip().lower()
+
+
+def hasActions(records):
+    """
+    Returns whether any record of a zone does something else than an upsert
+
+    Args:
+        records (list): The records of the zone
+
+    Returns:
+        bool
+    """
+
+    return any(recordAction(rec) != 'upsert' for rec in records)
+
+
+def splitZoneDelete(records):
+    """
+    Splits the records of a zone at its last delete-zone row.
+    Rows before it would be deleted with the zone anyway, so only the
+    rows after it are kept.
+
+    Args:
+        records (list): The records of the zone
+
+    Returns:
+        tuple: (whether the zone is deleted first, the remaining records)
+    """
+
+    for position in xrange(len(records) - 1, -1, -1):
+        if recordAction(records[position]) == 'delete-zone':
+            return True, records[position + 1:]
+    return False, records
+
+
+def actionRuns(records):
+    """
+    Splits the records of one (domain, type) group into runs of consecutive
+    rows with the same action, which have to be applied in order
+
+    Args:
+        records (list): The records of the group in file order
+
+    Returns:
+        list: (action, records) tuples
+    """
+
+    runs = []
+    for rec in records:
+        action = recordAction(rec)
+        if runs and runs[-1][0] == action:
+            runs[-1][1].append(rec)
+        else:
+            runs.append((action, [rec]))
+    return runs
@@ -1,12 +1,102 @@
+import os
+import time
+
 from zonedataparser import ZoneDataParser
 from nsoneimporter import NsoneImporter
+from nsoneexporter import NsoneExporter
+from importservice import ImportService
+from keyrouter import KeyRouter
+from pooledtransport import setRateLimit, setRateLimiter
+from ratecoordinator import RateCoordinator, RateCoordinatorClient
+from profiler import ImportProfiler
+from zonewatcher import ZoneWatcher
+from zoneverifier import ZoneVerifier
+from zonetransfer import ZoneTransfer
 
 def run():
+    started = time.time()
     zoneDataParser = ZoneDataParser()
     args = zoneDataParser.getArgs()
-    data = zoneDataParser.loadZoneData(args.filename)
+    zoneFilter = zoneDataParser.getZoneFilter(args)
+
+    if args.serveRateCoordinator:
+        rateCoordinator = RateCoordinator(args.rate)
+        rateCoordinator.run(args.serveRateCoordinator)
+        return
+
+    if args.serve:
+        apiKey = args.apikey[0] if args.apikey else None
+        token = None
+        if args.serveTokenFile:
+            with open(args.serveTokenFile, 'rb') as f:
+                token = f.read().strip()
+        importService = ImportService(apiKey, args.workers, args.rate, token, args.serveDir)
+        importService.run(args.serve)
+        return
+
+    keyRouter = KeyRouter.fromFile(args.apikey, args.keyZones)
+    if args.rateCoordinator:
+        jobName = '{}-{}'.format(os.path.basename(args.filename or 'transfer'), os.getpid())
+        rateCoordinatorClient = RateCoordinatorClient(args.rateCoordinator, jobName, args.priority,
+                                                      args.rate)
+        for apiKey in keyRouter.apiKeys:
+            setRateLimiter(apiKey, rateCoordinatorClient.limiterFor(apiKey))
+    elif args.rate:
+        for apiKey in keyRouter.apiKeys:
+            setRateLimit(apiKey, args.rate)
+
+    if args.export:
+        nsoneExporter = NsoneExporter(args.apikey[0], args.export, args.concurrency or 20, zoneFilter)
+        nsoneExporter.run()
+        return
+
+    if args.transferFrom:
+        zones = sorted(zoneFilter.zones) if zoneFilter is not None else []
+        zoneTransfer = ZoneTransfer(args.transferFrom, zones, args.apikey, keyRouter,
+                                    zoneFilter, args.concurrency or 10,
+                                    stateFilename=args.transferState)
+        zoneTransfer.run()
+        return
+
+    if args.watch:
+        zoneWatcher = ZoneWatcher(args.filename, args.apikey, keyRouter, args.workers, zoneFilter,
+                                  args.watchInterval)
+        zoneWatcher.run()
+        return
+
+    profiler = None
+    if args.profile:
+        profiler = ImportProfiler(args.stallThreshold, args.profileStats, args.profileFolded)
+        profiler.recordPhase('validate', started, time.time())
+
+    parseStarted = time.time()
+    data = zoneDataParser.loadZoneData(args.filename, args.workers, zoneFilter, args.cache)
+    if profiler is not None:
+        profiler.recordPhase('parse', parseStarted, time.time())
+        data = profiler.trackIterator('parse', data)
+
+    if args.engine == 'threads':
+        # requests and futures are only needed by the threads engine
+        from threadedimporter import ThreadedImporter
+        threadedImporter = ThreadedImporter(args.apikey, data, args.delete, args.concurrency or 20,
+                                            keyRouter, rate=args.rate)
+        threadedImporter.run()
+        return
+
+    if args.verify and not args.delete:
+        nsoneImporter = NsoneImporter(args.apikey, iter([]), args.delete, profiler,
+                                      keyRouter=keyRouter, linkZones=args.linkZones)
+        zoneVerifier = ZoneVerifier(nsoneImporter, data, args.concurrency or 20,
+                                    args.verifyReport, args.verifyRequeue)
+        nsoneImporter.run(zoneVerifier.verify, zoneVerifier.importZones)
+        return
 
-    nsoneImporter = NsoneImporter(args.apikey, data, args.delete)
+    concurrency = args.concurrency
+    if concurrency is None and os.path.splitext(args.filename)[1] == '.json':
+        # templates are expanded while the zones are pulled, a bound keeps them out of memory
+        concurrency = 20
+    nsoneImporter = NsoneImporter(args.apikey, data, args.delete, profiler, keyRouter=keyRouter,
+                                  concurrency=concurrency, linkZones=args.linkZones)
     nsoneImporter.run()
 
 if __name__ == '__main__':
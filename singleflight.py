@@ -0,0 +1,60 @@
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls for the same key into one in-flight request.
+
+    The first caller for a key starts the request. Every caller that asks for
+    the same key before it finishes receives a deferred that fires with the
+    same result, or the same failure, without touching the network again.
+    Once the request finishes the key is forgotten, so later calls fetch
+    fresh data.
+
+    Attributes:
+        hits (int): Calls that joined a request already in flight
+        misses (int): Calls that started a new request
+        _waiting (dict): key -> list of deferreds waiting on the in-flight request
+    """
+
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._waiting = {}
+
+
+    def run(self, key, f, *args, **kwargs):
+        """
+        Calls f unless a call for key is already in flight
+
+        Args:
+            key (hashable): Identifies the resource, like ('zone', 'example.test')
+            f (function): Function returning a deferred
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        d = defer.Deferred()
+        if key in self._waiting:
+            self.hits += 1
+            self._waiting[key].append(d)
+            return d
+
+        self.misses += 1
+        self._waiting[key] = [d]
+        request = defer.maybeDeferred(f, *args, **kwargs)
+        request.addBoth(self._release, key)
+        return d
+
+
+    def _release(self, result, key):
+        """Fires every waiting deferred of key with the result"""
+
+        for d in self._waiting.pop(key):
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
@@ -0,0 +1,248 @@
+import json
+
+from nsone import NSONE, Config
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+from twisted.web import resource, server
+
+import pooledtransport
+from nsoneimporter import NsoneImporter
+from pooledtransport import TRANSPORT
+
+
+class FakeNsoneApi(resource.Resource):
+    """
+    In-memory stand-in of the parts of the NS1 rest api the importers use,
+    answering every request after a fixed latency like a remote api would.
+
+    Attributes:
+        latency (float): Seconds every response is delayed
+        zones (dict): zone name -> {'records': {(domain, type): record}}
+        requests (int): Requests served so far
+    """
+
+    isLeaf = True
+
+
+    def __init__(self, latency=0.02):
+        """
+        Args:
+            latency (float): Seconds every response is delayed
+        """
+
+        resource.Resource.__init__(self)
+        self.latency = latency
+        self.zones = {}
+        self.requests = 0
+
+
+    def render(self, request):
+        """Answers the request after the latency"""
+
+        self.requests += 1
+        body = request.content.read()
+        reactor.callLater(self.latency, self._respond, request, body)
+        return server.NOT_DONE_YET
+
+
+    def _respond(self, request, body):
+        """Writes the response of a request"""
+
+        path = [segment for segment in request.postpath if segment]
+        try:
+            code, response = self._handle(request.method, path[1:], json.loads(body or '{}'))
+        except (KeyError, ValueError, IndexError) as e:
+            code, response = 400, {'message': 'bad request: {}'.format(e)}
+        request.setResponseCode(code)
+        request.setHeader('content-type', 'application/json')
+        request.write(json.dumps(response))
+        request.finish()
+
+
+    def _handle(self, method, path, body):
+        """
+        Applies one api call to the zones
+
+        Args:
+            method (str): The http method
+            path (list): The path below /v1
+            body (dict): The json body
+
+        Returns:
+            tuple: (http code, response body)
+        """
+
+        if path == ['zones'] and method == 'GET':
+            return 200, [{'zone': zoneName} for zoneName in self.zones]
+        if len(path) == 2 and path[0] == 'zones':
+            return self._handleZone(method, path[1], body)
+        if len(path) == 4 and path[0] == 'zones':
+            return self._handleRecord(method, path[1], path[2].lower(), path[3].upper(), body)
+        return 404, {'message': 'not found'}
+
+
+    def _zoneData(self, zoneName):
+        """Returns the zone details the api returns"""
+
+        zone = self.zones[zoneName]
+        records = [{'domain': rec['domain'], 'type': rec['type'], 'ttl': rec['ttl'],
+                    'short_answers': [' '.join(str(token) for token in answer['answer'])
+                                      for answer in rec['answers']]}
+                   for rec in zone['records'].itervalues()]
+        return {'zone': zoneName, 'link': zone.get('link'), 'records': records}
+
+
+    def _handleZone(self, method, zoneName, body):
+        """Creates, loads or deletes a zone"""
+
+        if method == 'PUT':
+            if zoneName in self.zones:
+                return 400, {'message': 'zone already exists'}
+            self.zones[zoneName] = {'records': {}, 'link': body.get('link')}
+            return 200, self._zoneData(zoneName)
+        if zoneName not in self.zones:
+            return 404, {'message': 'zone not found'}
+        if method == 'GET':
+            return 200, self._zoneData(zoneName)
+        if method == 'DELETE':
+            del self.zones[zoneName]
+            return 200, {}
+        return 405, {'message': 'method not allowed'}
+
+
+    def _handleRecord(self, method, zoneName, domain, recType, body):
+        """Creates, loads, updates or deletes a record"""
+
+        if zoneName not in self.zones:
+            return 404, {'message': 'zone not found'}
+        records = self.zones[zoneName]['records']
+        key = (domain, recType)
+        if method == 'PUT':
+            if key in records:
+                return 400, {'message': 'record already exists'}
+            records[key] = {'zone': zoneName, 'domain': domain, 'type': recType,
+                            'ttl': body.get('ttl'), 'answers': body.get('answers', [])}
+            return 200, records[key]
+        if key not in records:
+            return 404, {'message': 'record not found'}
+        if method == 'GET':
+            return 200, records[key]
+        if method == 'POST':
+            for field in ('answers', 'ttl'):
+                if field in body:
+                    records[key][field] = body[field]
+            return 200, records[key]
+        if method == 'DELETE':
+            del records[key]
+            return 200, {}
+        return 405, {'message': 'method not allowed'}
+
+
+class LocalConfig(Config):
+    """nsone config sending every request to a local endpoint over plain http"""
+
+    endpoint = None
+
+
+    def getEndpoint(self):
+        return self.endpoint
+
+
+def localClient(apiKey, transport, endpoint):
+    """
+    Returns an nsone client talking to the fake api
+
+    Args:
+        apiKey (str): The api key sent with the requests
+        transport (str): The nsone transport
+        endpoint (str): Base url like http://127.0.0.1:8053/v1/
+
+    Returns:
+        nsone.NSONE
+    """
+
+    config = LocalConfig()
+    config.createFromAPIKey(apiKey)
+    config['transport'] = transport
+    config.endpoint = endpoint
+    return NSONE(config=config)
+
+
+class LocalNsoneImporter(NsoneImporter):
+    """
+    The twisted engine pointed at the fake api
+
+    Attributes:
+        endpoint (str): Base url of the fake api
+    """
+
+
+    def __init__(self, endpoint, *args, **kwargs):
+        """
+        Args:
+            endpoint (str): Base url like http://127.0.0.1:8053/v1/
+            args, kwargs: The arguments of NsoneImporter
+        """
+
+        self.endpoint = endpoint
+        NsoneImporter.__init__(self, *args, **kwargs)
+
+
+    def _createClient(self, apiKey):
+        return localClient(apiKey, TRANSPORT, self.endpoint)
+
+
+class FakeApiTestCase(unittest.TestCase):
+    """
+    Serves a fresh fake api without latency on a local port for every test
+
+    Attributes:
+        api (FakeNsoneApi): The fake api of the test
+        endpoint (str): Its base url
+        messages (list): Progress messages of the importers created with importer()
+    """
+
+
+    def setUp(self):
+        self.api = FakeNsoneApi(latency=0)
+        self.apiPort = reactor.listenTCP(0, server.Site(self.api), interface='127.0.0.1')
+        self.endpoint = 'http://127.0.0.1:{}/v1/'.format(self.apiPort.getHost().port)
+        self.messages = []
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield pooledtransport.getPool().closeCachedConnections()
+        yield self.apiPort.stopListening()
+
+
+    def importer(self, data, delete=False, **kwargs):
+        """Returns an importer of data talking to the fake api"""
+
+        return LocalNsoneImporter(self.endpoint, 'testkey', iter(data), delete,
+                                  progress=self.messages.append, **kwargs)
+
+
+    def runImporter(self, data, delete=False, **kwargs):
+        """Runs an importer of data and returns it once every request is done"""
+
+        importer = self.importer(data, delete, **kwargs)
+        d = importer.start()
+        d.addCallback(lambda result: importer)
+        return d
+
+
+    def addRecord(self, zoneName, domain, recType, answers, ttl=300):
+        """Stores a record in the fake api, creating its zone if needed"""
+
+        zone = self.api.zones.setdefault(zoneName, {'link': None, 'records': {}})
+        zone['records'][(domain, recType)] = {'zone': zoneName, 'domain': domain, 'type': recType,
+                                              'ttl': ttl,
+                                              'answers': [{'answer': answer} for answer in answers]}
+
+
+    def answers(self, zoneName, domain, recType):
+        """Returns the sorted answers of a record of the fake api"""
+
+        record = self.api.zones[zoneName]['records'][(domain, recType)]
+        return sorted(answer['answer'] for answer in record['answers'])
@@ -0,0 +1,54 @@
+import os
+
+from twisted.trial import unittest
+
+from csvindex import CsvIndexReader
+
+
+HEADER = 'Zone,Name,Type,TTL,Data\n'
+
+
+class CsvIndexReaderTest(unittest.TestCase):
+    """Tests of the on disk zone index"""
+
+
+    def setUp(self):
+        self.filename = self.mktemp()
+        self.write(HEADER + 'a.test,www,A,300,1.1.1.1\nb.test,www,A,300,2.2.2.2\n')
+
+
+    def write(self, content, mtime=1000000000):
+        with open(self.filename, 'wb') as f:
+            f.write(content)
+        os.utime(self.filename, (mtime, mtime))
+
+
+    def test_indexUsedForUnchangedFile(self):
+        reader = CsvIndexReader(self.filename, workers=1)
+        reader.parse()
+
+        self.assertEqual(list(reader.readZones(['b.test'])),
+                         [('b.test', [{'Data': '2.2.2.2', 'Type': 'A', 'Name': 'www', 'TTL': '300'}])])
+
+
+    def test_changedContentWithSameSizeAndMtimeIsStale(self):
+        reader = CsvIndexReader(self.filename, workers=1)
+        reader.parse()
+
+        self.write(HEADER + 'b.test,www,A,300,2.2.2.2\na.test,www,A,300,1.1.1.1\n')
+
+        self.assertIdentical(reader.loadIndex(), None)
+
+
+    def test_zoneNamesInFileOrder(self):
+        self.write(HEADER + ''.join('{}.test,www,A,300,1.1.1.1\n'.format(name)
+                                    for name in ('m', 'b', 'x', 'caf\xc3\xa9', 'a', 'b')))
+        reader = CsvIndexReader(self.filename, workers=1)
+        reader.parse()
+
+        zoneNames = reader.zoneNames()
+
+        self.assertEqual(zoneNames, ['m.test', 'b.test', 'x.test', 'caf\xc3\xa9.test', 'a.test'])
+        self.assertEqual([type(zoneName) for zoneName in zoneNames], [str] * 5)
+        self.assertEqual([zoneName for zoneName, records in reader.readZones(['caf\xc3\xa9.test'])],
+                         ['caf\xc3\xa9.test'])
@@ -0,0 +1,71 @@
+from twisted.internet import defer
+
+from tests.fakensone import FakeApiTestCase
+
+
+def zoneRecords(target):
+    """Returns the records of a zone, its CNAME points at target"""
+
+    return [{'Name': 'www', 'Type': 'A', 'TTL': '300', 'Data': '10.0.0.1'},
+            {'Name': 'www', 'Type': 'A', 'TTL': '300', 'Data': '10.0.0.2'},
+            {'Name': 'ftp', 'Type': 'CNAME', 'TTL': '300', 'Data': target}]
+
+
+class LinkZonesTest(FakeApiTestCase):
+    """Imports with --link-zones against the local fake NS1 api"""
+
+
+    def importZones(self, data):
+        """Imports data with linked zones and returns the importer once done"""
+
+        return self.runImporter(data, linkZones=True)
+
+
+    @defer.inlineCallbacks
+    def test_linkedZoneCreated(self):
+        importer = yield self.importZones([('one.test', zoneRecords('web.example.com')),
+                                           ('two.test', zoneRecords('web.example.com'))])
+
+        self.assertEqual(importer.linkStats, {'linked': 1, 'sources': 1, 'fallbacks': 0})
+        self.assertEqual(self.api.zones['two.test']['link'], 'one.test')
+        self.assertEqual(self.api.zones['two.test']['records'], {})
+        self.assertEqual(self.answers('one.test', 'www.one.test', 'A'), [['10.0.0.1'], ['10.0.0.2']])
+        self.assertEqual(importer.failedZones, set())
+
+
+    @defer.inlineCallbacks
+    def test_recordsNamingTheirZoneImportedPerRecord(self):
+        importer = yield self.importZones([('one.test', zoneRecords('web.one.test')),
+                                           ('two.test', zoneRecords('web.two.test'))])
+
+        self.assertEqual(importer.linkStats, {'linked': 0, 'sources': 2, 'fallbacks': 0})
+        self.assertIdentical(self.api.zones['two.test']['link'], None)
+        self.assertEqual(self.answers('two.test', 'ftp.two.test', 'CNAME'), [['web.two.test']])
+        self.assertEqual(self.answers('two.test', 'www.two.test', 'A'), [['10.0.0.1'], ['10.0.0.2']])
+
+
+    @defer.inlineCallbacks
+    def test_existingUnlinkedZoneUpdated(self):
+        self.addRecord('two.test', 'www.two.test', 'A', [['10.0.0.9']])
+
+        importer = yield self.importZones([('one.test', zoneRecords('web.example.com')),
+                                           ('two.test', zoneRecords('web.example.com'))])
+
+        self.assertEqual(importer.linkStats, {'linked': 0, 'sources': 1, 'fallbacks': 1})
+        self.assertIdentical(self.api.zones['two.test']['link'], None)
+        self.assertEqual(self.answers('two.test', 'www.two.test', 'A'),
+                         [['10.0.0.1'], ['10.0.0.2'], ['10.0.0.9']])
+        self.assertEqual(self.answers('two.test', 'ftp.two.test', 'CNAME'), [['web.example.com']])
+        self.assertIn('Zone two.test is not linked to one.test, importing its records',
+                      self.messages)
+
+
+    @defer.inlineCallbacks
+    def test_zoneAlreadyLinkedLeftAlone(self):
+        self.api.zones['two.test'] = {'link': 'one.test', 'records': {}}
+
+        importer = yield self.importZones([('one.test', zoneRecords('web.example.com')),
+                                           ('two.test', zoneRecords('web.example.com'))])
+
+        self.assertEqual(importer.linkStats, {'linked': 1, 'sources': 1, 'fallbacks': 0})
+        self.assertEqual(self.api.zones['two.test']['records'], {})
@@ -0,0 +1,135 @@
+from twisted.internet import defer
+
+from singleflight import SingleFlight
+from tests.fakensone import FakeApiTestCase
+
+
+def row(name, recType, data, ttl='300', action=None):
+    """Returns a csv row, without an Action column unless action is given"""
+
+    rec = {'Name': name, 'Type': recType, 'TTL': ttl, 'Data': data}
+    if action is not None:
+        rec['Action'] = action
+    return rec
+
+
+class NsoneImporterTest(FakeApiTestCase):
+    """Imports with the twisted engine against the local fake NS1 api"""
+
+
+    @defer.inlineCallbacks
+    def test_namesDifferingInCaseMergedIntoOneRecord(self):
+        self.addRecord('a.test', 'www.a.test', 'A', [['10.0.0.9']])
+
+        importer = yield self.runImporter([('a.test', [row('www', 'A', '10.0.0.1'),
+                                                       row('WWW', 'A', '10.0.0.2'),
+                                                       row('Www.A.TEST.', 'A', '10.0.0.3')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(sorted(self.api.zones['a.test']['records']), [('www.a.test', 'A')])
+        self.assertEqual(self.answers('a.test', 'www.a.test', 'A'),
+                         [['10.0.0.1'], ['10.0.0.2'], ['10.0.0.3'], ['10.0.0.9']])
+
+
+    @defer.inlineCallbacks
+    def test_importersSharingLocksMergeOneAfterTheOther(self):
+        self.api.latency = 0.01
+        self.addRecord('a.test', 'www.a.test', 'A', [['10.0.0.9']])
+        singleFlight = SingleFlight()
+        recordLocks = {}
+        importers = [self.importer([('a.test', [row('www', 'A', address)])],
+                                   singleFlight=singleFlight, recordLocks=recordLocks)
+                     for address in ('10.0.0.1', '10.0.0.2')]
+
+        yield defer.gatherResults([importer.start() for importer in importers])
+
+        self.assertEqual(self.answers('a.test', 'www.a.test', 'A'),
+                         [['10.0.0.1'], ['10.0.0.2'], ['10.0.0.9']])
+        self.assertEqual(recordLocks, {})
+
+
+    @defer.inlineCallbacks
+    def test_upsertCreatesZoneAndRecord(self):
+        importer = yield self.runImporter([('new.test', [row('www', 'A', '10.0.0.1', action='upsert'),
+                                                         row('www', 'A', '10.0.0.2', action='upsert')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(self.answers('new.test', 'www.new.test', 'A'), [['10.0.0.1'], ['10.0.0.2']])
+
+
+    @defer.inlineCallbacks
+    def test_replaceAnswersReplacesEveryAnswer(self):
+        self.addRecord('a.test', 'www.a.test', 'A', [['10.0.0.8'], ['10.0.0.9']])
+
+        importer = yield self.runImporter([('a.test', [row('www', 'A', '10.0.0.1', ttl='60',
+                                                           action='replace-answers')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(self.answers('a.test', 'www.a.test', 'A'), [['10.0.0.1']])
+        self.assertEqual(self.api.zones['a.test']['records'][('www.a.test', 'A')]['ttl'], 60)
+
+
+    @defer.inlineCallbacks
+    def test_removeAnswersKeepsOtherAnswers(self):
+        self.addRecord('a.test', 'www.a.test', 'A', [['10.0.0.8'], ['10.0.0.9']])
+        self.addRecord('a.test', 'mail.a.test', 'A', [['10.0.0.7']])
+
+        importer = yield self.runImporter([('a.test', [row('www', 'A', '10.0.0.9', action='remove-answers'),
+                                                       row('mail', 'A', '10.0.0.7', action='remove-answers')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(self.answers('a.test', 'www.a.test', 'A'), [['10.0.0.8']])
+        # a record left without answers is deleted
+        self.assertEqual(sorted(self.api.zones['a.test']['records']), [('www.a.test', 'A')])
+
+
+    @defer.inlineCallbacks
+    def test_deleteRecordDeletesOnlyThatRecord(self):
+        self.addRecord('a.test', 'www.a.test', 'A', [['10.0.0.9']])
+        self.addRecord('a.test', 'www.a.test', 'AAAA', [['::9']])
+
+        importer = yield self.runImporter([('a.test', [row('www', 'A', '', action='delete-record'),
+                                                       row('gone', 'A', '', action='delete-record')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(sorted(self.api.zones['a.test']['records']), [('www.a.test', 'AAAA')])
+
+
+    @defer.inlineCallbacks
+    def test_deleteZoneRecreatesZoneWithFollowingRows(self):
+        self.addRecord('a.test', 'old.a.test', 'A', [['10.0.0.9']])
+
+        importer = yield self.runImporter([('a.test', [row('', 'SOA', '', action='delete-zone'),
+                                                       row('www', 'A', '10.0.0.1')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(sorted(self.api.zones['a.test']['records']), [('www.a.test', 'A')])
+
+
+    @defer.inlineCallbacks
+    def test_rowsBeforeDeleteZoneDropped(self):
+        self.addRecord('a.test', 'old.a.test', 'A', [['10.0.0.9']])
+
+        importer = yield self.runImporter([('a.test', [row('early', 'A', '10.0.0.1'),
+                                                       row('', 'SOA', '', action='delete-zone'),
+                                                       row('www', 'A', '10.0.0.2', action='remove-answers'),
+                                                       row('', 'SOA', '', action='delete-zone'),
+                                                       row('late', 'A', '10.0.0.3')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(sorted(self.api.zones['a.test']['records']), [('late.a.test', 'A')])
+
+
+    @defer.inlineCallbacks
+    def test_actionsOfOneRecordAppliedInFileOrder(self):
+        self.addRecord('a.test', 'www.a.test', 'A', [['10.0.0.9']])
+
+        importer = yield self.runImporter([('a.test', [row('www', 'A', '10.0.0.1', action='replace-answers'),
+                                                       row('www', 'A', '10.0.0.2', action='upsert'),
+                                                       row('www', 'A', '10.0.0.1', action='remove-answers'),
+                                                       row('mail', 'A', '', action='delete-record'),
+                                                       row('mail', 'A', '10.0.0.3', action='upsert')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(self.answers('a.test', 'www.a.test', 'A'), [['10.0.0.2']])
+        self.assertEqual(self.answers('a.test', 'mail.a.test', 'A'), [['10.0.0.3']])
@@ -0,0 +1,64 @@
+from twisted.internet import defer, threads
+
+import threadedimporter
+from tests.fakensone import FakeApiTestCase, localClient
+
+
+class LocalThreadedImporter(threadedimporter.ThreadedImporter):
+    """The threads engine pointed at an endpoint"""
+
+
+    def __init__(self, endpoint, *args, **kwargs):
+        self.endpoint = endpoint
+        threadedimporter.ThreadedImporter.__init__(self, *args, **kwargs)
+
+
+    def _createClient(self, apiKey):
+        return localClient(apiKey, threadedimporter.SESSION_TRANSPORT, self.endpoint)
+
+
+def zoneRecords():
+    """Returns the rows of a zone with one record of two answers"""
+
+    return [{'Name': 'www', 'Type': 'A', 'TTL': '300', 'Data': '10.0.0.1'},
+            {'Name': 'www', 'Type': 'A', 'TTL': '300', 'Data': '10.0.0.2'}]
+
+
+class ThreadedImporterTest(FakeApiTestCase):
+    """The threads engine runs in a thread while the reactor serves the fake api"""
+
+
+    def runThreaded(self, endpoint, data):
+        """Runs the threads engine in a thread and returns it once done"""
+
+        importer = LocalThreadedImporter(endpoint, 'testkey', iter(data), False, 2,
+                                         progress=self.messages.append)
+        d = threads.deferToThread(importer.run)
+        d.addCallback(lambda result: importer)
+        return d
+
+
+    @defer.inlineCallbacks
+    def test_zonesImported(self):
+        self.addRecord('b.test', 'www.b.test', 'A', [['10.0.0.9']])
+
+        importer = yield self.runThreaded(self.endpoint, [('a.test', zoneRecords()),
+                                                          ('b.test', zoneRecords())])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(self.answers('a.test', 'www.a.test', 'A'), [['10.0.0.1'], ['10.0.0.2']])
+        self.assertEqual(self.answers('b.test', 'www.b.test', 'A'),
+                         [['10.0.0.1'], ['10.0.0.2'], ['10.0.0.9']])
+
+
+    @defer.inlineCallbacks
+    def test_connectionErrorsFailZones(self):
+        closed = 'http://127.0.0.1:{}/v1/'.format(self.apiPort.getHost().port)
+        yield self.apiPort.stopListening()
+
+        importer = yield self.runThreaded(closed, [('a.test', zoneRecords()),
+                                                   ('b.test', zoneRecords())])
+
+        self.assertEqual(importer.failedZones, {'a.test', 'b.test'})
+        self.assertEqual(importer.keyStats['testkey']['errors'], 4)
+        self.assertIn('Summary:', self.messages)
@@ -0,0 +1,36 @@
+from twisted.trial import unittest
+
+from zonetemplates import ZoneTemplates
+
+
+TEMPLATES = {'parked': [{'Name': 'www', 'Type': 'CNAME', 'TTL': '3600', 'Data': '{zone}.'}]}
+
+
+class ZoneTemplatesTest(unittest.TestCase):
+    """Checks of the template file and the lazy expansion"""
+
+
+    def test_zonesExpandedLazily(self):
+        templates = ZoneTemplates(TEMPLATES, ['a.test', {'zone': 'b.test', 'template': 'parked'}],
+                                  'parked')
+
+        zones = templates.expand()
+
+        self.assertEqual(next(zones), ('a.test', [{'Name': 'www', 'Type': 'CNAME', 'TTL': '3600',
+                                                   'Data': 'a.test.'}]))
+        self.assertEqual(next(zones)[0], 'b.test')
+
+
+    def test_unknownZoneTemplateRejectedUpFront(self):
+        error = self.assertRaises(ValueError, ZoneTemplates, TEMPLATES,
+                                  ['a.test', {'zone': 'b.test', 'template': 'parkd'}], 'parked')
+        self.assertEqual(str(error), 'Zone b.test uses the unknown template parkd')
+
+
+    def test_unknownDefaultTemplateRejected(self):
+        self.assertRaises(ValueError, ZoneTemplates, TEMPLATES, [], 'missing')
+
+
+    def test_zoneWithoutTemplateRejected(self):
+        self.assertRaises(ValueError, ZoneTemplates, TEMPLATES, ['a.test'])
+        self.assertRaises(ValueError, ZoneTemplates, TEMPLATES, [{'template': 'parked'}], 'parked')
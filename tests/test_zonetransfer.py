@@ -0,0 +1,184 @@
+from twisted.internet import defer, protocol, reactor
+from twisted.names import dns
+
+from tests.fakensone import FakeApiTestCase, LocalNsoneImporter
+from zonetransfer import ZoneTransfer
+
+
+def soa(zoneName, serial):
+    """Returns the SOA resource record of a serial"""
+
+    return dns.RRHeader(zoneName, dns.SOA, ttl=3600, payload=dns.Record_SOA(
+        mname='ns1.' + zoneName, rname='admin.' + zoneName, serial=serial))
+
+
+def aRecord(name, address, ttl=300):
+    """Returns an A resource record"""
+
+    return dns.RRHeader(name, dns.A, ttl=ttl, payload=dns.Record_A(address, ttl))
+
+
+class StandInDnsServer(protocol.ServerFactory):
+    """
+    A DNS server answering AXFR with the whole zone and IXFR with the
+    changes since the serial of the query, one message per transfer
+
+    Attributes:
+        zoneName (str): The zone served
+        serial (int): The current serial
+        records (list): The current records without the SOA
+        changes (dict): old serial -> (deleted records, added records) up to the current serial
+        refuseIxfr (bool): Answer IXFR with REFUSED
+        queries (list): The query types received
+    """
+
+
+    def __init__(self, zoneName, serial, records):
+        self.zoneName = zoneName
+        self.serial = serial
+        self.records = records
+        self.changes = {}
+        self.refuseIxfr = False
+        self.queries = []
+
+
+    def buildProtocol(self, addr):
+        return dns.DNSProtocol(self)
+
+
+    def connectionMade(self, proto):
+        pass
+
+
+    def connectionLost(self, proto):
+        pass
+
+
+    def messageReceived(self, message, proto, address=None):
+        query = message.queries[0]
+        self.queries.append(query.type)
+        response = dns.Message(message.id, answer=1, recDes=0)
+        response.queries = message.queries
+        current = soa(self.zoneName, self.serial)
+        if query.type == dns.IXFR and self.refuseIxfr:
+            response.rCode = dns.EREFUSED
+        elif query.type == dns.IXFR and message.authority[0].payload.serial in self.changes:
+            old = message.authority[0].payload.serial
+            deleted, added = self.changes[old]
+            response.answers = ([current, soa(self.zoneName, old)] + deleted + [current] + added +
+                                [current])
+        else:
+            response.answers = [current] + self.records + [current]
+        proto.writeMessage(response)
+
+
+class LocalZoneTransfer(ZoneTransfer):
+    """ZoneTransfer importing into the local fake NS1 api"""
+
+
+    def __init__(self, endpoint, *args, **kwargs):
+        self.endpoint = endpoint
+        ZoneTransfer.__init__(self, *args, **kwargs)
+
+
+    def _createImporter(self):
+        return LocalNsoneImporter(self.endpoint, self.apiKey, iter([]), False,
+                                  progress=lambda message: None)
+
+
+class ZoneTransferTest(FakeApiTestCase):
+    """Transfers from a stand-in DNS server imported into the local fake NS1 api"""
+
+
+    def setUp(self):
+        FakeApiTestCase.setUp(self)
+        self.dns = StandInDnsServer('example.test', 1, [
+            dns.RRHeader('example.test', dns.NS, ttl=3600, payload=dns.Record_NS('ns1.example.test')),
+            dns.RRHeader('Example.TEST.', dns.NS, ttl=3600, payload=dns.Record_NS('ns2.example.test')),
+            aRecord('WWW.Example.Test.', '10.0.0.5'),
+            aRecord('www.example.test', '10.0.0.1'),
+            aRecord('www.example.test', '10.0.0.2'),
+            dns.RRHeader('example.test', dns.TXT, ttl=60,
+                         payload=dns.Record_TXT('v=spf1 mx -all', 'second string')),
+            dns.RRHeader('mail.example.test', dns.MX, ttl=300,
+                         payload=dns.Record_MX(10, 'mx.example.test'))])
+        self.dnsPort = reactor.listenTCP(0, self.dns, interface='127.0.0.1')
+        self.stateFilename = self.mktemp()
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield FakeApiTestCase.tearDown(self)
+        yield self.dnsPort.stopListening()
+
+
+    def transfer(self):
+        """Runs one transfer of the zone and returns the ZoneTransfer once done"""
+
+        server = '127.0.0.1:{}'.format(self.dnsPort.getHost().port)
+        zoneTransfer = LocalZoneTransfer(self.endpoint, server, ['example.test'], 'testkey',
+                                         stateFilename=self.stateFilename)
+        d = zoneTransfer._startRequests(reactor)
+        d.addCallback(lambda result: zoneTransfer)
+        return d
+
+
+    @defer.inlineCallbacks
+    def test_axfrImported(self):
+        zoneTransfer = yield self.transfer()
+
+        self.assertEqual(self.dns.queries, [dns.AXFR])
+        self.assertEqual(zoneTransfer.serials, {'example.test': 1})
+        self.assertEqual(sorted(self.api.zones['example.test']['records']), [
+            ('example.test', 'TXT'), ('mail.example.test', 'MX'), ('www.example.test', 'A')])
+        self.assertEqual(self.answers('example.test', 'www.example.test', 'A'),
+                         [['10.0.0.1'], ['10.0.0.2'], ['10.0.0.5']])
+        self.assertEqual(self.answers('example.test', 'mail.example.test', 'MX'), [['10', 'mx.example.test']])
+        self.assertEqual(self.answers('example.test', 'example.test', 'TXT'), [['v=spf1 mx -all', 'second string']])
+
+
+    @defer.inlineCallbacks
+    def test_axfrDeletesStaleRecords(self):
+        self.addRecord('example.test', 'www.example.test', 'A', [['10.0.0.9']])
+        self.addRecord('example.test', 'old.example.test', 'A', [['10.0.0.8']])
+        self.addRecord('example.test', 'example.test', 'CAA', [[0, 'issue', 'ca.test']])
+
+        yield self.transfer()
+
+        self.assertEqual(sorted(self.api.zones['example.test']['records']), [
+            ('example.test', 'CAA'), ('example.test', 'TXT'), ('mail.example.test', 'MX'),
+            ('www.example.test', 'A')])
+        self.assertEqual(self.answers('example.test', 'www.example.test', 'A'),
+                         [['10.0.0.1'], ['10.0.0.2'], ['10.0.0.5']])
+
+
+    @defer.inlineCallbacks
+    def test_ixfrChangesApplied(self):
+        yield self.transfer()
+        self.dns.serial = 2
+        self.dns.changes[1] = ([aRecord('www.example.test', '10.0.0.2')],
+                               [aRecord('www.example.test', '10.0.0.3'),
+                                aRecord('db.example.test', '10.0.0.4')])
+
+        zoneTransfer = yield self.transfer()
+
+        self.assertEqual(self.dns.queries, [dns.AXFR, dns.IXFR])
+        self.assertEqual(zoneTransfer.serials, {'example.test': 2})
+        self.assertEqual(self.answers('example.test', 'www.example.test', 'A'),
+                         [['10.0.0.1'], ['10.0.0.3'], ['10.0.0.5']])
+        self.assertEqual(self.answers('example.test', 'db.example.test', 'A'), [['10.0.0.4']])
+
+
+    @defer.inlineCallbacks
+    def test_refusedIxfrRetriedAsAxfr(self):
+        yield self.transfer()
+        self.dns.serial = 2
+        self.dns.refuseIxfr = True
+        self.dns.records.append(aRecord('db.example.test', '10.0.0.4'))
+
+        zoneTransfer = yield self.transfer()
+
+        self.assertEqual(self.dns.queries, [dns.AXFR, dns.IXFR, dns.AXFR])
+        self.assertEqual(zoneTransfer.serials, {'example.test': 2})
+        self.assertEqual(zoneTransfer.failedZones, set())
+        self.assertEqual(self.answers('example.test', 'db.example.test', 'A'), [['10.0.0.4']])
@@ -0,0 +1,40 @@
+from twisted.internet import defer
+
+from tests.fakensone import FakeApiTestCase
+from zoneverifier import ZoneVerifier
+
+
+class ZoneVerifierTest(FakeApiTestCase):
+    """Imports and verifies zones against the local fake NS1 api"""
+
+
+    @defer.inlineCallbacks
+    def verify(self, data):
+        """Imports and verifies data and returns the verifier once done"""
+
+        importer = self.importer([])
+        verifier = ZoneVerifier(importer, iter(data), 2)
+        yield importer.start(verifier.importZones)
+        yield verifier.verify()
+        defer.returnValue(verifier)
+
+
+    @defer.inlineCallbacks
+    def test_namesInAnyCaseVerified(self):
+        verifier = yield self.verify([('a.test', [
+            {'Name': 'WWW', 'Type': 'A', 'TTL': '300', 'Data': '10.0.0.1'},
+            {'Name': 'Mail.A.Test.', 'Type': 'mx', 'TTL': '300', 'Data': '10 MX.a.test'}])])
+
+        self.assertEqual(verifier.mismatches, [])
+        self.assertEqual(verifier.verifiedZones, 1)
+
+
+    @defer.inlineCallbacks
+    def test_changedAnswersReported(self):
+        self.addRecord('a.test', 'www.a.test', 'A', [['10.0.0.9']], ttl=60)
+
+        verifier = yield self.verify([('a.test', [
+            {'Name': 'www', 'Type': 'A', 'TTL': '300', 'Data': '10.0.0.1'}])])
+
+        self.assertEqual(sorted(mismatch[0] for mismatch in verifier.mismatches),
+                         ['extra-answer', 'ttl'])
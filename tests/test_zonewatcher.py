@@ -0,0 +1,48 @@
+from functools import partial
+
+from twisted.internet import defer
+
+from tests.fakensone import FakeApiTestCase
+from zonewatcher import ZoneWatcher
+
+
+def removeRow(name, recType, data):
+    """Returns the remove-answers row of a row that left the file"""
+
+    return {'Name': name, 'Type': recType, 'TTL': '300', 'Data': data, 'Action': 'remove-answers'}
+
+
+class ZoneWatcherTest(FakeApiTestCase):
+    """Pushes of the zone watcher against the local fake NS1 api"""
+
+
+    def push(self, changedData, removedData):
+        """Runs one push of the watcher with a local importer"""
+
+        watcher = ZoneWatcher(self.mktemp(), 'testkey')
+        importer = self.importer(iter(changedData))
+        d = importer.start(partial(watcher._pushZones, changedData=changedData,
+                                   removedData=removedData))
+        d.addCallback(lambda result: importer)
+        return d
+
+
+    @defer.inlineCallbacks
+    def test_rowsOfRemovedZoneRemoved(self):
+        self.addRecord('gone.test', 'www.gone.test', 'A', [['10.0.0.1'], ['10.0.0.2']])
+
+        importer = yield self.push([], [('gone.test', [removeRow('www', 'A', '10.0.0.1')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(self.answers('gone.test', 'www.gone.test', 'A'), [['10.0.0.2']])
+
+
+    @defer.inlineCallbacks
+    def test_removedZoneDeletedInNs1NotRecreated(self):
+        importer = yield self.push([('kept.test', [{'Name': 'www', 'Type': 'A', 'TTL': '300',
+                                                    'Data': '10.0.0.1'}])],
+                                   [('gone.test', [removeRow('www', 'A', '10.0.0.1')])])
+
+        self.assertEqual(importer.failedZones, set())
+        self.assertEqual(sorted(self.api.zones), ['kept.test'])
+        self.assertIn('Skipped Zone: gone.test does not exist', self.messages)
@@ -0,0 +1,529 @@
+import time
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from nsone import NSONE, Config
+from nsone.rest.errors import ResourceException
+from nsone.rest.transport.base import TransportBase
+from nsone.rest.transport.requests import RequestsTransport
+
+from keyrouter import KeyRouter
+from ratelimiter import BlockingRateLimiter
+from recordutils import (ACTIONS, actionRuns, answerTokens, groupRecords, missingAnswers,
+                         remainingAnswers, splitZoneDelete, uniqueAnswers)
+
+
+SESSION_TRANSPORT = 'requests-session'
+
+_sessions = threading.local()
+_limiters = {}
+
+
+def getSession():
+    """
+    Returns the requests session of the calling thread, so every worker
+    thread keeps its own persistent connections
+
+    Returns:
+        requests.Session
+    """
+
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _sessions.session = session
+    return session
+
+
+def sessionRequest(method, url, **kwargs):
+    """Sends a request with the session of the calling thread"""
+
+    return getSession().request(method, url, **kwargs)
+
+
+def setRateLimit(apiKey, rate):
+    """
+    Limits the requests sent with apiKey to rate per second, for every thread of the process
+
+    Args:
+        apiKey (str): The Nsone Api Key
+        rate (float): Requests per second, None removes the limit
+    """
+
+    if rate:
+        _limiters[apiKey] = BlockingRateLimiter(rate)
+    else:
+        _limiters.pop(apiKey, None)
+
+
+class SessionTransport(RequestsTransport):
+    """
+    The nsone requests transport sending through the session of the calling
+    thread instead of opening a new connection for every request, and
+    waiting for a token of the api key's rate limiter before every request.
+    Errors of requests, like a refused connection, are raised as
+    ResourceException like the api errors, so they fail single operations.
+    It is registered with nsone as the 'requests-session' transport.
+    """
+
+
+    def __init__(self, config):
+        """
+        Args:
+            config (nsone.Config): The client configuration
+        """
+
+        RequestsTransport.__init__(self, config)
+        self.apiKey = config.getAPIKey()
+        # the transport is shared by the threads, the session is picked per call
+        self.REQ_MAP = {method: partial(sessionRequest, method)
+                        for method in ('GET', 'POST', 'DELETE', 'PUT')}
+
+
+    def send(self, method, url, headers=None, data=None, files=None,
+             callback=None, errback=None):
+        """Sends the request with the session of the calling thread once a token was granted"""
+
+        limiter = _limiters.get(self.apiKey)
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return RequestsTransport.send(self, method, url, headers, data, files,
+                                          callback, errback)
+        except requests.RequestException as e:
+            raise ResourceException('{} {} failed: {}'.format(method, url, e))
+
+
+TransportBase.REGISTRY[SESSION_TRANSPORT] = SessionTransport
+
+
+class ThreadedImporter(object):
+    """
+    Synchronous import engine running the blocking nsone client on a thread pool.
+
+    Every zone is one task: the zone is created, or loaded if it exists, and
+    only then are its records submitted to the pool, one task per
+    (domain, type) group with all of its answers. A record that already exists
+    is loaded and only its missing answers are added in a single request,
+    like the Twisted engine does. Zones are submitted from the data as
+    threads become free, so the data is never materialized all at once.
+
+    Attributes:
+        apiKey (str): The first Nsone Api Key
+        apiKeys (list): Every Nsone Api Key of the pool
+        keyRouter (KeyRouter): Routes every zone to one of the api keys
+        clients (dict): api key -> nsone.NSONE instance with its own config
+        keyStats (dict): api key -> request and error counts of this run
+        failedZones (set): Zones with at least one failed operation in this run
+        data (iterable): (zone name, records) tuples
+        deleteData (bool): Delete the zones instead of importing them
+        threads (int): Size of the thread pool
+        progress (function): Receives every progress message, they are printed without it
+    """
+
+
+    def __init__(self, apiKey, data, delete, threads=20, keyRouter=None, progress=None, rate=None):
+        """
+        Args:
+            apiKey (str|list): The Nsone Api Key or a pool of keys
+            data (iterable): (zone name, records) tuples
+            delete (bool): Delete Flag, defaults to false from argument parser
+            threads (int): Size of the thread pool
+            keyRouter (KeyRouter): Routing of zones to keys, defaults to hashing over the pool
+            progress (function): Called with every progress message
+            rate (float): Requests per second per api key, None for no limit
+        """
+
+        apiKeys = [apiKey] if isinstance(apiKey, basestring) else list(apiKey)
+        self.keyRouter = keyRouter or KeyRouter(apiKeys)
+        self.apiKeys = self.keyRouter.apiKeys
+        self.apiKey = self.apiKeys[0]
+        self.clients = {}
+        self.keyStats = {}
+        for key in self.apiKeys:
+            self.clients[key] = self._createClient(key)
+            self.keyStats[key] = {'requests': 0, 'errors': 0}
+            setRateLimit(key, rate)
+        self.data = data
+        self.deleteData = delete
+        self.threads = threads
+        self.progress = progress
+        self.failedZones = set()
+        self._lock = threading.Lock()
+        self._started = None
+
+
+    def _createClient(self, apiKey):
+        """
+        Creates a blocking nsone client with its own config for one api key
+
+        Args:
+            apiKey (str): The Nsone Api Key
+
+        Returns:
+            nsone.NSONE
+        """
+
+        config = Config()
+        config.createFromAPIKey(apiKey)
+        config['transport'] = SESSION_TRANSPORT
+        return NSONE(config=config)
+
+
+    def clientFor(self, zoneName):
+        """
+        Returns the client of the api key the zone is routed to, or None
+
+        Args:
+            zoneName (str): The zone name
+
+        Returns:
+            nsone.NSONE
+        """
+
+        return self.clients.get(self.keyRouter.keyFor(zoneName))
+
+
+    def _call(self, nsoneObj, f, *args, **kwargs):
+        """
+        Sends one request and counts it against the api key of nsoneObj
+
+        Args:
+            nsoneObj (nsone.NSONE): The client sending the request
+            f (function): The blocking api method
+
+        Returns:
+            The result of f
+        """
+
+        try:
+            result = f(*args, **kwargs)
+        except Exception:
+            self._countRequest(nsoneObj, True)
+            raise
+        self._countRequest(nsoneObj, False)
+        return result
+
+
+    def _countRequest(self, nsoneObj, error):
+        """Updates the request and error counts of the api key of nsoneObj"""
+
+        with self._lock:
+            stats = self.keyStats[nsoneObj.config.getAPIKey()]
+            stats['requests'] += 1
+            if error:
+                stats['errors'] += 1
+
+
+    def _zoneFailed(self, zoneName, message):
+        """Records a failed zone and reports why"""
+
+        with self._lock:
+            self.failedZones.add(zoneName)
+        self._report('{}: {}'.format(zoneName, message))
+
+
+    def _importZone(self, executor, zoneName, records, nsoneObj):
+        """
+        Creates or loads one zone and submits its records
+
+        Args:
+            executor (concurrent.futures.ThreadPoolExecutor): The pool
+            zoneName (str): The zone name
+            records (list): The records of the zone
+            nsoneObj (nsone.NSONE): The client of the zone
+
+        Returns:
+            list: The futures of the record tasks
+        """
+
+        deleteZone, records = splitZoneDelete(records)
+        if deleteZone:
+            try:
+                zone = self._call(nsoneObj, nsoneObj.loadZone, zoneName)
+                self._call(nsoneObj, zone.delete)
+            except ResourceException as e:
+                self._report('{} not deleted: {}'.format(zoneName, e.message))
+            else:
+                self._report('Successfully Deleted Zone: {}'.format(zoneName))
+            if not records:
+                return []
+
+        try:
+            zone = self._call(nsoneObj, nsoneObj.createZone, zoneName)
+        except ResourceException as e:
+            self._report(e.message)
+            try:
+                zone = self._call(nsoneObj, nsoneObj.loadZone, zoneName)
+            except ResourceException as e:
+                self._zoneFailed(zoneName, e.message)
+                return []
+            self._report('Successfully Loaded Zone: {}'.format(zoneName))
+
+        futures = []
+        for (domain, recType), group in groupRecords(zoneName, records):
+            futures.append(executor.submit(self._importRecordGroup, zone, zoneName, domain,
+                                           recType, group, nsoneObj))
+        return futures
+
+
+    def _importRecordGroup(self, zone, zoneName, domain, recType, group, nsoneObj):
+        """
+        Applies the runs of consecutive rows with the same action of one
+        record in file order
+
+        Args:
+            zone (nsone.zones.Zone): The zone of the record
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            group (list): The rows of the record
+            nsoneObj (nsone.NSONE): The client of the zone
+        """
+
+        for action, rows in actionRuns(group):
+            answers = uniqueAnswers([answerTokens(rec) for rec in rows], recType)
+            if action == 'upsert':
+                self._importRecord(zone, zoneName, domain, recType, answers, rows[0]['TTL'],
+                                   nsoneObj)
+            elif action == 'replace-answers':
+                self._replaceRecordAnswers(zone, zoneName, domain, recType, answers,
+                                           rows[0]['TTL'], nsoneObj)
+            elif action == 'delete-record':
+                self._deleteRecord(zoneName, domain, recType, nsoneObj)
+            elif action == 'remove-answers':
+                self._removeRecordAnswers(zoneName, domain, recType, answers, nsoneObj)
+            else:
+                self._zoneFailed(zoneName, 'unknown action {} for {} {}, expected one of: {}'.format(
+                    action, domain, recType, ', '.join(ACTIONS)))
+
+
+    def _importRecord(self, zone, zoneName, domain, recType, answers, ttl, nsoneObj):
+        """
+        Creates a record with all of its answers, or merges the missing answers
+        into the record if it already exists
+
+        Args:
+            zone (nsone.zones.Zone): The zone of the record
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            answers (list): All of the answers for the record
+            ttl (str): The TTL value for the record
+            nsoneObj (nsone.NSONE): The client of the zone
+        """
+
+        try:
+            addMethod = getattr(zone, 'add_{}'.format(recType))
+            record = self._call(nsoneObj, addMethod, domain, answers, ttl=ttl)
+            self._report('Created record: {}'.format(record))
+            return
+        except ResourceException as e:
+            self._report('{} {} {}'.format(domain, recType, e.message))
+
+        try:
+            record = self._call(nsoneObj, nsoneObj.loadRecord, domain, recType, zoneName)
+            self._report('Successfully loaded Record: {}'.format(record))
+            newAnswers = missingAnswers(record.data['answers'], answers, recType)
+            if not newAnswers:
+                self._report('Answers already exist: {}'.format(answers))
+                return
+            self._report('Adding answers: {}'.format(newAnswers))
+            self._call(nsoneObj, record.addAnswers, newAnswers)
+            self._report('Successfully processed answers: {}'.format(answers))
+        except ResourceException as e:
+            self._zoneFailed(zoneName, e.message)
+
+
+    def _replaceRecordAnswers(self, zone, zoneName, domain, recType, answers, ttl, nsoneObj):
+        """
+        Creates a record with exactly the given answers, or replaces every
+        answer of the record if it already exists
+
+        Args:
+            zone (nsone.zones.Zone): The zone of the record
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            answers (list): The new answers of the record
+            ttl (str): The TTL value for the record
+            nsoneObj (nsone.NSONE): The client of the zone
+        """
+
+        try:
+            addMethod = getattr(zone, 'add_{}'.format(recType))
+            record = self._call(nsoneObj, addMethod, domain, answers, ttl=ttl)
+            self._report('Created record: {}'.format(record))
+            return
+        except ResourceException:
+            pass
+
+        try:
+            record = self._call(nsoneObj, nsoneObj.loadRecord, domain, recType, zoneName)
+            self._call(nsoneObj, record.update, answers=answers, ttl=ttl)
+        except ResourceException as e:
+            self._zoneFailed(zoneName, e.message)
+        else:
+            self._report('Replaced answers of {} {}: {}'.format(domain, recType, answers))
+
+
+    def _removeRecordAnswers(self, zoneName, domain, recType, answers, nsoneObj):
+        """
+        Removes answers from a record, a record left without answers is deleted
+
+        Args:
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            answers (list): The answers to remove
+            nsoneObj (nsone.NSONE): The client of the zone
+        """
+
+        try:
+            record = self._call(nsoneObj, nsoneObj.loadRecord, domain, recType, zoneName)
+        except ResourceException as e:
+            self._report('{} {} answers not removed: {}'.format(domain, recType, e.message))
+            return
+
+        remaining = remainingAnswers(record.data['answers'], answers, recType)
+        if len(remaining) == len(record.data['answers']):
+            self._report('Answers already removed: {}'.format(answers))
+            return
+        try:
+            if remaining:
+                self._call(nsoneObj, record.update, answers=remaining)
+            else:
+                self._call(nsoneObj, record.delete)
+        except ResourceException as e:
+            self._zoneFailed(zoneName, e.message)
+        else:
+            self._report('Removed answers of {} {}: {}'.format(domain, recType, answers))
+
+
+    def _deleteRecord(self, zoneName, domain, recType, nsoneObj):
+        """
+        Deletes a record, a record that does not exist is already deleted
+
+        Args:
+            zoneName (str): The zone name
+            domain (str): The fully qualified record domain
+            recType (str): The record type
+            nsoneObj (nsone.NSONE): The client of the zone
+        """
+
+        try:
+            record = self._call(nsoneObj, nsoneObj.loadRecord, domain, recType, zoneName)
+        except ResourceException as e:
+            self._report('{} {} not deleted: {}'.format(domain, recType, e.message))
+            return
+
+        try:
+            self._call(nsoneObj, record.delete)
+        except ResourceException as e:
+            self._zoneFailed(zoneName, e.message)
+        else:
+            self._report('Deleted record: {} {}'.format(domain, recType))
+
+
+    def _deleteZone(self, executor, zoneName, records, nsoneObj):
+        """
+        Loads and deletes one zone
+
+        Args:
+            executor (concurrent.futures.ThreadPoolExecutor): The pool
+            zoneName (str): The zone name
+            records (list): The records of the zone
+            nsoneObj (nsone.NSONE): The client of the zone
+
+        Returns:
+            list: No follow up tasks
+        """
+
+        try:
+            zone = self._call(nsoneObj, nsoneObj.loadZone, zoneName)
+            self._call(nsoneObj, zone.delete)
+        except ResourceException as e:
+            self._zoneFailed(zoneName, e.message)
+        else:
+            self._report('Successfully Deleted Zone: {}'.format(zoneName))
+        return []
+
+
+    def _runZones(self, executor):
+        """
+        Submits the zones as threads become free and waits for every zone
+        and record task
+
+        Args:
+            executor (concurrent.futures.ThreadPoolExecutor): The pool
+        """
+
+        zoneTask = self._deleteZone if self.deleteData else self._importZone
+        window = self.threads * 2
+        zones = set()
+        records = []
+        for zoneName, zoneRecords in self.data:
+            nsoneObj = self.clientFor(zoneName)
+            if nsoneObj is None:
+                self._report('{}: no api key is allowed to manage this zone'.format(zoneName))
+                continue
+            zones.add(executor.submit(zoneTask, executor, zoneName, zoneRecords, nsoneObj))
+            if len(zones) >= window:
+                done, zones = wait(zones, return_when=FIRST_COMPLETED)
+                for future in done:
+                    records.extend(future.result())
+                for future in [future for future in records if future.done()]:
+                    records.remove(future)
+                    future.result()
+        for future in zones:
+            records.extend(future.result())
+        for future in records:
+            future.result()
+
+
+    def _report(self, message):
+        """
+        Hands a progress message to the progress callback or prints it
+
+        Args:
+            message (str): The message
+        """
+
+        with self._lock:
+            if self.progress is not None:
+                self.progress(message)
+            else:
+                print message
+
+
+    def _summaryLines(self):
+        """
+        Returns the lines of the run summary
+
+        Returns:
+            list
+        """
+
+        elapsed = max(time.time() - self._started, 0.001)
+        lines = ['Engine: threads, {} threads, {:.3f}s'.format(self.threads, elapsed)]
+        for apiKey in self.apiKeys:
+            stats = self.keyStats[apiKey]
+            lines.append('Key ...{}: {} requests, {} errors, {:.1f} requests/s'.format(
+                apiKey[-4:], stats['requests'], stats['errors'], stats['requests'] / elapsed))
+        return lines
+
+
+    def run(self):
+        """Runs the import or deletion and prints the summary once every task is done"""
+
+        self._started = time.time()
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            self._runZones(executor)
+        finally:
+            executor.shutdown(wait=True)
+            self._report('Summary:')
+            for line in self._summaryLines():
+                self._report('  ' + line)
@@ -1,6 +1,13 @@
 import os.path
 import csv
+import hashlib
 import argparse
+from collections import OrderedDict
+
+from csvindex import CsvIndexReader
+from parsecache import ParseCache
+from zonefilter import ZoneFilter
+from zonetemplates import ZoneTemplates
 
 
 class ZoneDataParser(object):
@@ -26,23 +33,199 @@ class ZoneDataParser(object):
         parser.add_argument("-a", "--apikey",
                             dest="apikey",
                             type=str,
-                            required=True,
+                            action='append',
                             metavar="API_KEY",
-                            help="Your NS1 api key with this flag")
+                            help="Your NS1 api key with this flag, repeat it to spread zones over several keys")
+        parser.add_argument("--key-zones",
+                            dest="keyZones",
+                            type=lambda x: self._isValidFile(parser, x),
+                            metavar="FILE",
+                            help="Json file mapping api keys to the zone globs they may manage")
         parser.add_argument("-f", "--file",
                             dest="filename",
                             type=lambda x: self._isValidFile(parser, x),
-                            required=True,
                             metavar="FILE",
                             help="Import Zone data from file with this flag")
         parser.add_argument("-d", "--delete",
                             dest="delete",
                             action='store_true',
                             help="Delete Zone data from file with this flag")
+        parser.add_argument("-e", "--export",
+                            dest="export",
+                            metavar="FILE",
+                            help="Export the zones of the account to this csv file instead of importing")
+        parser.add_argument("--transfer-from",
+                            dest="transferFrom",
+                            metavar="SERVER",
+                            help="Pull the zones given with -z/--zones-from from this DNS server (host[:port]) with AXFR or IXFR")
+        parser.add_argument("--transfer-state",
+                            dest="transferState",
+                            metavar="FILE",
+                            help="With --transfer-from, keep zone serials in FILE and only pull changes with IXFR")
+        parser.add_argument("-c", "--concurrency",
+                            dest="concurrency",
+                            type=int,
+                            metavar="N",
+                            help="Number of zones processed at the same time")
+        parser.add_argument("--engine",
+                            dest="engine",
+                            choices=('twisted', 'threads'),
+                            default='twisted',
+                            help="Run the requests on the twisted reactor or on a thread pool of -c threads")
+        parser.add_argument("--rate",
+                            dest="rate",
+                            type=float,
+                            metavar="N",
+                            help="Send at most N requests per second per api key")
+        parser.add_argument("--rate-coordinator",
+                            dest="rateCoordinator",
+                            metavar="ENDPOINT",
+                            help="Share the --rate budget of every key with the other imports on this host through the coordinator on ENDPOINT")
+        parser.add_argument("--serve-rate-coordinator",
+                            dest="serveRateCoordinator",
+                            metavar="ENDPOINT",
+                            help="Run the rate coordinator handing out --rate requests per second per key on ENDPOINT")
+        parser.add_argument("--priority",
+                            dest="priority",
+                            type=float,
+                            default=1.0,
+                            metavar="WEIGHT",
+                            help="With --rate-coordinator, the share of this import relative to the others")
+        parser.add_argument("--serve",
+                            dest="serve",
+                            metavar="ENDPOINT",
+                            help="Run as an import service on ENDPOINT, like unix:/tmp/nsoneimporter.sock")
+        parser.add_argument("--serve-token-file",
+                            dest="serveTokenFile",
+                            type=lambda x: self._isValidFile(parser, x),
+                            metavar="FILE",
+                            help="With --serve, clients have to send the token in FILE, required on tcp endpoints")
+        parser.add_argument("--serve-dir",
+                            dest="serveDir",
+                            metavar="DIR",
+                            help="With --serve, jobs may only read files below DIR, defaults to the working directory")
+        parser.add_argument("--watch",
+                            dest="watch",
+                            action='store_true',
+                            help="Keep watching the file and push only the zones that changed")
+        parser.add_argument("--watch-interval",
+                            dest="watchInterval",
+                            type=float,
+                            default=2.0,
+                            metavar="SECONDS",
+                            help="How often --watch checks the file for changes")
+        parser.add_argument("--link-zones",
+                            dest="linkZones",
+                            action='store_true',
+                            help="Create zones with the same records as an earlier zone as linked zones")
+        parser.add_argument("--verify",
+                            dest="verify",
+                            action='store_true',
+                            help="After the import fetch every touched zone and compare it with the file")
+        parser.add_argument("--verify-report",
+                            dest="verifyReport",
+                            metavar="FILE",
+                            help="With --verify, write the mismatches to FILE")
+        parser.add_argument("--verify-requeue",
+                            dest="verifyRequeue",
+                            action='store_true',
+                            help="With --verify, import the missing records again")
+        parser.add_argument("-w", "--workers",
+                            dest="workers",
+                            type=int,
+                            default=1,
+                            metavar="N",
+                            help="Parse the csv in N parallel processes and write a zone index")
+        parser.add_argument("--cache",
+                            dest="cache",
+                            action='store_true',
+                            help="Parse the csv once into FILE.cache and read it from there while the file is unchanged")
+        parser.add_argument("-z", "--zone",
+                            dest="zones",
+                            action='append',
+                            metavar="ZONE",
+                            help="Only process this zone, may be repeated")
+        parser.add_argument("--zones-from",
+                            dest="zonesFrom",
+                            type=lambda x: self._isValidFile(parser, x),
+                            metavar="FILE",
+                            help="Only process the zones listed one per line in this file")
+        parser.add_argument("-t", "--type",
+                            dest="types",
+                            action='append',
+                            metavar="TYPE",
+                            help="Only process records of this type, may be repeated")
+        parser.add_argument("--match",
+                            dest="globs",
+                            action='append',
+                            metavar="GLOB",
+                            help="Only process zones matching this glob, may be repeated")
+        parser.add_argument("--regex",
+                            dest="regexes",
+                            action='append',
+                            metavar="PATTERN",
+                            help="Only process zones matching this regular expression, may be repeated")
+        parser.add_argument("--profile",
+                            dest="profile",
+                            action='store_true',
+                            help="Print a per-phase timing breakdown and report reactor stalls")
+        parser.add_argument("--profile-stats",
+                            dest="profileStats",
+                            metavar="FILE",
+                            help="With --profile, dump cProfile stats of the reactor thread to FILE")
+        parser.add_argument("--profile-folded",
+                            dest="profileFolded",
+                            metavar="FILE",
+                            help="With --profile, write sampled reactor stacks in flamegraph folded format")
+        parser.add_argument("--stall-threshold",
+                            dest="stallThreshold",
+                            type=float,
+                            default=0.5,
+                            metavar="SECONDS",
+                            help="With --profile, report reactor iterations blocked longer than this")
         args = parser.parse_args()
+        if args.serveRateCoordinator:
+            if not args.rate:
+                parser.error("--serve-rate-coordinator needs --rate")
+            return args
+        if args.serve:
+            if not args.serve.startswith('unix:') and args.serveTokenFile is None:
+                parser.error("--serve on an endpoint other than a unix socket needs --serve-token-file")
+            if args.serveDir is not None and not os.path.isdir(args.serveDir):
+                parser.error("The directory %s does not exist!" % args.serveDir)
+            return args
+        if args.apikey is None:
+            parser.error("argument -a/--apikey is required")
+        if args.delete and (args.types or args.globs or args.regexes):
+            parser.error("-d/--delete deletes whole zones and cannot be combined with -t/--type, "
+                         "--match or --regex, name the zones with -z/--zone or --zones-from")
+        if args.transferFrom and not (args.zones or args.zonesFrom):
+            parser.error("--transfer-from needs the zones to transfer with -z/--zone or --zones-from")
+        if args.transferFrom and (args.globs or args.regexes):
+            parser.error("--transfer-from cannot be combined with --match or --regex, "
+                         "name the zones with -z/--zone or --zones-from")
+        if args.filename is None and args.export is None and args.transferFrom is None:
+            parser.error("argument -f/--file is required")
+        if args.engine == 'threads':
+            twistedOnly = [flag for flag, value in (('--rate-coordinator', args.rateCoordinator),
+                                                   ('--verify', args.verify),
+                                                   ('--link-zones', args.linkZones),
+                                                   ('--profile', args.profile),
+                                                   ('--watch', args.watch),
+                                                   ('-e/--export', args.export),
+                                                   ('--transfer-from', args.transferFrom))
+                           if value]
+            if twistedOnly:
+                parser.error("--engine threads cannot be combined with {}".format(', '.join(twistedOnly)))
         return args
 
 
+    def getZoneFilter(self, args):
+        """Returns the ZoneFilter selected on the command line or None"""
+
+        return ZoneFilter.fromArgs(args)
+
+
     def _readCsv(self, reader):
         """Lets csv data be evaluated lazily. Since file might be huge
         Exits if the fields in the CSV are invalid
@@ -68,24 +251,32 @@ class ZoneDataParser(object):
             yield k, v
 
 
-    def _transformCsv(self, csvData):
+    def _transformCsv(self, csvData, zoneFilter=None):
         """
         Transforms the csv to a more easily processed dict to minimize
         rest api calls for creating and loading zones unecessarily.
         This is implemented since it is overkill to try to create or load
         the zones for each row using the api
 
+        Rows rejected by the zone filter are skipped before a record
+        is built for them. The optional Action column is kept on the
+        records that set it. Zones keep the order they first appear in.
+
         NOTE: Assumes Name,Zone,Type,TTL,Data as the header
         """
 
-        data = {}
+        data = OrderedDict()
         for row in csvData:
+            if zoneFilter is not None and not zoneFilter.matchesRow(row['Zone'], row['Type']):
+                continue
             record = {
                 'Data': row['Data'],
                 'Type': row['Type'],
                 'Name': row['Name'],
                 'TTL': row['TTL']
             }
+            if row.get('Action'):
+                record['Action'] = row['Action']
             if data.get(row['Zone']):
                 data[row['Zone']].append(record)
             else:
@@ -93,26 +284,85 @@ class ZoneDataParser(object):
         return data
 
 
-    def _transformJson(self, jsonData):
-        """Not Implemented. Assuming json transformed similar to csv"""
+    def zoneHash(self, records):
+        """
+        Returns a stable hash of the records of one zone block.
+        Records are hashed in sorted order, so reordering the rows of a zone
+        in the file does not change its hash.
+
+        Args:
+            records (list): The records of the zone
+
+        Returns:
+            str
+        """
 
-        return jsonData
+        rows = sorted('\t'.join('{}={}'.format(field, rec[field]) for field in sorted(rec))
+                      for rec in records)
+        return hashlib.sha1('\n'.join(rows)).hexdigest()
 
 
-    def loadZoneData(self, filename):
+    def loadZoneData(self, filename, workers=1, zoneFilter=None, useCache=False):
         """
         Based on the file extension, a data dictionary is
         populated and returned
+
+        With more than one worker, csv files are memory mapped and parsed
+        in parallel by CsvIndexReader, which also writes the zone index
+        used to read single zones later on.
+
+        When the zone filter selects zones and a fresh index exists, only
+        the byte ranges of the selected zones are read.
+
+        With useCache the whole csv is parsed once into a ParseCache and
+        later runs on the same content read the zones from the cache.
+
+        Json files hold zone templates, which are expanded one zone at a
+        time while the data is iterated.
         """
 
         extension = os.path.splitext(filename)[1]
+        if extension == '.csv' and useCache:
+            return self._loadCachedZoneData(filename, workers, zoneFilter)
+
+        if extension == '.csv' and zoneFilter is not None and zoneFilter.selectsZones():
+            indexReader = CsvIndexReader(filename)
+            index = indexReader.loadIndex()
+            if index is not None:
+                zoneNames = zoneFilter.filterZones(indexReader.zoneNames(index))
+                return indexReader.readZones(zoneNames, index, zoneFilter)
+
+        return self._parseZoneData(filename, extension, workers, zoneFilter)
+
+
+    def _parseZoneData(self, filename, extension, workers=1, zoneFilter=None):
+        """Parses the whole file, in parallel for csv files with more than one worker"""
+
+        if extension == '.json':
+            return ZoneTemplates.fromFile(filename).expand(zoneFilter)
+
+        if extension == '.csv' and workers > 1:
+            dataDict = CsvIndexReader(filename, workers).parse(zoneFilter)
+            return self._readDataDict(dataDict)
+
         with open(filename, 'rb') as f:
-            if extension == '.csv':
-                reader = csv.DictReader(f)
-                dataDict = self._transformCsv(self._readCsv(reader))
-                data = self._readDataDict(dataDict)
-            elif extension == '.json':
-                dataDict = json.loads(f)
-                data = self._transformJson(self._readDataDict(jsonDict))
+            reader = csv.DictReader(f)
+            dataDict = self._transformCsv(self._readCsv(reader), zoneFilter)
+            data = self._readDataDict(dataDict)
 
         return data
+
+
+    def _loadCachedZoneData(self, filename, workers=1, zoneFilter=None):
+        """
+        Reads the zone data from the parse cache, parsing the full file into
+        the cache first when its content changed since the cache was written
+        """
+
+        parseCache = ParseCache(filename)
+        if not parseCache.isFresh():
+            parseCache.write(self._parseZoneData(filename, '.csv', workers))
+        zoneNames = None
+        if zoneFilter is not None and zoneFilter.selectsZones():
+            zoneNames = zoneFilter.filterZones(parseCache.zoneNames())
+        return parseCache.readZones(zoneNames, zoneFilter)
@@ -0,0 +1,128 @@
+import re
+import fnmatch
+
+
+class ZoneFilter(object):
+    """
+    Selects the zones and record types that should be imported.
+
+    A zone is selected when no zone criteria are given or when it matches
+    any of the exact names, glob patterns or regular expressions.
+    A row is selected when its zone is selected and, if types were given,
+    its record type is one of them.
+
+    Attributes:
+        zones (set): Exact zone names
+        types (set): Upper cased record types
+        globs (list): fnmatch style zone patterns
+        regexes (list): Compiled zone regular expressions
+    """
+
+
+    def __init__(self, zones=None, types=None, globs=None, regexes=None):
+        """
+        Args:
+            zones (iterable): Exact zone names
+            types (iterable): Record types such as A or MX
+            globs (iterable): Glob patterns like *.example.com
+            regexes (iterable): Regular expression strings
+        """
+
+        self.zones = set(zones or [])
+        self.types = {recType.upper() for recType in types or []}
+        self.globs = list(globs or [])
+        self.regexes = [re.compile(regex) for regex in regexes or []]
+
+
+    @classmethod
+    def fromArgs(cls, args):
+        """
+        Builds a filter from the parsed command line arguments
+
+        Returns None when no filtering was requested so callers can
+        keep the unfiltered code path.
+
+        Args:
+            args (argparse.Namespace): The parsed arguments
+
+        Returns:
+            ZoneFilter
+        """
+
+        zones = list(args.zones or [])
+        if args.zonesFrom:
+            with open(args.zonesFrom, 'rb') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        zones.append(line)
+
+        zoneFilter = cls(zones, args.types, args.globs, args.regexes)
+        if not zoneFilter.selectsZones() and not zoneFilter.types:
+            return None
+        return zoneFilter
+
+
+    def selectsZones(self):
+        """Returns True if only some of the zones are selected"""
+
+        return bool(self.zones or self.globs or self.regexes)
+
+
+    def matchesZone(self, zoneName):
+        """
+        Args:
+            zoneName (str): The zone name
+
+        Returns:
+            bool
+        """
+
+        if not self.selectsZones() or zoneName in self.zones:
+            return True
+        for glob in self.globs:
+            if fnmatch.fnmatchcase(zoneName, glob):
+                return True
+        for regex in self.regexes:
+            if regex.search(zoneName):
+                return True
+        return False
+
+
+    def matchesType(self, recType):
+        """
+        Args:
+            recType (str): The record type
+
+        Returns:
+            bool
+        """
+
+        return not self.types or recType.upper() in self.types
+
+
+    def matchesRow(self, zoneName, recType):
+        """
+        Args:
+            zoneName (str): The zone name
+            recType (str): The record type
+
+        Returns:
+            bool
+        """
+
+        return self.matchesType(recType) and self.matchesZone(zoneName)
+
+
+    def filterZones(self, zoneNames):
+        """
+        Returns the selected zones out of zoneNames
+
+        Args:
+            zoneNames (iterable): Candidate zone names
+
+        Returns:
+            list
+        """
+
+        return [zoneName for zoneName in zoneNames if self.matchesZone(zoneName)]
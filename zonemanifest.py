@@ -0,0 +1,129 @@
+import os
+import json
+
+from recordutils import domainFor, recordAction
+
+
+class ZoneManifest(object):
+    """
+    The zone hashes and rows of the last successful import of a file.
+
+    Stored as json next to the zone data file (ZoneData.csv.manifest),
+    so a later run only has to push the zones whose hash changed, and can
+    remove the answers of rows that left the file since.
+
+    Attributes:
+        filename (str): Path of the manifest
+        hashes (dict): zone name -> hash of the zone block
+        rows (dict): zone name -> [Name, Type, Data] of every pushed row
+    """
+
+
+    def __init__(self, dataFilename):
+        """
+        Args:
+            dataFilename (str): The zone data file the manifest belongs to
+        """
+
+        self.filename = os.path.abspath(dataFilename) + '.manifest'
+        self.hashes = {}
+        self.rows = {}
+
+
+    def load(self):
+        """Loads the manifest, a missing or unreadable manifest is empty"""
+
+        try:
+            with open(self.filename, 'rb') as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            manifest = {}
+        self.hashes = manifest.get('zones', {})
+        self.rows = manifest.get('rows', {})
+        return self
+
+
+    def save(self):
+        """Writes the manifest through a temporary file so it is never half written"""
+
+        tmpFilename = self.filename + '.tmp'
+        with open(tmpFilename, 'wb') as f:
+            json.dump({'zones': self.hashes, 'rows': self.rows}, f)
+        os.rename(tmpFilename, self.filename)
+
+
+    def changed(self, hashes):
+        """
+        Returns the zones whose hash differs from the manifest
+
+        Args:
+            hashes (dict): zone name -> current hash
+
+        Returns:
+            set
+        """
+
+        return {zoneName for zoneName, zoneHash in hashes.iteritems()
+                if self.hashes.get(zoneName) != zoneHash}
+
+
+    def removed(self, hashes):
+        """
+        Returns the zones of the manifest that left the file
+
+        Args:
+            hashes (dict): zone name -> current hash of every zone in the file
+
+        Returns:
+            set
+        """
+
+        return set(self.hashes) - set(hashes)
+
+
+    def _rowKey(self, zoneName, name, recType, data):
+        """Returns the normalized identity of a row, the TTL is not part of it"""
+
+        return domainFor(zoneName, name), recType.upper(), ' '.join(data.split())
+
+
+    def removedRecords(self, zoneName, records):
+        """
+        Returns remove-answers records for the pushed rows of a zone that are
+        no longer part of its records
+
+        Args:
+            zoneName (str): The zone name
+            records (list): The current records of the zone, empty if it left the file
+
+        Returns:
+            list
+        """
+
+        current = {self._rowKey(zoneName, rec['Name'], rec['Type'], rec['Data'])
+                   for rec in records if recordAction(rec) in ('upsert', 'replace-answers')}
+        return [{'Name': name, 'Type': recType, 'TTL': '', 'Data': data, 'Action': 'remove-answers'}
+                for name, recType, data in self.rows.get(zoneName, [])
+                if self._rowKey(zoneName, name, recType, data) not in current]
+
+
+    def update(self, hashes, records, zoneNames):
+        """
+        Stores the current hashes and rows of zoneNames, zones of zoneNames
+        that left the file are forgotten
+
+        Args:
+            hashes (dict): zone name -> current hash of every zone in the file
+            records (dict): zone name -> current records of the zones in the file
+            zoneNames (iterable): The zones that were pushed successfully
+        """
+
+        for zoneName in zoneNames:
+            if zoneName not in hashes:
+                self.hashes.pop(zoneName, None)
+                self.rows.pop(zoneName, None)
+                continue
+            self.hashes[zoneName] = hashes[zoneName]
+            self.rows[zoneName] = [[rec['Name'], rec['Type'], rec['Data']]
+                                   for rec in records[zoneName]
+                                   if recordAction(rec) in ('upsert', 'replace-answers')]
@@ -0,0 +1,156 @@
+import re
+import json
+
+
+class ZoneTemplates(object):
+    """
+    Zone data declared as record set templates applied to lists of zones.
+
+    The json input looks like:
+    {
+        "templates": {
+            "parked": [
+                {"Name": "@", "Type": "A", "TTL": "3600", "Data": "192.0.2.10"},
+                {"Name": "www", "Type": "CNAME", "TTL": "3600", "Data": "{zone}."},
+                {"Name": "@", "Type": "TXT", "TTL": "3600", "Data": "owner={brand}"}
+            ]
+        },
+        "template": "parked",
+        "zones": [
+            "example.com",
+            {"zone": "example.net", "template": "parked", "vars": {"brand": "acme"}}
+        ]
+    }
+
+    A zone given as a plain string uses the default "template". Placeholders
+    like {zone} or {brand} are replaced in every field of the records with
+    the zone name and the vars of the zone, unknown placeholders are left as
+    they are. Zones are expanded one at a time while they are iterated, so
+    the cross product of zones and records is never held in memory.
+
+    Attributes:
+        templates (dict): template name -> list of records
+        defaultTemplate (str): Template of zones that do not name one
+        zones (list): Zone names or zone dicts
+    """
+
+    PLACEHOLDER = re.compile(r'\{(\w+)\}')
+    FIELDS = ('Name', 'Type', 'TTL', 'Data')
+
+
+    def __init__(self, templates, zones, defaultTemplate=None):
+        """
+        Args:
+            templates (dict): template name -> list of records
+            zones (list): Zone names or dicts with zone, template and vars
+            defaultTemplate (str): Template of zones that do not name one
+        """
+
+        self.templates = templates
+        self.zones = zones
+        self.defaultTemplate = defaultTemplate
+        for name, records in self.templates.iteritems():
+            for rec in records:
+                missing = [field for field in self.FIELDS if field not in rec]
+                if missing:
+                    raise ValueError('Template {} has a record without {}'.format(
+                        name, ', '.join(missing)))
+        # checked up front so a bad file fails before the first zone is pushed
+        if defaultTemplate is not None and defaultTemplate not in self.templates:
+            raise ValueError('The default template {} is unknown'.format(defaultTemplate))
+        for zone in self.zones:
+            if not isinstance(zone, (basestring, dict)) or (isinstance(zone, dict) and
+                                                            'zone' not in zone):
+                raise ValueError('Zone entries are names or dicts with a zone: {!r}'.format(zone))
+            zoneName, templateName, zoneVars = self._zoneSpec(zone)
+            if templateName not in self.templates:
+                raise ValueError('Zone {} uses the unknown template {}'.format(zoneName,
+                                                                               templateName))
+
+
+    @classmethod
+    def fromFile(cls, filename):
+        """
+        Reads the templates and zone list of a json file
+
+        Args:
+            filename (str): The json file
+
+        Returns:
+            ZoneTemplates
+        """
+
+        with open(filename, 'rb') as f:
+            spec = json.load(f)
+        return cls(spec.get('templates', {}), spec.get('zones', []), spec.get('template'))
+
+
+    def _zoneSpec(self, zone):
+        """
+        Returns the zone name, template name and vars of one entry of the zone list
+
+        Args:
+            zone (str|dict): A zone name or a zone dict
+
+        Returns:
+            tuple
+        """
+
+        if isinstance(zone, basestring):
+            return zone, self.defaultTemplate, {}
+        return zone['zone'], zone.get('template', self.defaultTemplate), zone.get('vars', {})
+
+
+    def _substitute(self, value, values):
+        """Replaces the known placeholders of value"""
+
+        return self.PLACEHOLDER.sub(lambda match: values.get(match.group(1), match.group(0)),
+                                    value)
+
+
+    def expandZone(self, zoneName, templateName, zoneVars=None, zoneFilter=None):
+        """
+        Returns the records of one zone built from its template
+
+        Args:
+            zoneName (str): The zone name
+            templateName (str): The template applied to the zone
+            zoneVars (dict): Placeholder values of the zone
+            zoneFilter (zonefilter.ZoneFilter): Optional record type selection
+
+        Returns:
+            list
+        """
+
+        if templateName not in self.templates:
+            raise ValueError('Zone {} uses the unknown template {}'.format(zoneName, templateName))
+        values = dict((key, unicode(value)) for key, value in (zoneVars or {}).iteritems())
+        values['zone'] = zoneName
+        records = []
+        for rec in self.templates[templateName]:
+            if zoneFilter is not None and not zoneFilter.matchesType(rec['Type']):
+                continue
+            records.append(dict((field, self._substitute(unicode(rec[field]), values).encode('utf-8'))
+                                for field in self.FIELDS))
+        return records
+
+
+    def expand(self, zoneFilter=None):
+        """
+        Lazily yields the records of every listed zone
+
+        Args:
+            zoneFilter (zonefilter.ZoneFilter): Optional zone and type selection
+
+        Yields:
+            tuple: (zone name, records)
+        """
+
+        for zone in self.zones:
+            zoneName, templateName, zoneVars = self._zoneSpec(zone)
+            zoneName = str(zoneName)
+            if zoneFilter is not None and not zoneFilter.matchesZone(zoneName):
+                continue
+            records = self.expandZone(zoneName, templateName, zoneVars, zoneFilter)
+            if records:
+                yield zoneName, records
@@ -0,0 +1,541 @@
+import os
+import json
+import socket
+import time
+
+from twisted.internet import defer, error, reactor, task
+from twisted.names import dns
+from twisted.names.client import DNSClientFactory
+
+from nsoneimporter import NsoneImporter
+from recordutils import domainFor, recordName
+
+
+class TransferController(object):
+    """
+    Runs one AXFR or IXFR over a tcp connection, like the AXFRController
+    of twisted.names.client, which only knows AXFR.
+
+    Without a serial the whole zone is requested with AXFR. With one an
+    IXFR is sent with the SOA of that serial in the authority section. The
+    server answers with a single SOA if nothing changed, with the changes
+    since the serial, or with the whole zone if it has no history for it.
+
+    Attributes:
+        zoneName (str): The zone to transfer
+        deferred (twisted.internet.defer.Deferred): Fires with the answer records
+        serial (int): The serial of the copy we have, None for a full transfer
+        records (list): The answer records received so far
+        pending (list): Unused, read by DNSClientFactory
+    """
+
+    timeoutCall = None
+
+
+    def __init__(self, zoneName, deferred, serial=None):
+        self.zoneName = zoneName
+        self.deferred = deferred
+        self.serial = serial
+        self.records = []
+        self.pending = []
+
+
+    def connectionMade(self, protocol):
+        """Sends the transfer query"""
+
+        message = dns.Message(protocol.pickID(), recDes=0)
+        if self.serial is None:
+            message.queries = [dns.Query(self.zoneName, dns.AXFR, dns.IN)]
+        else:
+            message.queries = [dns.Query(self.zoneName, dns.IXFR, dns.IN)]
+            message.authority = [dns.RRHeader(self.zoneName, dns.SOA, dns.IN,
+                                              payload=dns.Record_SOA(serial=self.serial))]
+        protocol.writeMessage(message)
+
+
+    def connectionLost(self, protocol):
+        """Fails the transfer if the server closed the connection before the end"""
+
+        self._fail(error.ConnectionLost('Transfer of {} ended after {} records'.format(
+            self.zoneName, len(self.records))))
+
+
+    def connectionFailed(self, reason):
+        """Fails the transfer if the server could not be reached"""
+
+        self._fail(reason)
+
+
+    def messageReceived(self, message, protocol):
+        """Collects the answers of every message until the transfer is complete"""
+
+        if message.rCode != dns.OK:
+            self._fail(IOError('Transfer of {} refused: rcode {}'.format(self.zoneName,
+                                                                          message.rCode)))
+            return
+        self.records.extend(message.answers)
+        if self.records and self._isComplete():
+            self._cancelTimeout()
+            if self.deferred is not None:
+                d, self.deferred = self.deferred, None
+                d.callback(self.records)
+
+
+    def _isComplete(self):
+        """
+        Returns whether the closing SOA was received.
+
+        Every transfer starts with the SOA of the current serial. A full
+        transfer ends with the same SOA. An incremental one, recognized by a
+        second SOA right after the first, repeats it at the start of the last
+        addition sequence and once more at the end.
+        """
+
+        first = self.records[0]
+        if first.type != dns.SOA:
+            self._fail(IOError('Transfer of {} does not start with a SOA'.format(self.zoneName)))
+            return False
+        serial = first.payload.serial
+        if len(self.records) == 1:
+            return self.serial is not None and serial <= self.serial
+        closing = len([rr for rr in self.records[1:]
+                       if rr.type == dns.SOA and rr.payload.serial == serial])
+        incremental = self.serial is not None and self.records[1].type == dns.SOA
+        return closing >= (2 if incremental else 1)
+
+
+    def timedOut(self, connector, seconds):
+        """Gives up on a transfer that takes too long"""
+
+        self.timeoutCall = None
+        connector.disconnect()
+        self._fail(error.TimeoutError('Transfer of {} timed out after {} seconds'.format(
+            self.zoneName, seconds)))
+
+
+    def _cancelTimeout(self):
+        if self.timeoutCall is not None:
+            self.timeoutCall.cancel()
+            self.timeoutCall = None
+
+
+    def _fail(self, reason):
+        """Fails the transfer once"""
+
+        self._cancelTimeout()
+        if self.deferred is not None:
+            d, self.deferred = self.deferred, None
+            d.errback(reason)
+
+
+class TransferFactory(DNSClientFactory):
+    """DNSClientFactory telling the controller when the connection cannot be made"""
+
+    noisy = False
+
+
+    def clientConnectionFailed(self, connector, reason):
+        self.controller.connectionFailed(reason)
+
+
+class ZoneTransfer(object):
+    """
+    Pulls zones from a DNS server with AXFR, or IXFR for zones transferred
+    before, and streams them into an NsoneImporter without going through a csv.
+
+    Up to `concurrency` zones are transferred and imported at the same time.
+    Every transferred zone is handed to the importer as soon as its transfer
+    completes. A full transfer replaces the answers of every record and
+    deletes the records of the transferred types it does not contain. After
+    an incremental one, added records are upserted and deleted records
+    become remove-answers rows.
+
+    The serial of every zone imported without errors is kept in a json state
+    file, so the next run asks for the changes since that serial only.
+
+    Attributes:
+        host (str): The DNS server
+        port (int): The DNS server port
+        zones (list): The zones to transfer
+        apiKey (str|list): The Nsone Api Key or a pool of keys
+        keyRouter (keyrouter.KeyRouter): Routes every zone to one of the api keys
+        zoneFilter (zonefilter.ZoneFilter): Optional record type selection
+        concurrency (int): Transfers running at the same time
+        timeout (float): Seconds one transfer may take
+        stateFilename (str): Json file with the serial of every imported zone, None for AXFR only
+        serials (dict): zone name -> serial of the last imported transfer
+        failedZones (set): Zones that could not be transferred
+    """
+
+    SKIPPED_TYPES = (dns.SOA,)
+    # the types _answerData converts, records of other types in NS1 are never deleted
+    TRANSFERRED_TYPES = ('A', 'AAAA', 'CNAME', 'NS', 'PTR', 'MX', 'SRV', 'TXT', 'SPF')
+
+
+    def __init__(self, server, zones, apiKey, keyRouter=None, zoneFilter=None, concurrency=10,
+                 timeout=60, stateFilename=None):
+        """
+        Args:
+            server (str): host or host:port of the DNS server
+            zones (list): The zones to transfer
+            apiKey (str|list): The Nsone Api Key or a pool of keys
+            keyRouter (keyrouter.KeyRouter): Routing of zones to keys
+            zoneFilter (zonefilter.ZoneFilter): Optional record type selection
+            concurrency (int): Transfers running at the same time
+            timeout (float): Seconds one transfer may take
+            stateFilename (str): Json file keeping the serials for IXFR
+        """
+
+        host, _, port = server.partition(':')
+        self.host = host
+        self.port = int(port or dns.PORT)
+        self.zones = list(zones)
+        self.apiKey = apiKey
+        self.keyRouter = keyRouter
+        self.zoneFilter = zoneFilter
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.stateFilename = stateFilename
+        self.serials = {}
+        self.failedZones = set()
+        self._counts = {'axfr': 0, 'ixfr': 0, 'unchanged': 0, 'skipped': 0, 'fallbacks': 0,
+                        'deleted': 0}
+
+
+    def _loadState(self):
+        """Loads the serials of the last run, a missing state file means AXFR for every zone"""
+
+        if not self.stateFilename:
+            return
+        try:
+            with open(self.stateFilename, 'rb') as f:
+                self.serials = json.load(f).get('serials', {})
+        except (IOError, ValueError):
+            self.serials = {}
+
+
+    def _saveState(self, result):
+        """Writes the serials through a temporary file so it is never half written"""
+
+        if self.stateFilename:
+            tmpFilename = self.stateFilename + '.tmp'
+            with open(tmpFilename, 'wb') as f:
+                json.dump({'serials': self.serials}, f)
+            os.rename(tmpFilename, self.stateFilename)
+        return result
+
+
+    def transfer(self, zoneName):
+        """
+        Transfers one zone, incrementally if its serial is known. An IXFR that
+        is refused or fails is retried as AXFR.
+
+        Args:
+            zoneName (str): The zone name
+
+        Returns:
+            twisted.internet.defer.Deferred: fires with (serial, records, full)
+        """
+
+        serial = self.serials.get(zoneName)
+        d = self._request(zoneName, serial)
+        if serial is not None:
+            d.addErrback(self._fullTransfer, zoneName)
+        return d
+
+
+    def _request(self, zoneName, serial):
+        """
+        Sends one AXFR, or IXFR if serial is given, and collects the answers
+
+        Args:
+            zoneName (str): The zone name
+            serial (int): The serial of the copy we have, None for a full transfer
+
+        Returns:
+            twisted.internet.defer.Deferred: fires with (serial, records, full)
+        """
+
+        d = defer.Deferred()
+        controller = TransferController(zoneName, d, serial)
+        connector = reactor.connectTCP(self.host, self.port,
+                                       TransferFactory(controller, self.timeout))
+        controller.timeoutCall = reactor.callLater(self.timeout, controller.timedOut,
+                                                   connector, self.timeout)
+        d.addBoth(self._disconnect, connector)
+        d.addCallback(self._toRecords, zoneName, serial is not None)
+        return d
+
+
+    def _fullTransfer(self, failure, zoneName):
+        """
+        Retries a failed IXFR as AXFR
+
+        Args:
+            failure (twisted.python.failure)
+            zoneName (str): The zone name
+
+        Returns:
+            twisted.internet.defer.Deferred: fires with (serial, records, full)
+        """
+
+        print 'IXFR of {} failed, falling back to AXFR: {}'.format(zoneName,
+                                                                  failure.getErrorMessage())
+        self._counts['fallbacks'] += 1
+        return self._request(zoneName, None)
+
+
+    def _disconnect(self, result, connector):
+        connector.disconnect()
+        return result
+
+
+    def _toRecords(self, answers, zoneName, incremental):
+        """
+        Turns the answers of a transfer into importer records
+
+        Args:
+            answers (list): The answer records, starting and ending with the SOA
+            zoneName (str): The zone name
+            incremental (bool): Whether an IXFR was sent
+
+        Returns:
+            tuple: (serial, records, whether the whole zone was transferred)
+        """
+
+        serial = answers[0].payload.serial
+        if len(answers) == 1:
+            self._counts['unchanged'] += 1
+            return serial, [], False
+
+        incremental = incremental and answers[1].type == dns.SOA
+        self._counts['ixfr' if incremental else 'axfr'] += 1
+        records = []
+        action = None
+        for rr in answers[1:-1]:
+            if rr.type == dns.SOA:
+                # every SOA of an incremental transfer switches between deletions and additions
+                action = 'upsert' if action == 'remove-answers' else 'remove-answers'
+                continue
+            record = self._toRecord(rr, zoneName)
+            if record is None:
+                continue
+            # a full transfer holds every answer of a record, answers missing from it are stale
+            record['Action'] = action if incremental else 'replace-answers'
+            records.append(record)
+        return serial, records, not incremental
+
+
+    def _toRecord(self, rr, zoneName):
+        """
+        Returns the importer record of one resource record or None if it is skipped.
+        The SOA and the NS records of the apex are managed by NS1.
+
+        Args:
+            rr (twisted.names.dns.RRHeader): The resource record
+            zoneName (str): The zone name
+
+        Returns:
+            dict
+        """
+
+        # names compare without case and trailing dot, servers differ in both
+        name = str(rr.name).rstrip('.').lower()
+        apex = zoneName.rstrip('.').lower()
+        recType = dns.QUERY_TYPES.get(rr.type)
+        if (rr.type in self.SKIPPED_TYPES or (rr.type == dns.NS and name == apex) or
+                recType is None):
+            return None
+        if self.zoneFilter is not None and not self.zoneFilter.matchesType(recType):
+            return None
+        data = self._answerData(rr)
+        if data is None:
+            self._counts['skipped'] += 1
+            return None
+        record = {
+            'Data': data,
+            'Type': recType,
+            'Name': recordName(apex, name),
+            'TTL': str(rr.ttl)
+        }
+        if rr.type in (dns.TXT, dns.SPF):
+            # one answer token per character-string, they may contain spaces
+            record['Answer'] = list(rr.payload.data)
+        return record
+
+
+    def _answerData(self, rr):
+        """Returns the answer of a resource record in the Data format of the csv or None"""
+
+        payload = rr.payload
+        if rr.type == dns.A:
+            return payload.dottedQuad()
+        if rr.type == dns.AAAA:
+            return socket.inet_ntop(socket.AF_INET6, payload.address)
+        if rr.type in (dns.CNAME, dns.NS, dns.PTR):
+            return str(payload.name)
+        if rr.type == dns.MX:
+            return '{} {}'.format(payload.preference, payload.name)
+        if rr.type == dns.SRV:
+            return '{} {} {} {}'.format(payload.priority, payload.weight, payload.port,
+                                        payload.target)
+        if rr.type in (dns.TXT, dns.SPF):
+            return ' '.join(payload.data)
+        return None
+
+
+    def _transferZones(self, importer):
+        """
+        Transfers every zone and hands it to the importer once it arrived
+
+        Args:
+            importer (NsoneImporter): The importer of the run
+
+        Returns:
+            defer.DeferredList
+        """
+
+        semaphore = defer.DeferredSemaphore(self.concurrency)
+        dl = [semaphore.run(self._transferZone, importer, zoneName) for zoneName in self.zones]
+        return defer.DeferredList(dl)
+
+
+    def _transferZone(self, importer, zoneName):
+        """
+        Transfers and imports one zone
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        d = self.transfer(zoneName)
+        d.addCallback(self._transferSuccess, importer, zoneName)
+        d.addErrback(self._transferFailure, zoneName)
+        return d
+
+
+    def _transferSuccess(self, result, importer, zoneName):
+        """
+        Hands the records of a transferred zone to the importer. After a full
+        transfer the records the server no longer serves are deleted.
+
+        Args:
+            result (tuple): (serial, records, full)
+            importer (NsoneImporter): The importer of the run
+            zoneName (str): The zone name
+        """
+
+        serial, records, full = result
+        print 'Transferred {}: serial {}, {} records'.format(zoneName, serial, len(records))
+        if not records and not full:
+            self.serials[zoneName] = serial
+            return None
+        d = importer.importZone(zoneName, records)
+        if d is None:
+            return None
+        if full:
+            d.addCallback(self._deleteStaleRecords, importer, zoneName, records)
+        d.addCallback(self._importSuccess, importer, zoneName, serial)
+        return d
+
+
+    def _deleteStaleRecords(self, result, importer, zoneName, records):
+        """
+        Deletes the records of a zone in NS1 that are missing from its full transfer.
+        Only records of the transferred types are considered, the NS records of
+        the apex are left to NS1 like on import.
+
+        Args:
+            result: The result of the import
+            importer (NsoneImporter): The importer of the run
+            zoneName (str): The zone name
+            records (list): The records of the full transfer
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        nsoneObj = importer.clientFor(zoneName)
+        # the zone was loaded or created by the import, so it lists the records from before it
+        zone = importer.zoneCache.get((importer._keyOf(nsoneObj), zoneName))
+        if zone is None or zoneName in importer.failedZones:
+            return None
+
+        apex = zoneName.rstrip('.').lower()
+        transferred = {(domainFor(apex, rec['Name']), rec['Type']) for rec in records}
+        stale = []
+        for remote in zone.data.get('records', []):
+            domain = remote['domain'].rstrip('.').lower()
+            recType = remote['type'].upper()
+            if (recType not in self.TRANSFERRED_TYPES or (recType == 'NS' and domain == apex) or
+                    (domain, recType) in transferred):
+                continue
+            if self.zoneFilter is not None and not self.zoneFilter.matchesType(recType):
+                continue
+            stale.append({'Name': recordName(apex, domain), 'Type': recType, 'TTL': '', 'Data': '',
+                          'Action': 'delete-record'})
+        if not stale:
+            return None
+        print 'Deleting {} records of {} missing from its transfer'.format(len(stale), zoneName)
+        self._counts['deleted'] += len(stale)
+        return importer.importZone(zoneName, stale)
+
+
+    def _importSuccess(self, result, importer, zoneName, serial):
+        """Remembers the serial of a zone imported without errors"""
+
+        if zoneName not in importer.failedZones:
+            self.serials[zoneName] = serial
+
+
+    def _transferFailure(self, failure, zoneName):
+        """
+        Records a zone whose transfer or import failed
+
+        Args:
+            failure (twisted.python.failure)
+            zoneName (str): The zone name
+        """
+
+        self.failedZones.add(zoneName)
+        print '{}: {}'.format(zoneName, failure.getErrorMessage())
+
+
+    def _reportSummary(self, result, started):
+        """Prints the transfer counts"""
+
+        print 'Transfers from {}:{} in {:.1f}s:'.format(self.host, self.port, time.time() - started)
+        print '  {} full, {} incremental, {} unchanged, {} failed'.format(
+            self._counts['axfr'], self._counts['ixfr'], self._counts['unchanged'],
+            len(self.failedZones))
+        if self._counts['deleted']:
+            print '  {} records missing from full transfers deleted'.format(self._counts['deleted'])
+        if self._counts['fallbacks']:
+            print '  {} incremental transfers retried as full transfers'.format(
+                self._counts['fallbacks'])
+        if self._counts['skipped']:
+            print '  {} records of unsupported types skipped'.format(self._counts['skipped'])
+        return result
+
+
+    def _createImporter(self):
+        """Returns the importer the transferred zones are handed to"""
+
+        return NsoneImporter(self.apiKey, iter([]), False, keyRouter=self.keyRouter)
+
+
+    def _startRequests(self, reactor):
+        """Transfers and imports every zone, then saves the serials"""
+
+        self._loadState()
+        importer = self._createImporter()
+        d = importer.start(self._transferZones)
+        d.addBoth(self._reportSummary, time.time())
+        d.addCallback(self._saveState)
+        return d
+
+
+    def run(self):
+        """Runs the transfers on the reactor and exits once every zone is imported"""
+
+        task.react(self._startRequests)
@@ -0,0 +1,245 @@
+import time
+from collections import OrderedDict
+
+from twisted.internet import defer, task
+
+from nsoneimporter import NsoneImporter
+from recordutils import (actionRuns, answerKey, answerTokens, groupRecords, recordKey,
+                         splitZoneDelete)
+
+
+class ZoneVerifier(object):
+    """
+    Compares the imported zones with what NS1 actually serves.
+
+    Zones are imported by a bounded number of cooperating workers pulling
+    from the data, and every zone is fetched and compared as soon as its own
+    import is done, so a lazily read source is never held in memory as a
+    whole. Zone details carry the short answers of all records, so
+    verification costs one request per zone and not one per record.
+    Expected and remote answers are compared as sets of
+    (domain, type, answer) keys, and TTLs per (domain, type).
+
+    Mismatches are written to a tab separated report and can be imported
+    again right away.
+
+    Attributes:
+        importer (NsoneImporter): The importer pushing the data
+        data (iterable): (zone name, records) tuples to import and verify
+        concurrency (int): Zones imported and verified at the same time
+        reportFilename (str): Where the mismatch report is written, None to skip it
+        requeue (bool): Import the missing records again after verifying
+        mismatches (list): (kind, zone, domain, type, expected, remote) tuples
+        missing (OrderedDict): zone name -> csv records whose answers are missing
+    """
+
+
+    def __init__(self, importer, data, concurrency=20, reportFilename=None, requeue=False):
+        """
+        Args:
+            importer (NsoneImporter): The importer pushing the data
+            data (iterable): (zone name, records) tuples to import and verify
+            concurrency (int): Zones imported and verified at the same time
+            reportFilename (str): Mismatch report file
+            requeue (bool): Import the missing records again
+        """
+
+        self.importer = importer
+        self.data = data
+        self.concurrency = concurrency
+        self.reportFilename = reportFilename
+        self.requeue = requeue
+        self.mismatches = []
+        self.missing = OrderedDict()
+        self.verifiedZones = 0
+
+
+    def _report(self, message):
+        """Reports through the importer so progress ends up in the same place"""
+
+        self.importer._report(message)
+
+
+    def importZones(self, importer):
+        """
+        Imports every zone of the data and verifies it once its import is done.
+        Passed to NsoneImporter.run as the source of the requests.
+
+        Args:
+            importer (NsoneImporter): The importer of the run
+
+        Returns:
+            defer.DeferredList
+        """
+
+        self._started = time.time()
+        work = (self._importZone(importer, zoneName, records) for zoneName, records in self.data)
+        cooperator = task.Cooperator()
+        dl = [cooperator.coiterate(work) for _ in xrange(self.concurrency)]
+        return defer.DeferredList(dl, fireOnOneErrback=True)
+
+
+    def _importZone(self, importer, zoneName, records):
+        """
+        Imports one zone and verifies it afterwards
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        d = importer.importZone(zoneName, records)
+        if d is None:
+            return None
+        d.addCallback(lambda result: self._verifyZone(zoneName, records))
+        return d
+
+
+    def verify(self):
+        """
+        Reports the outcome once every zone was imported and verified.
+        Passed to NsoneImporter.run as the stage after the import.
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        return self._verifyDone(None)
+
+
+    def _verifyZone(self, zoneName, records):
+        """
+        Fetches one zone and compares it with its records
+
+        Args:
+            zoneName (str): The zone name
+            records (list): The records of the zone in the input
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        nsoneObj = self.importer.clientFor(zoneName)
+        deleteZone, records = splitZoneDelete(records)
+        if nsoneObj is None or not records:
+            return None
+        zone = nsoneObj.zones().retrieve(zoneName)
+        zone.addCallback(self._compareZone, zoneName, records)
+        zone.addErrback(self._verifyZoneFailure, zoneName, records)
+        return zone
+
+
+    def _compareZone(self, response, zoneName, records):
+        """
+        Compares the zone details with the expected records
+
+        Args:
+            response (dict): The zone details returned by the api
+            zoneName (str): The zone name
+            records (list): The records of the zone in the input
+        """
+
+        remoteAnswers = set()
+        remoteTtls = {}
+        for rec in response.get('records', []):
+            key = recordKey(rec['domain'], rec['type'])
+            remoteTtls[key] = rec.get('ttl')
+            for answer in rec.get('short_answers', []):
+                remoteAnswers.add(key + (answerKey(answer.split(), key[1]),))
+
+        expected = set()
+        for (domain, recType), group in groupRecords(zoneName, records):
+            # only the last action of a record decides what it should look like
+            action, group = actionRuns(group)[-1]
+            if action not in ('upsert', 'replace-answers'):
+                continue
+            key = (domain, recType)
+            if key not in remoteTtls:
+                self._mismatch('missing-record', zoneName, domain, recType,
+                               len(group), 0, zoneName, group)
+                continue
+            groupExpected = set()
+            for rec in group:
+                answer = key + (answerKey(answerTokens(rec), recType),)
+                groupExpected.add(answer)
+                if answer not in remoteAnswers:
+                    self._mismatch('missing-answer', zoneName, domain, recType,
+                                   rec['Data'], '', zoneName, [rec])
+            expected.update(groupExpected)
+            if str(remoteTtls[key]) != str(group[0]['TTL']).strip():
+                self._mismatch('ttl', zoneName, domain, recType, group[0]['TTL'],
+                               remoteTtls[key])
+
+        # only records of the input are checked for extra answers, records that
+        # were never part of the input are left alone like the importer does
+        expectedRecords = set(answer[:2] for answer in expected)
+        for answer in remoteAnswers - expected:
+            if answer[:2] in expectedRecords:
+                self._mismatch('extra-answer', zoneName, answer[0], answer[1], '',
+                               ' '.join(answer[2]))
+        self.verifiedZones += 1
+
+
+    def _verifyZoneFailure(self, failure, zoneName, records):
+        """
+        Records a zone that could not be fetched, all of its records count as missing
+
+        Args:
+            failure (twisted.python.failure)
+            zoneName (str): The zone name
+            records (list): The records of the zone in the input
+        """
+
+        self._mismatch('missing-zone', zoneName, zoneName, '', len(records),
+                       failure.getErrorMessage(), zoneName, records)
+
+
+    def _mismatch(self, kind, zoneName, domain, recType, expected, remote,
+                  requeueZone=None, requeueRecords=None):
+        """Records one mismatch and the input rows that would fix it"""
+
+        self.mismatches.append((kind, zoneName, domain, recType, expected, remote))
+        if requeueZone is not None:
+            # missing rows are merged in again, whatever their action was
+            self.missing.setdefault(requeueZone, []).extend(
+                dict(rec, Action='upsert') for rec in requeueRecords)
+
+
+    def _writeReport(self):
+        """Writes the mismatches as tab separated lines"""
+
+        with open(self.reportFilename, 'wb') as f:
+            f.write('Kind\tZone\tDomain\tType\tExpected\tRemote\n')
+            for mismatch in self.mismatches:
+                f.write('\t'.join(str(field) for field in mismatch) + '\n')
+        self._report('Wrote verification report: {}'.format(self.reportFilename))
+
+
+    def _verifyDone(self, result):
+        """
+        Reports the outcome and requeues the missing records if asked to
+
+        Returns:
+            twisted.internet.defer.Deferred
+        """
+
+        counts = OrderedDict()
+        for mismatch in self.mismatches:
+            counts[mismatch[0]] = counts.get(mismatch[0], 0) + 1
+        self._report('Verification:')
+        self._report('  Verified {} zones in {:.1f}s'.format(self.verifiedZones,
+                                                             time.time() - self._started))
+        if not counts:
+            self._report('  No mismatches')
+        for kind, count in counts.iteritems():
+            self._report('  {}: {}'.format(kind, count))
+        if self.reportFilename:
+            self._writeReport()
+
+        if self.requeue and self.missing:
+            self._report('Requeueing {} records in {} zones'.format(
+                sum(len(records) for records in self.missing.itervalues()), len(self.missing)))
+            importer = NsoneImporter(self.importer.apiKeys, iter(self.missing.items()), False,
+                                     zoneCache=self.importer.zoneCache,
+                                     keyRouter=self.importer.keyRouter,
+                                     progress=self.importer.progress)
+            return importer.start()
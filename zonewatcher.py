@@ -0,0 +1,185 @@
+import os
+from functools import partial
+
+from twisted.internet import defer, reactor, task, threads
+
+from nsoneimporter import NsoneImporter
+from zonedataparser import ZoneDataParser
+from zonemanifest import ZoneManifest
+
+
+class ZoneWatcher(object):
+    """
+    Watches a zone data file and pushes only the zones whose content changed.
+
+    The file is polled for size and modification time changes. Once a change
+    has settled (two polls in a row see the same state) the file is parsed in
+    a thread, every zone block is hashed and compared with the manifest of the
+    last successful push, and only the changed zones are handed to an importer.
+    Zones that imported without errors are then written to the manifest.
+
+    Rows that left a changed zone since the last push are removed with the
+    remove-answers action, a record left without answers is deleted. A zone
+    that left the file has all of its pushed rows removed, the zone itself
+    is kept, and a zone that no longer exists in NS1 is skipped instead of
+    being created again. Without a manifest of the earlier rows nothing is
+    removed.
+
+    Attributes:
+        filename (str): The zone data file
+        apiKey (str|list): The Nsone Api Key or pool of keys
+        keyRouter (keyrouter.KeyRouter): Routing of zones to keys
+        workers (int): Parser processes
+        zoneFilter (zonefilter.ZoneFilter): Optional zone and type selection
+        interval (float): Seconds between two polls
+        manifest (ZoneManifest): Zone hashes of the last successful push
+        zoneCache (dict): Zone cache kept between pushes
+    """
+
+
+    def __init__(self, filename, apiKey, keyRouter=None, workers=1, zoneFilter=None,
+                 interval=2.0):
+        """
+        Args:
+            filename (str): The zone data file
+            apiKey (str|list): The Nsone Api Key or pool of keys
+            keyRouter (keyrouter.KeyRouter): Routing of zones to keys
+            workers (int): Parser processes
+            zoneFilter (zonefilter.ZoneFilter): Optional zone and type selection
+            interval (float): Seconds between two polls
+        """
+
+        self.filename = filename
+        self.apiKey = apiKey
+        self.keyRouter = keyRouter
+        self.workers = workers
+        self.zoneFilter = zoneFilter
+        self.interval = interval
+        self.manifest = ZoneManifest(filename).load()
+        self.zoneCache = {}
+        self._parser = ZoneDataParser()
+        self._seen = None
+        self._synced = None
+        self._syncing = False
+
+
+    def _stat(self):
+        """Returns the (size, mtime) state of the file or None if it is missing"""
+
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+
+    def _poll(self):
+        """Starts a push once a change of the file has settled"""
+
+        state = self._stat()
+        settled = state == self._seen
+        self._seen = state
+        if state is None or not settled or state == self._synced or self._syncing:
+            return
+        self._sync(state)
+
+
+    def _parse(self):
+        """
+        Parses the file and hashes every zone, runs in a thread
+
+        Returns:
+            tuple: (list of (zone name, records), zone name -> hash)
+        """
+
+        data = list(self._parser.loadZoneData(self.filename, self.workers, self.zoneFilter))
+        hashes = {zoneName: self._parser.zoneHash(records) for zoneName, records in data}
+        return data, hashes
+
+
+    def _removedRecords(self, zoneName, records):
+        """
+        Returns the remove-answers records of the rows that left a zone,
+        leaving out record types the zone filter does not select
+
+        Args:
+            zoneName (str): The zone name
+            records (list): The current records of the zone
+
+        Returns:
+            list
+        """
+
+        return [rec for rec in self.manifest.removedRecords(zoneName, records)
+                if self.zoneFilter is None or self.zoneFilter.matchesRow(zoneName, rec['Type'])]
+
+
+    @defer.inlineCallbacks
+    def _sync(self, state):
+        """
+        Pushes the zones that changed since the last successful push
+
+        Args:
+            state (tuple): The file state the push is based on
+        """
+
+        self._syncing = True
+        try:
+            data, hashes = yield threads.deferToThread(self._parse)
+            changed = self.manifest.changed(hashes)
+            # with a filter, zones missing from the data may only be filtered out
+            removed = self.manifest.removed(hashes) if self.zoneFilter is None else set()
+            if not changed and not removed:
+                print 'No zones changed in {}'.format(self.filename)
+            else:
+                print '{} of {} zones changed, {} removed in {}'.format(
+                    len(changed), len(hashes), len(removed), self.filename)
+                records = dict(data)
+                changedData = [(zoneName, self._removedRecords(zoneName, zoneRecords) + zoneRecords)
+                               for zoneName, zoneRecords in data if zoneName in changed]
+                removedData = [(zoneName, self._removedRecords(zoneName, []))
+                               for zoneName in sorted(removed)]
+                importer = NsoneImporter(self.apiKey, iter(changedData), False,
+                                         zoneCache=self.zoneCache, keyRouter=self.keyRouter)
+                yield importer.start(partial(self._pushZones, changedData=changedData,
+                                             removedData=removedData))
+                pushed = (changed | removed) - importer.failedZones
+                if importer.failedZones:
+                    print '{} zones failed and will be retried on the next change'.format(
+                        len(importer.failedZones))
+                self.manifest.update(hashes, records, pushed)
+            self.manifest.save()
+            self._synced = state
+        except (Exception, SystemExit) as e:
+            print 'Push of {} failed and will be retried: {}'.format(self.filename, e)
+        finally:
+            self._syncing = False
+
+
+    def _pushZones(self, importer, changedData, removedData):
+        """
+        Imports the changed zones and removes the rows of the zones that left
+        the file, passed to NsoneImporter.start as the source of the requests
+
+        Args:
+            importer (NsoneImporter): The importer of the push
+            changedData (list): (zone name, records) of the changed zones
+            removedData (list): (zone name, remove-answers records) of the removed zones
+
+        Returns:
+            defer.DeferredList
+        """
+
+        dl = [importer.importZone(zoneName, records) for zoneName, records in changedData]
+        dl.extend(importer.updateZone(zoneName, records)
+                  for zoneName, records in removedData if records)
+        return defer.DeferredList([d for d in dl if d is not None], fireOnOneErrback=True)
+
+
+    def run(self):
+        """Polls the file until the process is stopped"""
+
+        print 'Watching {} every {}s'.format(self.filename, self.interval)
+        poller = task.LoopingCall(self._poll)
+        poller.start(self.interval)
+        reactor.run()